@@ -0,0 +1,121 @@
+"""
+Benchmark dei backend di embedding di rag_orchestrator: KServe remoto vs in-process.
+
+Lo stesso SentenceTransformer è usato in entrambi i casi: per "kserve" è
+servito da un server locale con il contratto KServe (fakes.py), per "local"
+è chiamato nel thread pool dell'orchestrator. La differenza misurata è quindi
+il costo dell'hop HTTP e della serializzazione; `--network-latency-ms`
+aggiunge la latenza di rete del cluster, assente su loopback.
+
+Per ogni backend e livello di concorrenza riporta query/sec e latenze
+p50/p95/p99 di get_embedding.
+
+Uso:
+    python benchmarks/bench_embedding_backend.py --concurrency 1 8 32 --requests 300
+    python benchmarks/bench_embedding_backend.py --embedding-format f32 --network-latency-ms 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from fakes import ServerThread, create_embedding_app
+from load_test import git_commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+BACKENDS = ("kserve", "local")
+
+
+async def run_level(orchestrator, concurrency: int, total: int) -> dict:
+    latencies = []
+    queries = iter(range(total))
+
+    async def worker():
+        for i in queries:
+            started = time.perf_counter()
+            await orchestrator.get_embedding(f"Domanda di benchmark numero {i} sulla pipeline RAG")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = 1000 * np.array(latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "qps": total / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+async def run_backends(orchestrator, model, args) -> list:
+    results = []
+    print(f"{'backend':>8} {'conc':>5} {'qps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for backend in args.backends:
+        orchestrator.EMBEDDING_BACKEND = backend
+        orchestrator.embedding_model = model if backend == "local" else None
+        await run_level(orchestrator, 1, args.warmup)
+        for concurrency in args.concurrency:
+            level = await run_level(orchestrator, concurrency, args.requests)
+            level["backend"] = backend
+            results.append(level)
+            print(f"{backend:>8} {concurrency:>5} {level['qps']:>9.1f} {level['p50_ms']:>8.2f} "
+                  f"{level['p95_ms']:>8.2f} {level['p99_ms']:>8.2f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend di embedding dell'orchestrator")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=300, help="Query per livello di concorrenza")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--embedding-format", choices=["json", "f32", "f16"], default="json")
+    parser.add_argument("--network-latency-ms", type=float, default=0.0,
+                        help="Latenza aggiunta a ogni chiamata KServe (rete del cluster)")
+    parser.add_argument("--threads", type=int, default=2, help="EMBEDDING_THREADS del backend local")
+    parser.add_argument("--port", type=int, default=18010)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    model = SentenceTransformer(args.model, device="cpu")
+    embedding_app = create_embedding_app(latency_s=args.network_latency_ms / 1000, model=model)
+
+    with ServerThread(embedding_app, args.port) as embedding_server:
+        # La configurazione dell'orchestrator è letta all'import: va impostata prima
+        os.environ["EMBEDDING_SERVICE_URL"] = f"{embedding_server.url}/v1/models/embedding-model:predict"
+        os.environ["EMBEDDING_RESPONSE_FORMAT"] = args.embedding_format
+        os.environ["EMBEDDING_THREADS"] = str(args.threads)
+        os.environ.setdefault("CONTEXT_TOKENIZER", "")
+        sys.path.insert(0, os.path.join(ROOT, "rag_orchestrator"))
+        import rag_orchestrator
+
+        print(f"\n=== Backend di embedding ({args.model}, formato {args.embedding_format}, "
+              f"rete +{args.network_latency_ms}ms) ===")
+        results = asyncio.run(run_backends(rag_orchestrator, model, args))
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", "bench_embedding_backend.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(f"\n✓ Risultati salvati in {output}")
+
+
+if __name__ == "__main__":
+    main()
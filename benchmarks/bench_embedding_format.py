@@ -0,0 +1,52 @@
+"""
+Benchmark del formato di risposta di EmbeddingPredictor: JSON vs binario.
+
+Confronta, per diverse dimensioni di batch, i byte trasferiti e i tempi di
+serializzazione (lato predictor) e decodifica (lato orchestrator).
+
+Uso:
+    python benchmarks/bench_embedding_format.py --dim 384 --batch-sizes 1 32 128
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from rag_pipeline.binary_format import decode_embeddings, encode_embeddings
+
+
+def _timeit(fn, repeat: int) -> float:
+    """Tempo medio (ms) di una chiamata a fn."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return 1000 * (time.perf_counter() - start) / repeat
+
+
+def run(dim: int, batch_sizes, repeat: int):
+    rng = np.random.default_rng(0)
+    print(f"{'batch':>6} {'format':>6} {'bytes':>10} {'ratio':>7} {'encode ms':>10} {'decode ms':>10}")
+    for batch in batch_sizes:
+        embeddings = rng.standard_normal((batch, dim)).astype(np.float32)
+
+        json_payload = json.dumps({"predictions": embeddings.tolist()}).encode()
+        json_encode = _timeit(lambda: json.dumps({"predictions": embeddings.tolist()}).encode(), repeat)
+        json_decode = _timeit(lambda: json.loads(json_payload)["predictions"], repeat)
+        print(f"{batch:>6} {'json':>6} {len(json_payload):>10} {1.0:>7.2f} {json_encode:>10.3f} {json_decode:>10.3f}")
+
+        for fmt in ("f32", "f16"):
+            payload = encode_embeddings(embeddings, fmt)
+            encode_ms = _timeit(lambda: encode_embeddings(embeddings, fmt), repeat)
+            # L'orchestrator passa liste di float a Qdrant: includiamo tolist() nella decodifica
+            decode_ms = _timeit(lambda: decode_embeddings(payload).tolist(), repeat)
+            ratio = len(json_payload) / len(payload)
+            print(f"{batch:>6} {fmt:>6} {len(payload):>10} {ratio:>7.2f} {encode_ms:>10.3f} {decode_ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark formato risposta embedding")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 128, 512])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    run(args.dim, args.batch_sizes, args.repeat)
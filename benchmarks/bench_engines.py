@@ -0,0 +1,73 @@
+"""
+Benchmark dei motori di inferenza di EmbeddingPredictor sulla stessa macchina.
+
+Per ogni motore (torch, onnx, onnx-int8) e dimensione di batch riporta
+texts/sec e latenza p50/p99 di una chiamata a encode.
+
+Uso:
+    python benchmarks/bench_engines.py --engines torch onnx onnx-int8 --batch-sizes 1 32
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "kserve-embedding", "model_server"))
+
+from engines import ENGINES, build_model  # noqa: E402
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+SAMPLE_TEXTS = [
+    "Come si configura il remote DVC su MinIO?",
+    "Quali componenti compongono la pipeline di ingestion dei documenti?",
+    "Retrieval-augmented generation combines a vector search step with a language model "
+    "so that answers are grounded in the indexed documents rather than in model memory alone.",
+    "Qdrant stores points made of a vector and a JSON payload.",
+]
+
+
+def bench_engine(model, batch_size: int, iterations: int, warmup: int):
+    texts = [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] for i in range(batch_size)]
+    for _ in range(warmup):
+        model.encode(texts)
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        model.encode(texts)
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies)
+    return {
+        "texts_per_sec": batch_size * iterations / latencies.sum(),
+        "p50_ms": 1000 * np.percentile(latencies, 50),
+        "p99_ms": 1000 * np.percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark motori di inferenza embedding")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=ENGINES)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--cache-dir", default="/tmp/embedding-engines")
+    args = parser.parse_args()
+
+    print(f"{'engine':>10} {'batch':>6} {'texts/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for engine in args.engines:
+        model = build_model(engine, args.model, args.cache_dir)
+        for batch_size in args.batch_sizes:
+            result = bench_engine(model, batch_size, args.iterations, args.warmup)
+            print(f"{engine:>10} {batch_size:>6} {result['texts_per_sec']:>10.1f} "
+                  f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+        del model
+
+
+if __name__ == "__main__":
+    main()
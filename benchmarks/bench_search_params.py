@@ -0,0 +1,161 @@
+"""
+Benchmark recall/latenza dei parametri di ricerca Qdrant.
+
+Per ogni quantizzazione (none, scalar, binary) crea una collection con
+vettori sintetici a cluster, attende la costruzione dell'indice HNSW e
+misura, per ogni combinazione di hnsw_ef / oversampling / rescore,
+recall@k rispetto alla ricerca esatta in numpy e latenza p50/p95.
+
+Serve un'istanza Qdrant reale: la modalità locale di qdrant-client
+ignora indice HNSW e quantizzazione.
+
+Uso:
+    python benchmarks/bench_search_params.py --qdrant-url http://localhost:6333 --points 100000
+    python benchmarks/bench_search_params.py --quantization scalar --hnsw-ef 32 64 128 --oversampling 1 2 4
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    BinaryQuantization, BinaryQuantizationConfig, CollectionStatus, Distance, HnswConfigDiff,
+    OptimizersConfigDiff, QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig,
+    ScalarType, SearchParams, VectorParams
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUANTIZATIONS = {
+    "none": None,
+    "scalar": ScalarQuantization(
+        scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+    ),
+    "binary": BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True)),
+}
+
+
+def synthetic_vectors(points: int, queries: int, dim: int, clusters: int, seed: int):
+    """Vettori normalizzati raggruppati in cluster (più realistici di rumore uniforme)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    data = centers[rng.integers(0, clusters, points)] + 0.5 * rng.standard_normal((points, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    # Query vicine a punti esistenti, come domande sui documenti indicizzati
+    picks = rng.integers(0, points, queries)
+    query_vectors = data[picks] + 0.3 * rng.standard_normal((queries, dim)).astype(np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return data, query_vectors
+
+
+def ground_truth(data: np.ndarray, queries: np.ndarray, top_k: int) -> np.ndarray:
+    scores = queries @ data.T
+    return np.argsort(-scores, axis=1)[:, :top_k]
+
+
+def build_collection(client: QdrantClient, name: str, quantization: str, data: np.ndarray, args):
+    client.recreate_collection(
+        collection_name=name,
+        vectors_config=VectorParams(size=data.shape[1], distance=Distance.COSINE, on_disk=args.on_disk_vectors),
+        hnsw_config=HnswConfigDiff(m=args.hnsw_m, ef_construct=args.hnsw_ef_construct),
+        quantization_config=QUANTIZATIONS[quantization],
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=1000)
+    )
+    started = time.perf_counter()
+    client.upload_collection(
+        collection_name=name,
+        vectors=data,
+        ids=range(len(data)),
+        batch_size=256,
+        wait=True
+    )
+    while client.get_collection(name).status != CollectionStatus.GREEN:
+        time.sleep(1)
+    print(f"Collection '{name}' ({quantization}) pronta in {time.perf_counter() - started:.1f}s")
+
+
+def bench_params(client: QdrantClient, name: str, queries: np.ndarray, truth: np.ndarray,
+                 params: SearchParams, top_k: int) -> dict:
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = client.search(collection_name=name, query_vector=query.tolist(),
+                                search_params=params, limit=top_k, with_payload=False)
+        latencies.append(time.perf_counter() - started)
+        hits += len({point.id for point in results} & set(expected.tolist()))
+
+    latencies_ms = 1000 * np.array(latencies)
+    return {
+        "recall": hits / truth.size,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recall/latenza dei parametri di ricerca Qdrant")
+    parser.add_argument("--qdrant-url", default="http://localhost:6333")
+    parser.add_argument("--points", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quantization", nargs="+", default=list(QUANTIZATIONS), choices=QUANTIZATIONS)
+    parser.add_argument("--on-disk-vectors", action="store_true")
+    parser.add_argument("--hnsw-m", type=int, default=16)
+    parser.add_argument("--hnsw-ef-construct", type=int, default=100)
+    parser.add_argument("--hnsw-ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0, 4.0])
+    parser.add_argument("--keep", action="store_true", help="Non eliminare le collection di benchmark")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    client = QdrantClient(url=args.qdrant_url)
+    data, queries = synthetic_vectors(args.points, args.queries, args.dim, args.clusters, args.seed)
+    truth = ground_truth(data, queries, args.top_k)
+
+    results = []
+    print(f"{'quant':>7} {'ef':>5} {'overs':>6} {'rescore':>8} {'recall':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for quantization in args.quantization:
+        name = f"bench_search_{quantization}"
+        build_collection(client, name, quantization, data, args)
+
+        # Oversampling e rescore hanno effetto solo con vettori quantizzati
+        if quantization == "none":
+            grid = [(ef, None, None) for ef in args.hnsw_ef]
+        else:
+            grid = list(itertools.product(args.hnsw_ef, args.oversampling, [False, True]))
+
+        for ef, oversampling, rescore in grid:
+            quantization_params = None
+            if oversampling is not None:
+                quantization_params = QuantizationSearchParams(oversampling=oversampling, rescore=rescore)
+            params = SearchParams(hnsw_ef=ef, quantization=quantization_params)
+            result = bench_params(client, name, queries, truth, params, args.top_k)
+            result.update({"quantization": quantization, "hnsw_ef": ef,
+                           "oversampling": oversampling, "rescore": rescore})
+            results.append(result)
+            print(f"{quantization:>7} {ef:>5} {oversampling or '-':>6} {str(rescore if rescore is not None else '-'):>8} "
+                  f"{result['recall']:>8.3f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}")
+
+        if not args.keep:
+            client.delete_collection(name)
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", "bench_search_params.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(f"\n✓ Risultati salvati in {output}")
+
+
+if __name__ == "__main__":
+    main()
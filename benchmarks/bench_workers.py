@@ -0,0 +1,132 @@
+"""
+Benchmark del pool di worker di EmbeddingPredictor: throughput vs numero di worker.
+
+Il modello è caricato una volta e condiviso con i worker (worker_pool.py);
+per ogni numero di worker, `--concurrency` client inviano batch piccoli
+(come le query) e si misurano texts/sec, latenza p50/p99 e memoria dei
+worker (PSS: le pagine condivise sono ripartite tra i processi, quindi la
+somma mostra se i pesi vengono davvero condivisi).
+
+Uso:
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --batch-size 1 --concurrency 32
+    python benchmarks/bench_workers.py --workers 1 4 --threads-per-worker 2 --pin-cpus
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "kserve-embedding", "model_server"))
+
+from engines import PROBE_TEXTS  # noqa: E402
+from load_test import git_commit  # noqa: E402
+from sentence_transformers import SentenceTransformer  # noqa: E402
+from worker_pool import WorkerPool  # noqa: E402
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def memory_mb(pid: int) -> float:
+    """PSS del processo in MB (solo Linux, NaN altrove)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def bench_pool(pool: WorkerPool, batch_size: int, concurrency: int, total: int) -> dict:
+    batches = iter(range(total))
+    lock = threading.Lock()
+    latencies = []
+
+    def client():
+        while True:
+            with lock:
+                i = next(batches, None)
+            if i is None:
+                return
+            texts = [f"{PROBE_TEXTS[(i + j) % len(PROBE_TEXTS)]} #{i}" for j in range(batch_size)]
+            started = time.perf_counter()
+            pool.encode(texts)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = 1000 * np.array(latencies)
+    return {
+        "texts_per_sec": total * batch_size / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark throughput del pool di worker di embedding")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Default: CPU disponibili / numero di worker")
+    parser.add_argument("--pin-cpus", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=1, help="Testi per richiesta")
+    parser.add_argument("--concurrency", type=int, default=32, help="Client concorrenti")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    model = SentenceTransformer(args.model, device="cpu")
+    cpus = os.cpu_count() or 1
+
+    results = []
+    print(f"{'workers':>8} {'threads':>8} {'texts/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'PSS MB':>8}")
+    for workers in args.workers:
+        threads = args.threads_per_worker or max(1, cpus // workers)
+        pool = WorkerPool(workers, threads, model=model, pin_cpus=args.pin_cpus, warmup_texts=PROBE_TEXTS)
+        pool.start()
+        try:
+            bench_pool(pool, args.batch_size, args.concurrency, args.warmup)
+            result = bench_pool(pool, args.batch_size, args.concurrency, args.requests)
+            result.update({
+                "workers": workers,
+                "threads_per_worker": threads,
+                "workers_pss_mb": sum(memory_mb(w["pid"]) for w in pool.stats().values()),
+            })
+        finally:
+            pool.close()
+        results.append(result)
+        print(f"{workers:>8} {threads:>8} {result['texts_per_sec']:>10.1f} {result['p50_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f} {result['workers_pss_mb']:>8.1f}")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", "bench_workers.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "cpu_count": cpus,
+            "config": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(f"\n✓ Risultati salvati in {output}")
+
+
+if __name__ == "__main__":
+    main()
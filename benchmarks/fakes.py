@@ -0,0 +1,181 @@
+"""
+Sostituti locali dei servizi esterni usati dal percorso di query.
+
+- server di embedding che parla il contratto KServe {"instances"} -> {"predictions"}
+- LLM stub compatibile con /v1/chat/completions (anche in streaming) con latenza configurabile
+- collection Qdrant in memoria (local mode) popolata con chunk sintetici
+- modello di embedding in-process per rag_api_local
+
+Gli embeddings sono deterministici (seed dall'hash del testo) così che
+run diversi producano lo stesso carico.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from typing import List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from rag_pipeline.binary_format import encode_embeddings, requested_format
+
+EMBEDDING_DIM = 384
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeEmbeddingModel:
+    """Sostituto di SentenceTransformer per rag_api_local."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, latency_s: float = 0.0):
+        self.dim = dim
+        self.latency_s = latency_s
+
+    def encode(self, texts, **kwargs):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if isinstance(texts, str):
+            return fake_embedding(texts, self.dim)
+        return np.stack([fake_embedding(text, self.dim) for text in texts])
+
+
+def create_embedding_app(dim: int = EMBEDDING_DIM, latency_s: float = 0.0, model=None) -> FastAPI:
+    """Con `model` (es. SentenceTransformer) serve embeddings reali con lo stesso contratto."""
+    app = FastAPI(title="Fake embedding service")
+
+    @app.post("/v1/models/{model_name}:predict")
+    async def predict(model_name: str, request: Request):
+        body = await request.json()
+        texts = body["instances"]
+        if isinstance(texts, str):
+            texts = [texts]
+        if latency_s:
+            await asyncio.sleep(latency_s)
+        if model is not None:
+            embeddings = model.encode(texts)
+        else:
+            embeddings = np.stack([fake_embedding(text, dim) for text in texts])
+
+        fmt = requested_format(dict(request.headers))
+        if fmt != "json":
+            return Response(content=encode_embeddings(embeddings, fmt), media_type="application/octet-stream")
+        return {"predictions": embeddings.tolist()}
+
+    return app
+
+
+def create_llm_app(latency_s: float = 0.5, tokens: int = 32) -> FastAPI:
+    """LLM stub: `latency_s` è il tempo totale di generazione, distribuito sui token."""
+    app = FastAPI(title="Stub LLM")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        words = [f"tok{i} " for i in range(tokens)]
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency_s)
+            return {
+                "id": "stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(words)}}],
+            }
+
+        async def events():
+            for word in words:
+                await asyncio.sleep(latency_s / tokens)
+                chunk = {
+                    "id": "stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def synthetic_chunks(n_points: int) -> List[dict]:
+    return [
+        {
+            "source": f"doc_{i // 20}.pdf",
+            "chunk_id": i % 20,
+            "content": f"Chunk sintetico {i}. " + "Lorem ipsum dolor sit amet. " * 30,
+        }
+        for i in range(n_points)
+    ]
+
+
+def seed_collection(client, collection_name: str, n_points: int, dim: int = EMBEDDING_DIM):
+    """Crea e popola una collection (QdrantClient sincrono, anche in local mode)."""
+    from qdrant_client.models import Distance, PointStruct, VectorParams
+
+    client.recreate_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+    )
+    chunks = synthetic_chunks(n_points)
+    for start in range(0, n_points, 256):
+        batch = chunks[start:start + 256]
+        client.upsert(
+            collection_name=collection_name,
+            points=[
+                PointStruct(id=start + i, vector=fake_embedding(chunk["content"], dim).tolist(), payload=chunk)
+                for i, chunk in enumerate(batch)
+            ],
+        )
+
+
+async def seed_collection_async(client, collection_name: str, n_points: int, dim: int = EMBEDDING_DIM):
+    """Come seed_collection, per AsyncQdrantClient."""
+    from qdrant_client.models import Distance, PointStruct, VectorParams
+
+    await client.recreate_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+    )
+    chunks = synthetic_chunks(n_points)
+    for start in range(0, n_points, 256):
+        batch = chunks[start:start + 256]
+        await client.upsert(
+            collection_name=collection_name,
+            points=[
+                PointStruct(id=start + i, vector=fake_embedding(chunk["content"], dim).tolist(), payload=chunk)
+                for i, chunk in enumerate(batch)
+            ],
+        )
+
+
+class ServerThread:
+    """Esegue un'app ASGI con uvicorn in un thread in background."""
+
+    def __init__(self, app, port: int):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
@@ -0,0 +1,241 @@
+"""
+Load test offline del percorso di query di rag_orchestrator o rag_api_local.
+
+Avvia in-process i sostituti locali (fakes.py): servizio di embedding KServe,
+LLM stub con latenza configurabile e collection Qdrant in memoria. Poi
+misura, per ogni livello di concorrenza, richieste/sec e latenze p50/p95/p99
+(più il time-to-first-token per /query/stream). Uno stream con un evento
+`error` o senza l'evento finale `done` conta come errore e la sua latenza
+è esclusa dai percentili.
+
+I risultati sono salvati in JSON (con il commit corrente) e possono essere
+confrontati con un run precedente tramite --compare.
+
+Dipendenze: pip install -r benchmarks/requirements.txt (make benchmark-deps).
+
+Uso:
+    python benchmarks/load_test.py --target orchestrator --concurrency 1 8 32 --requests 200
+    python benchmarks/load_test.py --target local --endpoint stream --compare benchmarks/results/prev.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+import httpx
+import numpy as np
+
+from fakes import (FakeEmbeddingModel, ServerThread, create_embedding_app, create_llm_app,
+                   seed_collection, seed_collection_async)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLLECTION_NAME = "documents"
+
+ENDPOINTS = {
+    "query": "/query",
+    "stream": "/query/stream",
+}
+
+
+def setup_orchestrator(args, embedding_url: str, llm_url: str):
+    # La configurazione del servizio è letta all'import: va impostata prima
+    os.environ["EMBEDDING_SERVICE_URL"] = f"{embedding_url}/v1/models/embedding-model:predict"
+    os.environ["EMBEDDING_RESPONSE_FORMAT"] = args.embedding_format
+    os.environ["HF_CHAT_URL"] = f"{llm_url}/v1/chat/completions"
+    os.environ["COLLECTION_NAME"] = COLLECTION_NAME
+    # Offline: conteggio dei token del contesto senza scaricare il tokenizer
+    os.environ.setdefault("CONTEXT_TOKENIZER", "")
+    if not args.semantic_cache:
+        os.environ["SEMANTIC_CACHE_MAX_ENTRIES"] = "0"
+
+    sys.path.insert(0, os.path.join(ROOT, "rag_orchestrator"))
+    import rag_orchestrator
+    from qdrant_client import AsyncQdrantClient
+
+    client = AsyncQdrantClient(location=":memory:")
+    asyncio.run(seed_collection_async(client, COLLECTION_NAME, args.points))
+    rag_orchestrator.qdrant_client = client
+    return rag_orchestrator.app
+
+
+def setup_local(args, embedding_url: str, llm_url: str):
+    os.environ.setdefault("CONTEXT_TOKENIZER", "")
+    sys.path.insert(0, ROOT)
+    import rag_api_local
+    from huggingface_hub import InferenceClient
+    from qdrant_client import QdrantClient
+
+    client = QdrantClient(location=":memory:")
+    seed_collection(client, COLLECTION_NAME, args.points)
+    rag_api_local.qdrant_client = client
+    rag_api_local.embedding_model = FakeEmbeddingModel(latency_s=args.embedding_latency_ms / 1000)
+    rag_api_local.hf_client = InferenceClient(base_url=llm_url, token="fake")
+    return rag_api_local.app
+
+
+class StreamError(Exception):
+    """Stream SSE concluso con un evento `error` o senza l'evento `done`."""
+
+
+async def read_stream(response: httpx.Response) -> Optional[float]:
+    """Consuma gli eventi SSE e restituisce l'istante del primo token (None se assente)."""
+    first_token = None
+    event = None
+    done = False
+    async for line in response.aiter_lines():
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+            if event == "token" and first_token is None:
+                first_token = time.perf_counter()
+            elif event == "done":
+                done = True
+        elif line.startswith("data:") and event == "error":
+            raise StreamError(line[len("data:"):].strip())
+        elif not line:
+            event = None
+    if not done:
+        raise StreamError("stream terminato senza evento done")
+    return first_token
+
+
+async def run_level(base_url: str, endpoint: str, concurrency: int, total: int, top_k: int) -> dict:
+    latencies, ttfts = [], []
+    errors = 0
+    requests = iter(range(total))
+    stream = endpoint == "stream"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=300) as client:
+
+        async def worker():
+            nonlocal errors
+            for i in requests:
+                payload = {"query": f"Domanda di benchmark numero {i}", "top_k": top_k}
+                started = time.perf_counter()
+                try:
+                    first_token = None
+                    if stream:
+                        async with client.stream("POST", ENDPOINTS[endpoint], json=payload) as response:
+                            response.raise_for_status()
+                            first_token = await read_stream(response)
+                    else:
+                        response = await client.post(ENDPOINTS[endpoint], json=payload)
+                        response.raise_for_status()
+                except Exception:
+                    errors += 1
+                    continue
+                # Solo le richieste riuscite entrano nei percentili
+                latencies.append(time.perf_counter() - started)
+                if first_token is not None:
+                    ttfts.append(first_token - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    latencies_ms = 1000 * np.array(latencies or [np.nan])
+    result = {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+    if stream and ttfts:
+        ttfts_ms = 1000 * np.array(ttfts)
+        result["ttft_p50_ms"] = float(np.percentile(ttfts_ms, 50))
+        result["ttft_p95_ms"] = float(np.percentile(ttfts_ms, 95))
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(previous_file: str, previous_results: list, results: list):
+    previous = {level["concurrency"]: level for level in previous_results}
+
+    print(f"\nConfronto con {previous_file}:")
+    for level in results:
+        old = previous.get(level["concurrency"])
+        if not old:
+            continue
+        rps_delta = 100 * (level["rps"] - old["rps"]) / old["rps"] if old["rps"] else float("nan")
+        p95_delta = 100 * (level["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else float("nan")
+        print(f"  c={level['concurrency']:>4}  rps {old['rps']:.1f} -> {level['rps']:.1f} ({rps_delta:+.1f}%)  "
+              f"p95 {old['p95_ms']:.1f} -> {level['p95_ms']:.1f} ms ({p95_delta:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test offline del percorso di query RAG")
+    parser.add_argument("--target", choices=["orchestrator", "local"], default="orchestrator")
+    parser.add_argument("--endpoint", choices=list(ENDPOINTS), default="query")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=200, help="Richieste per livello di concorrenza")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--points", type=int, default=2000, help="Chunk sintetici nella collection")
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-tokens", type=int, default=32)
+    parser.add_argument("--embedding-latency-ms", type=float, default=2)
+    parser.add_argument("--embedding-format", choices=["json", "f32", "f16"], default="json")
+    parser.add_argument("--semantic-cache", action="store_true", help="Lascia attiva la cache semantica")
+    parser.add_argument("--port", type=int, default=18000, help="Porta base per i server locali")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="File JSON di un run precedente")
+    args = parser.parse_args()
+
+    # Letto prima di eseguire: --compare può coincidere con il file di output
+    previous_results = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous_results = json.load(f)["results"]
+
+    embedding_app = create_embedding_app(latency_s=args.embedding_latency_ms / 1000)
+    llm_app = create_llm_app(latency_s=args.llm_latency_ms / 1000, tokens=args.llm_tokens)
+
+    with ServerThread(embedding_app, args.port + 1) as embedding_server, \
+            ServerThread(llm_app, args.port + 2) as llm_server:
+        setup = setup_orchestrator if args.target == "orchestrator" else setup_local
+        app = setup(args, embedding_server.url, llm_server.url)
+
+        with ServerThread(app, args.port) as service:
+            print(f"\n=== Load test {args.target} {ENDPOINTS[args.endpoint]} "
+                  f"(llm={args.llm_latency_ms}ms, points={args.points}) ===")
+            asyncio.run(run_level(service.url, args.endpoint, 1, args.warmup, args.top_k))
+
+            results = []
+            print(f"{'conc':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+            for concurrency in args.concurrency:
+                level = asyncio.run(run_level(service.url, args.endpoint, concurrency, args.requests, args.top_k))
+                results.append(level)
+                print(f"{concurrency:>5} {level['rps']:>8.1f} {level['p50_ms']:>9.1f} "
+                      f"{level['p95_ms']:>9.1f} {level['p99_ms']:>9.1f} {level['errors']:>7}")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"load_test_{args.target}_{args.endpoint}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(f"\n✓ Risultati salvati in {output}")
+
+    if previous_results is not None:
+        compare(args.compare, previous_results, results)
+
+
+if __name__ == "__main__":
+    main()
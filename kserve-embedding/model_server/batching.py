@@ -0,0 +1,172 @@
+"""
+Micro-batching dinamico per EmbeddingPredictor.
+
+Le richieste concorrenti vengono accodate e unite in un'unica chiamata
+a `encode`, entro un limite di testi per batch (max_batch_size) e un tempo
+massimo di attesa in coda (max_wait_ms). I risultati vengono poi
+ridistribuiti a ciascun chiamante.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import numpy as np
+from prometheus_client import Histogram
+
+# Metriche esposte sull'endpoint /metrics del ModelServer KServe
+BATCH_SIZE_HIST = Histogram(
+    "embedding_batch_size",
+    "Numero di testi per chiamata a encode",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+QUEUE_WAIT_HIST = Histogram(
+    "embedding_queue_wait_seconds",
+    "Tempo trascorso in coda prima dell'encode",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+# Ogni quanti batch stampare un riepilogo delle statistiche
+STATS_LOG_EVERY = 500
+
+
+@dataclass
+class _PendingRequest:
+    texts: List[str]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatcher:
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 max_concurrent_batches: int = 1):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        # Batch in esecuzione contemporaneamente: 1 con un solo modello, N con
+        # il pool di N worker (worker_pool.py). I thread dedicati possono essere
+        # avviati da warmup() prima dell'arrivo delle richieste
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_batches, thread_name_prefix="encode")
+        self._slots: Optional[asyncio.Semaphore] = None
+        # Riferimenti ai batch in esecuzione (evita che i task siano raccolti dal GC)
+        self._running = set()
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Richiesta estratta dalla coda che non entrava nel batch precedente
+        self._carry: Optional[_PendingRequest] = None
+
+        # Statistiche cumulative (per stats())
+        self._batches = 0
+        self._texts = 0
+        self._max_batch = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._requests = 0
+
+    def _ensure_started(self):
+        # La coda va creata dentro l'event loop del ModelServer
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def warmup(self, texts: List[str]) -> np.ndarray:
+        """Esegue encode nel thread dei batch (sincrono, da chiamare prima di servire)."""
+        return self._executor.submit(self.encode_fn, texts).result()
+
+    async def submit(self, texts: List[str]) -> np.ndarray:
+        """Accoda i testi e attende i relativi embeddings."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingRequest(texts=texts, future=future))
+        return await future
+
+    async def _next_batch(self) -> List[_PendingRequest]:
+        first = self._carry or await self._queue.get()
+        self._carry = None
+
+        batch = [first]
+        size = len(first.texts)
+        deadline = first.enqueued_at + self.max_wait
+
+        while size < self.max_batch_size:
+            if self._queue.empty():
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self._queue.get_nowait()
+
+            if size + len(item.texts) > self.max_batch_size:
+                # Non entra: verrà servita per prima nel prossimo batch
+                self._carry = item
+                break
+            batch.append(item)
+            size += len(item.texts)
+
+        return batch
+
+    async def _run(self):
+        while True:
+            # Il batch successivo si forma mentre quelli in corso occupano gli slot
+            await self._slots.acquire()
+            batch = await self._next_batch()
+            task = asyncio.get_running_loop().create_task(self._execute(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, batch: List[_PendingRequest]):
+        started = time.perf_counter()
+        texts = [text for item in batch for text in item.texts]
+
+        for item in batch:
+            wait = started - item.enqueued_at
+            QUEUE_WAIT_HIST.observe(wait)
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        BATCH_SIZE_HIST.observe(len(texts))
+        self._batches += 1
+        self._requests += len(batch)
+        self._texts += len(texts)
+        self._max_batch = max(self._max_batch, len(texts))
+
+        try:
+            # encode è CPU-bound: lo eseguiamo fuori dall'event loop
+            embeddings = await asyncio.get_running_loop().run_in_executor(self._executor, self.encode_fn, texts)
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        offset = 0
+        for item in batch:
+            end = offset + len(item.texts)
+            if not item.future.done():
+                item.future.set_result(embeddings[offset:end])
+            offset = end
+
+        if self._batches % STATS_LOG_EVERY == 0:
+            print(f"Batching stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        """Riepilogo per il tuning di max_batch_size e max_wait_ms."""
+        return {
+            "batches": self._batches,
+            "requests": self._requests,
+            "texts": self._texts,
+            "avg_batch_size": self._texts / self._batches if self._batches else 0.0,
+            "max_batch_size_seen": self._max_batch,
+            "avg_queue_wait_ms": 1000 * self._wait_total / self._requests if self._requests else 0.0,
+            "max_queue_wait_ms": 1000 * self._wait_max,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+        }
@@ -0,0 +1,93 @@
+"""
+Cache LRU in-process degli embeddings per EmbeddingPredictor.
+
+La chiave è l'hash di (namespace, testo), dove il namespace identifica
+modello, revisione dei pesi e motore di inferenza; ogni testo di un batch viene
+cercato separatamente così che solo i miss arrivino a `encode`.
+L'eviction avviene per numero di voci e per budget di memoria (byte).
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+CACHE_HITS = Counter("embedding_cache_hits", "Testi serviti dalla cache")
+CACHE_MISSES = Counter("embedding_cache_misses", "Testi non presenti in cache")
+CACHE_EVICTIONS = Counter("embedding_cache_evictions", "Voci rimosse per rispettare i limiti")
+CACHE_ENTRIES = Gauge("embedding_cache_entries", "Voci attualmente in cache")
+CACHE_BYTES = Gauge("embedding_cache_bytes", "Memoria stimata occupata dalla cache")
+
+# Overhead stimato per voce (chiave, nodo dell'OrderedDict, header ndarray)
+_ENTRY_OVERHEAD = 200
+
+
+class EmbeddingCache:
+    def __init__(self, namespace: str, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.namespace}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Restituisce l'embedding in cache per ogni testo (None se assente)."""
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self._key(text)
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                results.append(vector)
+
+        hits = sum(vector is not None for vector in results)
+        self.hits += hits
+        self.misses += len(texts) - hits
+        CACHE_HITS.inc(hits)
+        CACHE_MISSES.inc(len(texts) - hits)
+        return results
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        with self._lock:
+            for text, vector in zip(texts, embeddings):
+                key = self._key(text)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    continue
+                # Copia: evita di trattenere in memoria l'intera matrice del batch
+                vector = np.array(vector, copy=True)
+                self._entries[key] = vector
+                self._bytes += vector.nbytes + _ENTRY_OVERHEAD
+            self._evict()
+            CACHE_ENTRIES.set(len(self._entries))
+            CACHE_BYTES.set(self._bytes)
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, vector = self._entries.popitem(last=False)
+            self._bytes -= vector.nbytes + _ENTRY_OVERHEAD
+            self.evictions += 1
+            CACHE_EVICTIONS.inc()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,92 @@
+"""
+Motori di inferenza selezionabili per EmbeddingPredictor (CPU).
+
+    torch      SentenceTransformer PyTorch (comportamento originale)
+    onnx       grafo ONNX eseguito con ONNX Runtime
+    onnx-int8  grafo ONNX con quantizzazione dinamica int8
+
+Tutti i motori restituiscono un SentenceTransformer, quindi `encode`
+mantiene lo stesso contratto (pooling e normalizzazione inclusi).
+"""
+import os
+from typing import List
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+ENGINES = ("torch", "onnx", "onnx-int8")
+
+# Distanza coseno massima ammessa rispetto al modello PyTorch di riferimento
+DEFAULT_TOLERANCES = {
+    "onnx": 1e-4,
+    "onnx-int8": 2e-2,
+}
+
+# Testi di controllo usati per validare il modello esportato all'avvio
+PROBE_TEXTS = [
+    "What is retrieval-augmented generation?",
+    "Qdrant è un database vettoriale open source.",
+    "The quick brown fox jumps over the lazy dog.",
+    "Kubeflow Pipelines orchestra i componenti di ingestion su Kubernetes.",
+    "a",
+]
+
+INT8_FILE_SUFFIX = "int8"
+
+
+def build_model(engine: str, model_name: str, cache_dir: str) -> SentenceTransformer:
+    """Costruisce il modello per il motore richiesto."""
+    if engine not in ENGINES:
+        raise ValueError(f"Motore di inferenza non supportato: {engine} (disponibili: {', '.join(ENGINES)})")
+
+    if engine == "torch":
+        return SentenceTransformer(model_name, device="cpu")
+
+    if engine == "onnx":
+        # Usa il grafo ONNX pubblicato con il modello o lo esporta al volo
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+
+    # onnx-int8: esporta una volta in cache_dir e quantizza dinamicamente i pesi
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    local_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+    int8_file = os.path.join("onnx", f"model_{INT8_FILE_SUFFIX}.onnx")
+    if not os.path.exists(os.path.join(local_dir, int8_file)):
+        print(f"Quantizzazione int8 di {model_name} in {local_dir}...")
+        onnx_model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+        onnx_model.save(local_dir)
+        export_dynamic_quantized_onnx_model(
+            onnx_model,
+            quantization_config="avx2",
+            model_name_or_path=local_dir,
+            file_suffix=INT8_FILE_SUFFIX,
+        )
+    return SentenceTransformer(local_dir, device="cpu", backend="onnx", model_kwargs={"file_name": int8_file})
+
+
+def max_cosine_distance(reference: np.ndarray, candidate: np.ndarray) -> float:
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return float(np.max(1.0 - np.sum(reference * candidate, axis=1)))
+
+
+def verify_against_reference(model: SentenceTransformer, engine: str, model_name: str,
+                             tolerance: float, probe_texts: List[str] = PROBE_TEXTS) -> float:
+    """
+    Confronta gli embeddings del motore con il modello PyTorch di riferimento.
+    Solleva RuntimeError se la distanza supera la tolleranza (fail fast all'avvio).
+    """
+    reference_model = SentenceTransformer(model_name, device="cpu")
+    reference = reference_model.encode(probe_texts)
+    del reference_model
+
+    candidate = model.encode(probe_texts)
+    if candidate.shape != reference.shape:
+        raise RuntimeError(f"Motore '{engine}': shape {candidate.shape} diversa dal riferimento {reference.shape}")
+
+    distance = max_cosine_distance(reference, candidate)
+    if distance > tolerance:
+        raise RuntimeError(
+            f"Motore '{engine}': distanza coseno {distance:.2e} oltre la tolleranza {tolerance:.2e}"
+        )
+    return distance
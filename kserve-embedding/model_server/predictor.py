@@ -1,26 +1,200 @@
+import os
+import time
+import hashlib
+import asyncio
+import functools
 import kserve
-from typing import Dict
+from typing import Dict, List, Union
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from prometheus_client import Gauge
+from rag_pipeline.binary_format import encode_embeddings, requested_format
+from rag_pipeline.startup_timing import record_startup_phase, startup_phase
+
+from batching import MicroBatcher
+from embedding_cache import EmbeddingCache
+from engines import DEFAULT_TOLERANCES, PROBE_TEXTS, build_model, verify_against_reference
+from worker_pool import WorkerPool
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Snapshot locale del modello (pre-caricato nell'immagine): se impostato,
+# il modello viene letto da qui senza contattare l'hub
+MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")
+
+# --- CONFIGURAZIONE MOTORE DI INFERENZA ---
+# "torch" (default), "onnx" oppure "onnx-int8"
+ENGINE = os.getenv("EMBEDDING_ENGINE", "torch").lower()
+# Distanza coseno massima rispetto al modello PyTorch (vuoto = default del motore)
+ENGINE_TOLERANCE = os.getenv("EMBEDDING_ENGINE_TOLERANCE")
+# Directory in cui salvare i grafi ONNX quantizzati
+ENGINE_CACHE_DIR = os.getenv("EMBEDDING_ENGINE_CACHE_DIR", "/tmp/embedding-engines")
+
+# --- CONFIGURAZIONE WORKER ---
+# Repliche del modello in processi separati (1 = modello nel processo del server)
+WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+# Thread intra-op di ciascun worker e assegnazione di CPU dedicate
+THREADS_PER_WORKER = int(os.getenv("EMBEDDING_THREADS_PER_WORKER", str(max(1, (os.cpu_count() or 1) // max(WORKERS, 1)))))
+PIN_CPUS = os.getenv("EMBEDDING_PIN_CPUS", "false").lower() in ("1", "true", "yes")
+# Riavvii massimi dei worker terminati; senza worker attivi il predictor non è pronto
+WORKER_MAX_RESTARTS = int(os.getenv("EMBEDDING_WORKER_MAX_RESTARTS", "3"))
+
+# --- CONFIGURAZIONE MICRO-BATCHING ---
+# Numero massimo di testi uniti in una singola chiamata a encode (<= 1 disabilita il batching)
+MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+# Attesa massima in coda (ms) prima di eseguire un batch incompleto
+MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+
+# --- CONFIGURAZIONE CACHE ---
+# Voci massime in cache (0 disabilita la cache) e budget di memoria in MB
+CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "64"))
+
+# --- CONFIGURAZIONE WARM-UP ---
+# Testi per batch di warm-up (0 = disabilitato) e ripetizioni, eseguiti prima
+# di dichiarare il modello pronto
+WARMUP_BATCH_SIZE = int(os.getenv("EMBEDDING_WARMUP_BATCH_SIZE", str(max(MAX_BATCH_SIZE, 1))))
+WARMUP_ROUNDS = int(os.getenv("EMBEDDING_WARMUP_ROUNDS", "3"))
+
+STARTUP_PHASE_SECONDS = Gauge(
+    "embedding_startup_phase_seconds",
+    "Durata delle fasi di avvio del predictor",
+    ["phase"],
+)
+
+def model_revision(source: str) -> str:
+    """Revisione dei pesi: fingerprint dei file di uno snapshot locale o commit dello snapshot dell'hub."""
+    if os.path.isdir(source):
+        digest = hashlib.blake2b(digest_size=8)
+        for root, _, names in sorted(os.walk(source)):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, source)}:{stat.st_size}:{stat.st_mtime_ns}\0".encode("utf-8"))
+        return digest.hexdigest()
+    try:
+        from huggingface_hub import snapshot_download
+        return os.path.basename(snapshot_download(source, local_files_only=True))
+    except Exception:
+        return "unknown"
 
 class EmbeddingPredictor(kserve.Model):
     def __init__(self, name: str):
         super().__init__(name)
         self.name = name
         self.model = None
+        self.batcher = None
+        self.pool = None
+        self.cache = None
         self.ready = False
+        self.startup_timings: Dict[str, float] = {}
+
+    @property
+    def ready(self) -> bool:
+        # Con il pool di worker serve almeno un worker attivo (readiness probe)
+        return self._ready and (self.pool is None or self.pool.healthy())
+
+    @ready.setter
+    def ready(self, value: bool):
+        self._ready = value
 
     def load(self):
         """Carica il modello sentence-transformers"""
-        print(f"Loading model: sentence-transformers/all-MiniLM-L6-v2")
-        self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        if MODEL_PATH and not os.path.isdir(MODEL_PATH):
+            raise RuntimeError(f"Snapshot del modello non trovato: {MODEL_PATH}")
+        source = MODEL_PATH or MODEL_NAME
+        timings = self.startup_timings
+        started = time.perf_counter()
+
+        print(f"Loading model: {source} (engine={ENGINE})")
+        with startup_phase(STARTUP_PHASE_SECONDS, timings, "load_model"):
+            self.model = build_model(ENGINE, source, ENGINE_CACHE_DIR)
+        encode_fn = self.model.encode
+        if WORKERS > 1:
+            # Pool avviato prima di qualsiasi inferenza nel processo principale.
+            # torch: pesi caricati qui e condivisi con i worker (fork); ONNX: una
+            # sessione per worker (spawn), il modello qui è servito solo a
+            # esportare il grafo in cache e viene rilasciato. I worker sostituiti
+            # dopo un crash usano sempre spawn e la factory
+            if ENGINE != "torch":
+                self.model = None
+            with startup_phase(STARTUP_PHASE_SECONDS, timings, "workers"):
+                self.pool = WorkerPool(
+                    WORKERS, THREADS_PER_WORKER,
+                    model=self.model,
+                    model_factory=functools.partial(build_model, ENGINE, source, ENGINE_CACHE_DIR),
+                    pin_cpus=PIN_CPUS,
+                    warmup_texts=PROBE_TEXTS,
+                    max_restarts=WORKER_MAX_RESTARTS,
+                )
+                self.pool.start()
+            encode_fn = self.pool.encode
+        if ENGINE != "torch":
+            # Fail fast: un grafo esportato che diverge dal riferimento non deve
+            # andare in servizio (verificato su ciò che servirà le richieste)
+            tolerance = float(ENGINE_TOLERANCE) if ENGINE_TOLERANCE else DEFAULT_TOLERANCES[ENGINE]
+            with startup_phase(STARTUP_PHASE_SECONDS, timings, "verify"):
+                distance = verify_against_reference(self.pool if self.pool is not None else self.model,
+                                                    ENGINE, source, tolerance)
+            print(f"Motore '{ENGINE}' verificato: distanza coseno max {distance:.2e} (tolleranza {tolerance:.2e})")
+        if MAX_BATCH_SIZE > 1:
+            self.batcher = MicroBatcher(encode_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                                        max_concurrent_batches=WORKERS)
+            print(f"Micro-batching attivo (max_batch_size={MAX_BATCH_SIZE}, max_wait_ms={MAX_WAIT_MS})")
+        if CACHE_MAX_ENTRIES > 0:
+            # Embeddings di motori o pesi diversi non sono intercambiabili
+            namespace = f"{source}@{model_revision(source)}:{ENGINE}"
+            self.cache = EmbeddingCache(namespace, max_entries=CACHE_MAX_ENTRIES, max_bytes=int(CACHE_MAX_MB * 1024 * 1024))
+            print(f"Cache embeddings attiva (namespace={namespace}, max_entries={CACHE_MAX_ENTRIES}, max_mb={CACHE_MAX_MB})")
+        if WARMUP_BATCH_SIZE > 0 and WARMUP_ROUNDS > 0:
+            with startup_phase(STARTUP_PHASE_SECONDS, timings, "warmup"):
+                self.warmup()
+
+        record_startup_phase(STARTUP_PHASE_SECONDS, timings, "total", time.perf_counter() - started)
         self.ready = True
         print("Model loaded successfully")
+        print("Startup: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
+
+    def warmup(self):
+        """
+        Inferenze di prova prima di dichiararsi pronto: le prime richieste
+        reali non pagano inizializzazioni lazy (allocatori, kernel, thread).
+        Passa dal thread del micro-batcher, lo stesso che servirà le richieste.
+        """
+        if self.batcher is not None:
+            encode = self.batcher.warmup
+        else:
+            encode = self.pool.encode if self.pool is not None else self.model.encode
+        batch = [PROBE_TEXTS[i % len(PROBE_TEXTS)] for i in range(WARMUP_BATCH_SIZE)]
+        for _ in range(WARMUP_ROUNDS):
+            encode(batch[:1])
+            encode(batch)
+        print(f"Warm-up completato ({WARMUP_ROUNDS} round, batch da 1 e {WARMUP_BATCH_SIZE})")
+
+    async def _encode(self, texts: List[str]) -> np.ndarray:
+        """Genera embeddings (uniti alle richieste concorrenti se il batching è attivo)"""
+        if self.batcher is not None:
+            return await self.batcher.submit(texts)
+        if self.pool is not None:
+            return await asyncio.wrap_future(self.pool.submit(texts))
+        return self.model.encode(texts)
+
+    async def _encode_cached(self, texts: List[str]) -> np.ndarray:
+        """Cerca ogni testo in cache e calcola solo i miss (deduplicati)."""
+        cached = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+        if missing:
+            computed = await self._encode(missing)
+            self.cache.put_many(missing, computed)
+            by_text = dict(zip(missing, computed))
+            cached = [vector if vector is not None else by_text[text] for text, vector in zip(texts, cached)]
+        return np.stack(cached)
 
-    def predict(self, request: Dict, headers: Dict = None) -> Dict:  # <-- AGGIUNTO headers
+    async def predict(self, request: Dict, headers: Dict = None) -> Union[Dict, bytes]:  # <-- AGGIUNTO headers
         """
         Input format: {"instances": ["text1", "text2", ...]}
         Output format: {"predictions": [[embedding1], [embedding2], ...]}
+
+        Con l'header `X-Embedding-Format: f32|f16` la risposta è invece
+        la matrice binaria descritta in rag_pipeline/binary_format.py.
         """
         try:
             texts = request["instances"]
@@ -28,9 +202,17 @@ class EmbeddingPredictor(kserve.Model):
             if isinstance(texts, str):
                 texts = [texts]
             
-            # Genera embeddings
-            embeddings = self.model.encode(texts)
+            # Genera embeddings (dalla cache quando possibile)
+            if self.cache is not None and texts:
+                embeddings = await self._encode_cached(texts)
+            else:
+                embeddings = await self._encode(texts)
             
+            # Formato binario opzionale: evita la serializzazione float -> testo
+            fmt = requested_format(headers)
+            if fmt != "json":
+                return encode_embeddings(embeddings, fmt)
+
             # Converti in lista per JSON serialization
             embeddings_list = embeddings.tolist()
             
@@ -0,0 +1,291 @@
+"""
+Pool di processi worker per EmbeddingPredictor.
+
+Con batch piccoli (le query) il threading intra-op di PyTorch non scala sui
+nodi con molti core: conviene eseguire N repliche del modello in processi
+separati, ciascuna con pochi thread (e, opzionalmente, CPU dedicate).
+
+- con `model` (motore torch) i worker sono creati con fork dopo il caricamento
+  del modello nel processo principale e i pesi, spostati in memoria condivisa
+  (`share_memory`), non vengono duplicati: il processo principale non deve
+  aver eseguito inferenze (thread pool intra-op e allocatori non sopravvivono
+  al fork), quindi il pool va avviato prima di verifiche e warm-up
+- con `model_factory` (motori ONNX, sessione non condivisibile tra processi)
+  i worker sono creati con spawn e costruiscono ciascuno il proprio modello,
+  indipendentemente dallo stato del processo principale
+- ogni richiesta va al worker con meno testi in elaborazione (least-loaded)
+- un worker terminato viene sostituito (al più `max_restarts` volte); le sue
+  richieste in sospeso falliscono e `healthy()` è False se nessun worker è attivo.
+  Il sostituto è sempre creato con spawn e costruisce il modello con
+  `model_factory`: a quel punto il processo principale serve richieste (thread
+  del server, del batcher e dei lettori) e un fork non sarebbe sicuro
+- `submit` è thread-safe e restituisce un concurrent.futures.Future, così il
+  pool si usa sia dal thread del micro-batcher che dall'event loop
+"""
+import itertools
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from prometheus_client import Gauge
+
+WORKER_INFLIGHT = Gauge(
+    "embedding_worker_inflight_texts",
+    "Testi in elaborazione per worker",
+    ["worker"],
+)
+
+
+def _worker_main(index: int, conn, model, model_factory: Optional[Callable], threads: int,
+                 cpus: Optional[List[int]], warmup_texts: Sequence[str]):
+    """Loop del processo worker: riceve (id, testi) e risponde (id, embeddings, errore)."""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    import torch
+    torch.set_num_threads(threads)
+
+    try:
+        if model is None:
+            model = model_factory()
+        if warmup_texts:
+            model.encode(list(warmup_texts))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        request_id, texts = message
+        try:
+            conn.send((request_id, model.encode(texts), None))
+        except Exception as e:
+            conn.send((request_id, None, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.inflight = 0
+        self.requests = 0
+        self.texts = 0
+        self.alive = True
+        self.gauge = WORKER_INFLIGHT.labels(str(index))
+
+
+class WorkerPool:
+    def __init__(self, workers: int, threads_per_worker: int, model=None,
+                 model_factory: Optional[Callable] = None, pin_cpus: bool = False,
+                 warmup_texts: Sequence[str] = (), max_restarts: int = 3):
+        """
+        `model` è condiviso con i worker avviati da start() tramite fork;
+        `model_factory` (picklable) costruisce il modello nei worker creati
+        con spawn: tutti se `model` manca, altrimenti solo i sostituti.
+        Senza `model_factory` un worker terminato non viene sostituito.
+        """
+        if model is None and model_factory is None:
+            raise ValueError("Serve un modello o una model_factory")
+        self.workers_count = workers
+        self.threads_per_worker = threads_per_worker
+        self.model = model
+        self.model_factory = model_factory
+        self.pin_cpus = pin_cpus
+        self.warmup_texts = list(warmup_texts)
+        self.max_restarts = max_restarts
+
+        self._workers: List[_Worker] = []
+        self._cpus: List[Optional[List[int]]] = []
+        self._pending: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._restarts = 0
+        self._closing = False
+
+    def _cpu_slices(self) -> List[Optional[List[int]]]:
+        """CPU dedicate per worker (solo se ce ne sono abbastanza per tutti)."""
+        if not self.pin_cpus or not hasattr(os, "sched_getaffinity"):
+            return [None] * self.workers_count
+        cpus = sorted(os.sched_getaffinity(0))
+        if len(cpus) < self.workers_count * self.threads_per_worker:
+            print(f"⚠️ {len(cpus)} CPU per {self.workers_count} worker x {self.threads_per_worker} thread: "
+                  "affinità non impostata")
+            return [None] * self.workers_count
+        size = self.threads_per_worker
+        return [cpus[i * size:(i + 1) * size] for i in range(self.workers_count)]
+
+    def _launch(self, index: int, respawn: bool = False) -> _Worker:
+        # fork solo all'avvio, per condividere i pesi del processo principale
+        fork = self.model is not None and not respawn
+        context = multiprocessing.get_context("fork" if fork else "spawn")
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=_worker_main,
+            args=(index, child_conn, self.model if fork else None, self.model_factory, self.threads_per_worker,
+                  self._cpus[index], self.warmup_texts),
+            name=f"embedding-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(index, process, parent_conn)
+
+    def _await_ready(self, worker: _Worker):
+        """Attende il warm-up del worker e avvia il thread che ne legge i risultati."""
+        try:
+            status, detail = worker.conn.recv()
+        except EOFError:
+            worker.process.join(timeout=1)
+            status, detail = "error", f"processo terminato (exit code {worker.process.exitcode})"
+        if status != "ready":
+            raise RuntimeError(f"Worker {worker.index} non avviato: {detail}")
+        threading.Thread(target=self._read_results, args=(worker,), daemon=True,
+                         name=f"embedding-worker-{worker.index}-reader").start()
+
+    def start(self):
+        """Avvia i worker e attende che abbiano completato il warm-up."""
+        if self.model is not None and hasattr(self.model, "share_memory"):
+            # Pesi in memoria condivisa: i worker li leggono senza copiarli
+            self.model.share_memory()
+        self._cpus = self._cpu_slices()
+
+        self._workers = [self._launch(index) for index in range(self.workers_count)]
+        try:
+            for worker in self._workers:
+                self._await_ready(worker)
+        except RuntimeError:
+            self.close()
+            raise
+        print(f"Pool di {self.workers_count} worker avviato "
+              f"({self.threads_per_worker} thread ciascuno, pid {[w.process.pid for w in self._workers]})")
+
+    def submit(self, texts: List[str]) -> Future:
+        """Invia i testi al worker con meno testi in elaborazione."""
+        future = Future()
+        with self._lock:
+            alive = [worker for worker in self._workers if worker.alive]
+            if not alive:
+                raise RuntimeError("Nessun worker di embedding attivo")
+            worker = min(alive, key=lambda w: w.inflight)
+            request_id = next(self._ids)
+            self._pending[request_id] = (future, worker, len(texts))
+            worker.inflight += len(texts)
+            worker.requests += 1
+            worker.texts += len(texts)
+            worker.gauge.set(worker.inflight)
+        try:
+            with worker.send_lock:
+                worker.conn.send((request_id, texts))
+        except OSError as e:
+            # Worker appena terminato: se il thread di lettura non l'ha già fatto, fallisce qui
+            with self._lock:
+                pending = self._pending.pop(request_id, None)
+            if pending is not None:
+                future.set_exception(RuntimeError(f"Worker {worker.index} non raggiungibile: {e}"))
+        return future
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Versione bloccante di submit (stesso contratto di SentenceTransformer.encode)."""
+        return self.submit(texts).result()
+
+    def _read_results(self, worker: _Worker):
+        while True:
+            try:
+                request_id, embeddings, error = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future, _, size = self._pending.pop(request_id)
+                worker.inflight -= size
+                worker.gauge.set(worker.inflight)
+            if error is not None:
+                future.set_exception(RuntimeError(f"Worker {worker.index}: {error}"))
+            else:
+                future.set_result(embeddings)
+
+        # Worker terminato: le sue richieste in sospeso falliscono
+        with self._lock:
+            worker.alive = False
+            orphaned = [request_id for request_id, (_, owner, _) in self._pending.items() if owner is worker]
+            futures = [self._pending.pop(request_id)[0] for request_id in orphaned]
+        for future in futures:
+            future.set_exception(RuntimeError(f"Worker {worker.index} terminato"))
+        worker.process.join(timeout=1)
+        # SIGTERM: arresto richiesto (close o uscita dell'interprete), non un crash
+        if not self._closing and worker.process.exitcode != -signal.SIGTERM:
+            print(f"❌ Worker di embedding {worker.index} terminato (exit code {worker.process.exitcode})")
+            self._respawn(worker)
+
+    def _respawn(self, dead: _Worker):
+        """Sostituisce un worker terminato con uno nuovo sullo stesso indice (e CPU)."""
+        dead.conn.close()
+        with self._lock:
+            if self._closing:
+                return
+            if self.model_factory is None:
+                print(f"❌ Worker {dead.index} non sostituito: serve una model_factory")
+                return
+            if self._restarts >= self.max_restarts:
+                print(f"❌ Limite di {self.max_restarts} riavvii raggiunto: worker {dead.index} non sostituito")
+                return
+            self._restarts += 1
+        try:
+            worker = self._launch(dead.index, respawn=True)
+            self._await_ready(worker)
+        except Exception as e:
+            if not self._closing:
+                print(f"❌ Riavvio del worker di embedding {dead.index} fallito: {e}")
+            return
+        with self._lock:
+            if not self._closing:
+                self._workers[dead.index] = worker
+                print(f"Worker di embedding {dead.index} riavviato (pid {worker.process.pid})")
+                return
+        # close() arrivato durante il riavvio
+        worker.conn.send(None)
+        worker.process.join(timeout=5)
+
+    def healthy(self) -> bool:
+        """True se almeno un worker può servire richieste."""
+        with self._lock:
+            return any(worker.alive for worker in self._workers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                f"worker_{worker.index}": {
+                    "pid": worker.process.pid,
+                    "alive": worker.alive,
+                    "inflight_texts": worker.inflight,
+                    "requests": worker.requests,
+                    "texts": worker.texts,
+                }
+                for worker in self._workers
+            }
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+        for worker in self._workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+        self._workers = []
@@ -2,6 +2,39 @@ from kfp import dsl
 from kfp import compiler
 from kfp.dsl import Output, Input, Dataset
 import kfp
+import os
+import subprocess
+
+# Helper condivisi dai componenti (pipeline_lib/rag_pipeline): i componenti
+# lightweight sono serializzati da soli, quindi il pacchetto viene installato
+# dal repository in ciascuno
+PIPELINE_REPO_URL = 'https://github.com/vincenzo426/MLOpsRepo'
+
+
+def pipeline_lib_ref():
+    """
+    Commit del repository fissato nello YAML al momento della compilazione,
+    così i componenti installano esattamente il pipeline_lib con cui la
+    pipeline è stata compilata. PIPELINE_LIB_REF permette di forzare un
+    tag o uno SHA (es. build fuori da un checkout git).
+    """
+    ref = os.getenv("PIPELINE_LIB_REF", "").strip()
+    if ref:
+        return ref
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=repo_dir,
+            check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise RuntimeError(
+            "Impossibile determinare il commit di pipeline_lib: "
+            "compila da un checkout git o imposta PIPELINE_LIB_REF"
+        ) from e
+
+
+PIPELINE_LIB = f"git+{PIPELINE_REPO_URL}@{pipeline_lib_ref()}#subdirectory=pipeline_lib"
 
 @dsl.component(
     base_image="python:3.10",
@@ -56,19 +89,65 @@ def download_from_minio(
     packages_to_install=[
         "langchain-community==0.2.10", # Per PyPDFLoader
         "langchain-text-splitters==0.2.2", # Per RecursiveCharacterTextSplitter
-        "pypdfium2"                # Per la lettura dei PDF
+        "pypdfium2",               # Per la lettura dei PDF
+        "datasketch",              # Per la deduplica MinHash (dedup="minhash")
+        "qdrant-client==1.7.0",    # Per il manifest dell'ingestion incrementale
+        PIPELINE_LIB               # ShardWriter / iter_records e task del pool
     ]
 )
 def chunk_documents(
     documents: Input[Dataset],
     chunk_size: int,
     chunk_overlap: int,
-    output_chunks: Output[Dataset]
+    output_chunks: Output[Dataset],
+    shard_size: int = 10000,
+    compression: str = "gzip",
+    num_workers: int = 1,
+    pages_per_task: int = 50,
+    qdrant_url: str = "",
+    collection_name: str = "",
+    incremental: bool = True,
+    full_rebuild: bool = False,
+    dedup: str = "none",
+    minhash_threshold: float = 0.9,
+    minhash_num_perm: int = 128
 ):
+    """
+    Produce i chunk in formato JSON Lines a shard (chunks-00000.jsonl[.gz], ...)
+    più un manifest.json. I chunk sono scritti man mano che i documenti
+    vengono letti, quindi la memoria non cresce con la dimensione del corpus.
+
+    Con num_workers > 1 parsing e splitting girano in un pool di processi;
+    i PDF con più di `pages_per_task` pagine sono divisi in intervalli di
+    pagine estratti in parallelo e ricomposti in ordine prima dello split.
+    L'ordine di `source`/`chunk_id` non dipende dal numero di worker.
+
+    In modalità incrementale lo sha256 di ogni file viene confrontato con
+    il `file_hash` salvato nel payload del chunk 0 di quella source in
+    Qdrant (scritto da upload_to_qdrant solo a upload riuscito): i file
+    invariati non vengono riletti. Il manifest elenca tutte le source
+    presenti con il loro stato, così gli step successivi sanno cosa
+    mantenere e cosa rimuovere.
+
+    `dedup` elimina i chunk duplicati tra documenti: "exact" confronta lo
+    sha256 del testo normalizzato (minuscolo, spazi compattati), "minhash"
+    aggiunge i quasi-duplicati (MinHash LSH su trigrammi di parole con
+    soglia di Jaccard `minhash_threshold`). Resta il primo chunk di ogni
+    gruppo, con tutti i riferimenti source/chunk_id in `references`. La
+    deduplica lavora sull'intero corpus, quindi disattiva l'incrementale.
+    """
     from langchain_text_splitters import RecursiveCharacterTextSplitter
-    from langchain_community.document_loaders import PyPDFium2Loader
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    import multiprocessing
+    import pypdfium2 as pdfium
     import os
-    import json
+    import hashlib
+    import shutil
+    import tempfile
+    from rag_pipeline.chunking import run_task
+    from rag_pipeline.dedup import MODES as DEDUP_MODES, deduplicate
+    from rag_pipeline.shards import ShardWriter
     
     print(f"=== Exploring documents path: {documents.path} ===")
     
@@ -78,229 +157,967 @@ def chunk_documents(
         length_function=len
     )
     
-    all_chunks = []
-    
-    for root, dirs, files in os.walk(documents.path):
-        for file in files:
-            if file.startswith('.'):
-                continue
-                
-            file_path = os.path.join(root, file)
-            file_size = os.path.getsize(file_path)
-            print(f"Processing: {file} ({file_size} bytes)")
-            
-            try:
-                content = None
-                
-                # --- 3. MODIFICA LOGICA DI LETTURA ---
-                if file.lower().endswith('.pdf'):
-                    print(f"  → Loading as PDF (using PyPDFium2)...")
-                    loader = PyPDFium2Loader(file_path)
-                    pdf_pages = loader.load()
-                    # Uniamo il testo di tutte le pagine
-                    content = "\n".join([doc.page_content for doc in pdf_pages])
-                else:
-                    # Assumiamo che gli altri file siano di testo
-                    # (logica originale)
-                    print(f"  → Loading as Text...")
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                # --- FINE MODIFICA ---                
-                if content and content.strip():
-                    chunks = splitter.split_text(content)
-                    
-                    for i, chunk in enumerate(chunks):
-                        all_chunks.append({
-                            'source': file,
-                            'chunk_id': i,
-                            'content': chunk
-                        })
-                    print(f"  → Created {len(chunks)} chunks")
+    if dedup not in DEDUP_MODES:
+        raise ValueError(f"Modalità di deduplica non supportata: {dedup}")
+
+    # Con la deduplica i chunk passano da una directory temporanea
+    raw_path = tempfile.mkdtemp() if dedup != "none" else output_chunks.path
+    writer = ShardWriter(raw_path, "chunks", shard_size, compression)
+
+    def file_sha256(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def read_manifest():
+        """source -> file_hash dell'ultimo upload riuscito (payload del chunk 0)."""
+        from qdrant_client import QdrantClient
+        from qdrant_client.models import Filter, FieldCondition, MatchValue
+
+        client = QdrantClient(url=qdrant_url)
+        # collection_name può essere un alias (vedi full_rebuild in upload_to_qdrant)
+        known = [c.name for c in client.get_collections().collections]
+        known += [a.alias_name for a in client.get_aliases().aliases]
+        if collection_name not in known:
+            return {}
+        manifest = {}
+        offset = None
+        while True:
+            records, offset = client.scroll(
+                collection_name=collection_name,
+                scroll_filter=Filter(must=[FieldCondition(key="chunk_id", match=MatchValue(value=0))]),
+                limit=256,
+                offset=offset,
+                with_payload=["source", "file_hash"],
+                with_vectors=False
+            )
+            for record in records:
+                manifest[record.payload["source"]] = record.payload.get("file_hash")
+            if offset is None:
+                break
+        return manifest
+
+    # Un full rebuild riprocessa sempre tutto il corpus
+    incremental = incremental and not full_rebuild and dedup == "none" and bool(qdrant_url)
+    previous = read_manifest() if incremental else {}
+    if incremental:
+        print(f"Incremental mode: {len(previous)} sources in '{collection_name}'")
+
+    # Stato di ogni source trovata: new | changed | unchanged | error
+    sources = {}
+
+    def plan_tasks():
+        """Genera (file, indice parte, numero parti, task) in ordine deterministico."""
+        for root, dirs, files in os.walk(documents.path):
+            dirs.sort()
+            for file in sorted(files):
+                if file.startswith('.'):
+                    continue
+
+                file_path = os.path.join(root, file)
+                file_size = os.path.getsize(file_path)
+                file_hash = file_sha256(file_path)
+                if file in previous and previous[file] == file_hash:
+                    sources[file] = {'file_hash': file_hash, 'status': "unchanged"}
+                    print(f"Skipping: {file} (unchanged)")
+                    continue
+                status = "changed" if file in previous else "new"
+                sources[file] = {'file_hash': file_hash, 'status': status, 'chunk_count': 0}
+                print(f"Processing: {file} ({file_size} bytes, {status})")
+
+                if num_workers > 1 and file.lower().endswith('.pdf'):
+                    try:
+                        pdf = pdfium.PdfDocument(file_path)
+                        page_count = len(pdf)
+                        pdf.close()
+                    except Exception as e:
+                        yield file, 0, 1, ("error", f"{type(e).__name__}: {e}")
+                        continue
+                    if page_count > pages_per_task:
+                        ranges = [(start, min(start + pages_per_task, page_count))
+                                  for start in range(0, page_count, pages_per_task)]
+                        print(f"  → PDF di {page_count} pagine diviso in {len(ranges)} task")
+                        for part, (start, end) in enumerate(ranges):
+                            yield file, part, len(ranges), ("pages", (file_path, start, end))
+                        continue
+
+                yield file, 0, 1, ("file", (file_path, chunk_size, chunk_overlap))
+
+    def write_chunks(file, chunks):
+        for i, chunk in enumerate(chunks):
+            writer.write({
+                'source': file,
+                'chunk_id': i,
+                'content': chunk,
+                'file_hash': sources[file]['file_hash'],
+                'chunk_hash': hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+            })
+        sources[file]['chunk_count'] = len(chunks)
+        if chunks:
+            print(f"  → {file}: created {len(chunks)} chunks")
+        else:
+            print(f"  → {file}: empty file or no content, skipped")
+
+    # Raccoglie i risultati (in ordine) delle parti di ciascun file
+    pending = {"file": None, "parts": [], "error": None}
+
+    def collect(file, part, total, result):
+        kind, value = result
+        if part == 0:
+            pending.update(file=file, parts=[], error=None)
+        if kind == "error":
+            pending["error"] = pending["error"] or value
+        elif kind == "pages":
+            pending["parts"].extend(value)
+        else:
+            pending["parts"] = value
+        if part < total - 1:
+            return
+
+        if pending["error"]:
+            # La source resta com'è in Qdrant: verrà ritentata al prossimo run
+            sources[file]['status'] = "error"
+            print(f"  → Error processing {file}: {pending['error']}")
+        elif kind == "chunks" and total == 1:
+            write_chunks(file, pending["parts"])
+        else:
+            content = "\n".join(pending["parts"])
+            write_chunks(file, splitter.split_text(content) if content.strip() else [])
+
+    def execute(task):
+        return task if task[0] == "error" else run_task(task)
+
+    if num_workers > 1:
+        print(f"Parallel mode: {num_workers} workers, {pages_per_task} pages per task")
+        # Finestra limitata di future consumate in ordine di sottomissione:
+        # l'output è deterministico e la memoria resta costante
+        window = deque()
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as pool:
+            for file, part, total, task in plan_tasks():
+                if task[0] == "error":
+                    future = None
                 else:
-                    print(f"  → Empty file or no content, skipped")
-                    
-            except Exception as e:
-                print(f"  → Error processing {file}: {e}")
+                    future = pool.submit(run_task, task)
+                window.append((file, part, total, task, future))
+                if len(window) >= 2 * num_workers:
+                    file, part, total, task, future = window.popleft()
+                    collect(file, part, total, future.result() if future else task)
+            while window:
+                file, part, total, task, future = window.popleft()
+                collect(file, part, total, future.result() if future else task)
+    else:
+        for file, part, total, task in plan_tasks():
+            collect(file, part, total, execute(task))
     
-    os.makedirs(output_chunks.path, exist_ok=True)
-    output_file = os.path.join(output_chunks.path, "chunks.json")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(all_chunks, f, ensure_ascii=False)
-    
-    output_chunks.metadata["chunk_count"] = len(all_chunks)
-    print(f"\n✓ Total chunks created: {len(all_chunks)}")
+    writer.close(incremental=incremental, sources=sources)
+
+    raw_count = writer.count
+    if dedup != "none":
+        writer = deduplicate(raw_path, output_chunks.path, dedup, sources, shard_size, compression,
+                             minhash_threshold, minhash_num_perm)
+        shutil.rmtree(raw_path, ignore_errors=True)
+        print(f"✓ Deduplica ({dedup}): {raw_count} chunk -> {writer.count} unici "
+              f"({raw_count - writer.count} duplicati rimossi)")
+
+    skipped = sum(info['status'] == "unchanged" for info in sources.values())
+    failed = sum(info['status'] == "error" for info in sources.values())
+    output_chunks.metadata["chunk_count"] = writer.count
+    output_chunks.metadata["duplicates_removed"] = raw_count - writer.count
+    output_chunks.metadata["shard_count"] = len(writer.shards)
+    output_chunks.metadata["documents_processed"] = len(sources) - skipped - failed
+    output_chunks.metadata["documents_skipped"] = skipped
+    output_chunks.metadata["documents_failed"] = failed
+    print(f"\n✓ Total chunks created: {writer.count} ({len(writer.shards)} shards)")
+    print(f"✓ Documents: {len(sources) - skipped - failed} processed, {skipped} skipped (unchanged), {failed} failed")
+
+# create_embeddings è registrata come due componenti (vedi sotto la funzione):
+# sentence-transformers e torch vengono installati solo nella variante usata
+# dalla pipeline con embedding_backend="local"
+EMBEDDING_PACKAGES = [
+    "huggingface-hub>=0.20.0",
+    "numpy>=1.24.0",
+    "qdrant-client==1.7.0",
+    "requests",                      # Backend "kserve"
+    PIPELINE_LIB
+]
+
 
-@dsl.component(
-    base_image="python:3.10",
-    packages_to_install=[
-        "huggingface-hub>=0.20.0",
-        "numpy>=1.24.0"
-    ]
-)
 def create_embeddings(
     chunks: Input[Dataset],
     model_name: str,
     hf_api_key: str,
     output_embeddings: Output[Dataset],
-    batch_size: int = 128  # Aggiungi un parametro per la dimensione del batch
+    batch_size: int = 128,  # Aggiungi un parametro per la dimensione del batch
+    shard_size: int = 10000,
+    compression: str = "gzip",
+    qdrant_url: str = "",
+    collection_name: str = "",
+    max_concurrency: int = 4,
+    max_retries: int = 5,
+    base_backoff_s: float = 1.0,
+    max_backoff_s: float = 60.0,
+    min_coverage: float = 0.99,
+    backend: str = "hf_api",
+    kserve_url: str = "",
+    local_batch_size: int = 64,
+    embedding_dtype: str = "float32"
 ):
+    """
+    Legge i chunk a shard come generatore e scrive, un batch alla volta,
+    i vettori in una matrice contigua `embeddings.npy` (float32 o float16,
+    `embedding_dtype`) e i metadati dei chunk con l'indice di riga in shard
+    JSON Lines (metadata-00000.jsonl[.gz]) + manifest.json: la memoria
+    resta costante al crescere del corpus.
+
+    Se i chunk sono stati prodotti in modalità incrementale, i chunk il cui
+    punto in Qdrant ha già lo stesso `chunk_hash` non vengono ri-embeddati
+    né scritti nell'output (il punto esistente resta valido).
+
+    Fino a `max_concurrency` batch sono in volo contemporaneamente. Gli
+    errori transitori (timeout, 5xx, 429) sono ritentati con backoff
+    esponenziale e jitter (rispettando Retry-After); gli altri errori
+    dividono il batch a metà fino a isolare i testi non validi. Lo step
+    fallisce se la quota di chunk embeddati scende sotto `min_coverage`.
+
+    `backend` sceglie dove calcolare gli embeddings:
+      - "hf_api": Hugging Face Inference API (default)
+      - "kserve": endpoint :predict di EmbeddingPredictor (`kserve_url`),
+        lo stesso modello usato a query time, risposta in formato binario
+      - "local":  SentenceTransformer nel pod (torch CPU, solo nel
+        componente create_embeddings_local); encode ordina i testi per
+        lunghezza e li elabora a gruppi di `local_batch_size`, quindi
+        conviene un `batch_size` ampio
+    """
     from huggingface_hub import InferenceClient
-    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
     import os
+    import random
+    import threading
+    import time
+    import numpy as np
+    from rag_pipeline.matrix import MatrixWriter
+    from rag_pipeline.shards import ShardWriter, iter_records, point_id, read_manifest
 
-    client = InferenceClient(token=hf_api_key)
+    chunks_manifest = read_manifest(chunks.path)
+    sources = chunks_manifest.get("sources", {})
+    incremental = chunks_manifest.get("incremental", False) and bool(qdrant_url)
 
-    chunks_file = os.path.join(chunks.path, "chunks.json")
-    with open(chunks_file, 'r', encoding='utf-8') as f:
-        chunks_data = json.load(f)
+    qdrant = None
+    if incremental:
+        from qdrant_client import QdrantClient
+        qdrant = QdrantClient(url=qdrant_url)
+        known = [c.name for c in qdrant.get_collections().collections]
+        known += [a.alias_name for a in qdrant.get_aliases().aliases]
+        if collection_name not in known:
+            qdrant = None
 
-    embedded_chunks = []
-    
-    print(f"Generazione embeddings per {len(chunks_data)} chunks con {model_name}...")
+    def chunk_point_id(chunk):
+        return point_id(chunk['source'], chunk['chunk_id'])
 
-    # Raccogli solo i testi per il batching
-    all_texts = [chunk['content'] for chunk in chunks_data]
-    
-    # Lista per raccogliere tutti gli embedding calcolati
-    all_embeddings = []
-
-    for i in range(0, len(all_texts), batch_size):
-        # 1. Crea un batch di testi
-        batch_texts = all_texts[i:i + batch_size]
-        
-        # 2. Esegui UNA chiamata API per l'INTERO batch
-        try:
-            batch_embeddings = client.feature_extraction(
-                text=batch_texts,  # <-- SOLUZIONE: invia una lista di testi
+    def unchanged_ids(batch_chunks):
+        """ID dei chunk del batch già presenti in Qdrant con lo stesso chunk_hash."""
+        if qdrant is None:
+            return set()
+        records = qdrant.retrieve(
+            collection_name=collection_name,
+            ids=[chunk_point_id(chunk) for chunk in batch_chunks],
+            with_payload=["chunk_hash"],
+            with_vectors=False
+        )
+        existing = {str(record.id).replace("-", ""): record.payload.get("chunk_hash") for record in records}
+        return {
+            chunk_point_id(chunk) for chunk in batch_chunks
+            if existing.get(chunk_point_id(chunk)) == chunk['chunk_hash']
+        }
+
+    if backend not in ("hf_api", "kserve", "local"):
+        raise ValueError(f"Backend di embedding non supportato: {backend}")
+    if embedding_dtype not in ("float32", "float16"):
+        raise ValueError(f"embedding_dtype non supportato: {embedding_dtype}")
+
+    if backend == "hf_api":
+        client = InferenceClient(token=hf_api_key)
+
+        def call_backend(texts):
+            return client.feature_extraction(
+                text=texts,  # <-- SOLUZIONE: invia una lista di testi
                 model=model_name
             )
-            
-            # Gestione della struttura di output
-            if isinstance(batch_embeddings, list):
-                all_embeddings.extend([e.tolist() if hasattr(e, 'tolist') else e for e in batch_embeddings])
-            else:
-                # Se l'output è un singolo tensore/array per il batch
-                all_embeddings.extend([e.tolist() if hasattr(e, 'tolist') else e for e in batch_embeddings])
 
-            print(f"Processato batch {i//batch_size + 1}/{(len(all_texts) - 1)//batch_size + 1}")
+    elif backend == "kserve":
+        import requests
+        from rag_pipeline.binary_format import decode_embeddings, is_binary_payload
+
+        if not kserve_url:
+            raise ValueError("kserve_url è obbligatorio con backend='kserve'")
+        session = requests.Session()
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency))
+        def call_backend(texts):
+            response = session.post(
+                kserve_url,
+                json={"instances": texts},
+                headers={"X-Embedding-Format": "f32"},
+                timeout=300
+            )
+            response.raise_for_status()
+            content = response.content
+            if is_binary_payload(content):
+                matrix = decode_embeddings(content)
+                if len(matrix) != len(texts):
+                    raise ValueError(f"Payload di embedding binario con {len(matrix)} righe, attese {len(texts)}")
+                return matrix
+            return response.json()["predictions"]
+
+    else:
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(model_name, device="cpu")
+        # Un solo encode alla volta: il modello usa già tutti i core, i
+        # thread del pool sovrappongono solo lookup in Qdrant e scrittura
+        model_lock = threading.Lock()
 
+        def call_backend(texts):
+            with model_lock:
+                return model.encode(texts, batch_size=local_batch_size)
+
+    total_chunks = chunks.metadata.get("chunk_count", "?")
+    total_batches = (total_chunks - 1) // batch_size + 1 if isinstance(total_chunks, int) else "?"
+    print(f"Generazione embeddings per {total_chunks} chunks con {model_name} "
+          f"(backend {backend}, {max_concurrency} batch in parallelo)...")
+
+    # Errori HTTP per cui ha senso ritentare; gli altri 4xx (e qualsiasi
+    # errore del modello locale) indicano input non validi e portano a
+    # dividere il batch
+    RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+    rate_limit = {"until": 0.0}
+    rate_limit_lock = threading.Lock()
+
+    def wait_rate_limit():
+        """Tutti i worker si fermano finché dura l'ultimo rate limit ricevuto."""
+        delay = rate_limit["until"] - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff_delay(attempt, error):
+        """Retry-After se presente, altrimenti backoff esponenziale con jitter."""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(max_backoff_s, base_backoff_s * 2 ** attempt))
+
+    def embed_texts(texts):
+        """Embedding di una lista di testi con retry; None per i testi non recuperabili."""
+        for attempt in range(max_retries + 1):
+            wait_rate_limit()
+            try:
+                result = call_backend(texts)
+                # Gestione della struttura di output (lista o tensore per il batch)
+                return list(np.asarray(result, dtype=np.float32))
+            except Exception as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if backend == "local" or (status is not None and status not in RETRYABLE_STATUS):
+                    break
+                if attempt == max_retries:
+                    print(f"  → {len(texts)} testi falliti dopo {max_retries} retry: {e}")
+                    return [None] * len(texts)
+                delay = backoff_delay(attempt, e)
+                if status == 429:
+                    with rate_limit_lock:
+                        rate_limit["until"] = max(rate_limit["until"], time.monotonic() + delay)
+                    print(f"  → Rate limit, pausa di {delay:.1f}s")
+                else:
+                    time.sleep(delay)
+
+        # Errore non ritentabile: divide il batch a metà per isolare gli input non validi
+        if len(texts) == 1:
+            print(f"  → Testo scartato (errore non recuperabile): {texts[0][:80]!r}")
+            return [None]
+        middle = len(texts) // 2
+        return embed_texts(texts[:middle]) + embed_texts(texts[middle:])
+
+    def process_batch(batch_chunks, batch_number):
+        """Eseguito in un thread del pool: lookup dei chunk invariati + embedding."""
+        # 0. Scarta i chunk invariati rispetto all'ultimo upload
+        try:
+            unchanged = unchanged_ids(batch_chunks)
         except Exception as e:
-            print(f"Errore durante l'elaborazione del batch {i}: {e}")
-            # Aggiungi N embedding vuoti o gestisci l'errore
-            all_embeddings.extend([None] * len(batch_texts))
-
-    # 3. Ricombina i metadati con gli embedding
-    for i, chunk in enumerate(chunks_data):
-        embedding_value = all_embeddings[i]
-        # Salta i chunk che hanno fallito (se ce ne sono)
-        if embedding_value is not None:
-            embedded_chunks.append({
+            print(f"Lookup dei chunk esistenti fallito per il batch {batch_number}: {e}")
+            unchanged = set()
+        skipped = len(unchanged)
+        batch_chunks = [chunk for chunk in batch_chunks if chunk_point_id(chunk) not in unchanged]
+        if not batch_chunks:
+            return batch_number, [], [], skipped
+
+        # 1. Una chiamata API per l'intero batch (con retry e split)
+        batch_embeddings = embed_texts([chunk['content'] for chunk in batch_chunks])
+        return batch_number, batch_chunks, batch_embeddings, skipped
+
+    os.makedirs(output_embeddings.path, exist_ok=True)
+    matrix = MatrixWriter(
+        os.path.join(output_embeddings.path, "embeddings.npy"),
+        chunks_manifest.get("count", 0),
+        embedding_dtype
+    )
+    writer = ShardWriter(output_embeddings.path, "metadata", shard_size, compression)
+    failed_chunks = 0
+    skipped_chunks = 0
+    # Source con chunk non embeddati: upload_to_qdrant non ne aggiornerà il file_hash
+    incomplete_sources = set()
+
+    def collect(future):
+        nonlocal failed_chunks, skipped_chunks
+        batch_number, batch_chunks, batch_embeddings, skipped = future.result()
+        skipped_chunks += skipped
+        failed = 0
+        # 2. Vettore nella matrice, metadati (con l'indice di riga) negli shard
+        for chunk, embedding_value in zip(batch_chunks, batch_embeddings):
+            if embedding_value is None:
+                failed += 1
+                incomplete_sources.add(chunk['source'])
+                continue
+            writer.write({
                 **chunk,
-                'embedding': embedding_value
+                'row': matrix.write(embedding_value)
             })
+        failed_chunks += failed
+        if not batch_chunks:
+            print(f"Batch {batch_number}/{total_batches} invariato, saltato")
+        else:
+            print(f"Processato batch {batch_number}/{total_batches}"
+                  + (f" ({failed} chunk falliti)" if failed else ""))
 
-    os.makedirs(output_embeddings.path, exist_ok=True)
-    output_file = os.path.join(output_embeddings.path, "embeddings.json")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(embedded_chunks, f, ensure_ascii=False)
+    # Finestra limitata di batch in volo, consumati in ordine: l'output è
+    # deterministico e in memoria restano al più 2 * max_concurrency batch
+    window = deque()
+    batch = []
+    batch_number = 0
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        for chunk in iter_records(chunks.path, chunks_manifest):
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                batch_number += 1
+                window.append(pool.submit(process_batch, batch, batch_number))
+                batch = []
+                if len(window) >= 2 * max_concurrency:
+                    collect(window.popleft())
+        if batch:
+            batch_number += 1
+            window.append(pool.submit(process_batch, batch, batch_number))
+        while window:
+            collect(window.popleft())
 
-    output_embeddings.metadata["embedding_count"] = len(embedded_chunks)
-    print(f"✓ Embeddings completati: {len(embedded_chunks)} chunks")
+    matrix.close()
+    writer.close(
+        format="npy",
+        matrix="embeddings.npy",
+        dtype=matrix.dtype.name,
+        dim=matrix.dim,
+        incremental=chunks_manifest.get("incremental", False),
+        dedup=chunks_manifest.get("dedup", "none"),
+        sources=sources,
+        incomplete_sources=sorted(incomplete_sources)
+    )
+
+    output_embeddings.metadata["embedding_count"] = writer.count
+    output_embeddings.metadata["failed_count"] = failed_chunks
+    output_embeddings.metadata["skipped_count"] = skipped_chunks
+    print(f"✓ Embeddings completati: {writer.count} chunks ({skipped_chunks} invariati saltati, {failed_chunks} falliti)")
+
+    # Copertura sui chunk da embeddare: sotto soglia lo step fallisce,
+    # così un indice parziale non arriva a upload_to_qdrant
+    attempted = writer.count + failed_chunks
+    coverage = writer.count / attempted if attempted else 1.0
+    output_embeddings.metadata["coverage"] = coverage
+    if coverage < min_coverage:
+        raise RuntimeError(
+            f"Copertura embeddings {coverage:.2%} inferiore alla soglia {min_coverage:.2%} "
+            f"({failed_chunks} chunk falliti su {attempted})"
+        )
+
+
+create_embeddings_local = dsl.component(
+    base_image="python:3.10",
+    packages_to_install=EMBEDDING_PACKAGES + ["sentence-transformers>=3.2.0"],
+    # torch solo CPU per sentence-transformers (senza le librerie CUDA)
+    pip_index_urls=["https://pypi.org/simple", "https://download.pytorch.org/whl/cpu"]
+)(create_embeddings)
+create_embeddings = dsl.component(
+    base_image="python:3.10",
+    packages_to_install=EMBEDDING_PACKAGES
+)(create_embeddings)
 
 
 @dsl.component(
     base_image="python:3.10",
-    packages_to_install=["qdrant-client==1.7.0"]
+    packages_to_install=["qdrant-client==1.7.0", "numpy>=1.24.0", PIPELINE_LIB]
 )
 def upload_to_qdrant(
     embeddings: Input[Dataset],
     qdrant_url: str,
     collection_name: str,
-    vector_size: int
+    vector_size: int,
+    cache_invalidate_url: str = "",
+    prefer_grpc: bool = False,
+    grpc_port: int = 6334,
+    upload_batch_size: int = 100,
+    upload_workers: int = 1,
+    wait_for_batches: bool = True,
+    defer_indexing: bool = False,
+    consistency_timeout_s: float = 300.0,
+    full_rebuild: bool = False,
+    keep_versions: int = 2,
+    index_timeout_s: float = 1800.0,
+    index_start_timeout_s: float = 60.0,
+    quantization: str = "none",
+    on_disk_vectors: bool = False,
+    hnsw_m: int = 16,
+    hnsw_ef_construct: int = 100
 ):
+    """
+    Carica l'artifact di create_embeddings nella collection.
+
+    Con `prefer_grpc` il client usa la porta gRPC (`grpc_port`); i batch da
+    `upload_batch_size` punti sono inviati da `upload_workers` processi.
+    Con `wait_for_batches=False` non si attende la conferma di ogni batch
+    e, a fine caricamento, si verifica che tutti i punti siano presenti.
+    `defer_indexing` porta indexing_threshold a 0 durante il caricamento
+    e ripristina il valore precedente alla fine.
+
+    Con `full_rebuild` i punti sono scritti in una nuova collection
+    versionata (`<collection_name>_vYYYYmmddHHMMSSffffff`, UTC) e `collection_name`
+    diventa un alias spostato atomicamente sulla nuova versione a
+    indicizzazione completata; restano le ultime `keep_versions` versioni.
+    Se l'optimizer non avvia l'indicizzazione entro `index_start_timeout_s`
+    (segmenti sotto indexing_threshold) la versione viene esposta comunque.
+
+    Prima migrazione ad alias (manuale, una tantum): se `collection_name` è
+    una collection reale il full rebuild si ferma senza modificare nulla,
+    perché Qdrant non ammette un alias con lo stesso nome e rimuoverla
+    lascerebbe il servizio senza dati. Per migrare senza downtime: eseguire
+    il full rebuild con un nuovo `collection_name` (es. "documents_live"),
+    impostare COLLECTION_NAME dell'orchestrator sul nuovo alias e solo dopo
+    eliminare la vecchia collection.
+
+    `quantization` ("none", "scalar" int8 o "binary") mantiene in RAM solo
+    i vettori quantizzati; con `on_disk_vectors` gli originali (usati per il
+    rescore) restano su disco. `hnsw_m` e `hnsw_ef_construct` configurano
+    l'indice. Valgono alla creazione della collection: per cambiarli su una
+    collection esistente serve un `full_rebuild`. Con una collection
+    quantizzata, oversampling e rescore a query time si attivano a parte
+    nell'orchestrator (SEARCH_OVERSAMPLING / SEARCH_RESCORE, opt-in).
+
+    Se l'upload modifica i dati (punti caricati o rimossi, swap dell'alias)
+    viene scritta una nuova revisione in `<collection_name>_revision`: le
+    repliche del RAG orchestrator la controllano periodicamente e invalidano
+    la propria cache semantica. Un run incrementale senza modifiche lascia
+    revisione e cache invariate.
+    """
     from qdrant_client import QdrantClient
-    from qdrant_client.models import Distance, VectorParams, PointStruct
-    import json
-    import hashlib
+    from qdrant_client.models import (
+        Distance, VectorParams, Filter, FilterSelector,
+        FieldCondition, MatchValue, MatchAny, Range, OptimizersConfigDiff,
+        CollectionStatus, CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation,
+        PayloadSchemaType, HnswConfigDiff, ScalarQuantization, ScalarQuantizationConfig,
+        ScalarType, BinaryQuantization, BinaryQuantizationConfig, PointStruct
+    )
+    import itertools
     import os
+    import time
+    import uuid
+    from datetime import datetime, timezone
+    import numpy as np
+    from rag_pipeline.shards import iter_records, point_id, read_manifest
     
-    client = QdrantClient(url=qdrant_url)
+    if full_rebuild and keep_versions < 1:
+        raise ValueError(f"keep_versions deve essere >= 1 (ricevuto {keep_versions})")
+
+    client = QdrantClient(url=qdrant_url, prefer_grpc=prefer_grpc, grpc_port=grpc_port)
     
-    # Crea collection se non esiste
-    try:
-        client.create_collection(
-            collection_name=collection_name,
-            vectors_config=VectorParams(
-                size=vector_size,
-                distance=Distance.COSINE
-            )
+    vectors_config = VectorParams(
+        size=vector_size,
+        distance=Distance.COSINE,
+        on_disk=on_disk_vectors
+    )
+    hnsw_config = HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct)
+
+    # Vettori quantizzati sempre in RAM: la ricerca HNSW li usa al posto
+    # degli originali (int8 = 4x meno memoria, binario = 32x)
+    if quantization == "scalar":
+        quantization_config = ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
         )
-        print(f"Collection '{collection_name}' creata")
-    except Exception as e:
-        print(f"Collection già esistente: {e}")
-    
-    # Carica embeddings
-    embeddings_file = os.path.join(embeddings.path, "embeddings.json")
-    with open(embeddings_file, 'r', encoding='utf-8') as f:
-        embedded_chunks = json.load(f)
+    elif quantization == "binary":
+        quantization_config = BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    elif quantization == "none":
+        quantization_config = None
+    else:
+        raise ValueError(f"quantization non supportata: {quantization}")
+
+    def alias_target(alias):
+        """Collection a cui punta l'alias (None se l'alias non esiste)."""
+        for description in client.get_aliases().aliases:
+            if description.alias_name == alias:
+                return description.collection_name
+        return None
+
+    def collection_names():
+        return [c.name for c in client.get_collections().collections]
+
+    live_collection = alias_target(collection_name)
+    if full_rebuild and live_collection is None and collection_name in collection_names():
+        raise ValueError(
+            f"'{collection_name}' è una collection reale, non un alias: la prima migrazione al full rebuild "
+            f"è un passaggio manuale (rebuild con un nuovo collection_name, COLLECTION_NAME "
+            f"dell'orchestrator sul nuovo alias, poi eliminazione di '{collection_name}')"
+        )
+    if full_rebuild:
+        # Blue/green: nuova collection versionata, costruita senza indicizzazione
+        # e resa visibile solo a fine caricamento spostando l'alias
+        # Timestamp UTC al microsecondo (l'ordine dei nomi è cronologico); se un
+        # rebuild concorrente ha già creato lo stesso nome se ne genera un altro
+        for attempt in range(5):
+            target_collection = f"{collection_name}_v{datetime.now(timezone.utc):%Y%m%d%H%M%S%f}"
+            try:
+                client.create_collection(
+                    collection_name=target_collection,
+                    vectors_config=vectors_config,
+                    hnsw_config=hnsw_config,
+                    quantization_config=quantization_config,
+                    optimizers_config=OptimizersConfigDiff(indexing_threshold=0)
+                )
+                break
+            except Exception:
+                if target_collection not in collection_names():
+                    raise
+                print(f"⚠️ Collection '{target_collection}' già esistente, nuovo nome...")
+                time.sleep(0.01)
+        else:
+            raise RuntimeError(f"Impossibile creare una nuova versione di '{collection_name}'")
+        print(f"Full rebuild: collection '{target_collection}' creata (alias '{collection_name}' -> {live_collection})")
+    else:
+        # Le operazioni sull'alias vengono risolte da Qdrant sulla collection corrente
+        target_collection = collection_name
+        if live_collection is None and collection_name not in collection_names():
+            client.create_collection(
+                collection_name=target_collection,
+                vectors_config=vectors_config,
+                hnsw_config=hnsw_config,
+                quantization_config=quantization_config
+            )
+            print(f"Collection '{collection_name}' creata")
+
+    # Payload index per filtri e cancellazioni: la ricerca filtrata e i
+    # lookup del manifest non scansionano i payload (idempotente)
+    payload_indexes = {
+        "source": PayloadSchemaType.KEYWORD,
+        "references[].source": PayloadSchemaType.KEYWORD,
+        "chunk_id": PayloadSchemaType.INTEGER,
+        "file_hash": PayloadSchemaType.KEYWORD,
+        "chunk_hash": PayloadSchemaType.KEYWORD,
+    }
+    existing_indexes = client.get_collection(target_collection).payload_schema
+    for field_name, field_schema in payload_indexes.items():
+        if field_name not in existing_indexes:
+            client.create_payload_index(
+                collection_name=target_collection,
+                field_name=field_name,
+                field_schema=field_schema
+            )
+            print(f"Payload index creato: {field_name} ({field_schema.value})")
     
-    # Genera ID deterministici per i nuovi chunk
-    new_points = []
+    embeddings_manifest = read_manifest(embeddings.path)
+    sources = embeddings_manifest.get("sources", {})
+    incremental = embeddings_manifest.get("incremental", False)
+    incomplete_sources = set(embeddings_manifest.get("incomplete_sources", []))
+    dedup = embeddings_manifest.get("dedup", "none")
+    # Matrice degli embeddings in memory-map: vengono lette solo le righe del batch
+    matrix = np.load(os.path.join(embeddings.path, embeddings_manifest["matrix"]), mmap_mode="r")
+
+    # Upsert nuovi/aggiornati chunk in streaming con upload_collection: la
+    # matrice in memory-map viene letta a fette di `upload_batch_size` righe
+    # mentre i metadati scorrono in parallelo (in memoria restano solo gli
+    # ID, per il calcolo dei chunk obsoleti)
+    total_points = int(matrix.shape[0])
+    total_batches = (total_points - 1) // upload_batch_size + 1 if total_points else 0
     new_ids = set()
-    
-    for chunk in embedded_chunks:
-        chunk_identifier = f"{chunk['source']}_{chunk['chunk_id']}"
-        chunk_id = hashlib.md5(chunk_identifier.encode()).hexdigest()
-        new_ids.add(chunk_id)
-        
-        point = PointStruct(
-            id=chunk_id,
-            vector=chunk['embedding'],
-            payload={
+
+    records_for_ids, records_for_payload = itertools.tee(iter_records(embeddings.path, embeddings_manifest))
+
+    def iter_ids():
+        for index, chunk in enumerate(records_for_ids):
+            # Le righe della matrice seguono l'ordine dei metadati
+            if chunk['row'] != index:
+                raise ValueError(f"Riga {chunk['row']} fuori ordine (attesa {index})")
+            chunk_id = point_id(chunk['source'], chunk['chunk_id'])
+            new_ids.add(chunk_id)
+            if (index + 1) % (upload_batch_size * 50) == 0:
+                elapsed = time.perf_counter() - started
+                print(f"Inviati {index + 1}/{total_points} punti ({(index + 1) / elapsed:.0f} punti/s)")
+            yield chunk_id
+
+    def iter_payloads():
+        # Il file_hash non va nel payload qui: viene scritto sul chunk 0
+        # solo a upload completato, così un run interrotto viene ripetuto
+        for chunk in records_for_payload:
+            payload = {
                 'source': chunk['source'],
                 'chunk_id': chunk['chunk_id'],
-                'content': chunk['content']
+                'content': chunk['content'],
+                'chunk_hash': chunk.get('chunk_hash')
             }
+            # Chunk deduplicato: tutte le occorrenze del testo nel corpus
+            if 'references' in chunk:
+                payload['references'] = chunk['references']
+            yield payload
+
+    # Indicizzazione HNSW rimandata durante il caricamento massivo
+    previous_threshold = None
+    if full_rebuild:
+        # Creata con indexing_threshold=0: a fine upload si applica quella live
+        live_config = client.get_collection(collection_name).config if live_collection else None
+        previous_threshold = live_config.optimizer_config.indexing_threshold if live_config else 20000
+        if previous_threshold == 0:
+            previous_threshold = 20000
+    elif defer_indexing and total_points:
+        previous_threshold = client.get_collection(target_collection).config.optimizer_config.indexing_threshold
+        client.update_collection(
+            collection_name=target_collection,
+            optimizers_config=OptimizersConfigDiff(indexing_threshold=0)
         )
-        new_points.append(point)
-    
-    # Recupera tutti gli ID esistenti in Qdrant
-    existing_ids = set()
-    offset = None
-    while True:
-        records, offset = client.scroll(
-            collection_name=collection_name,
-            limit=100,
-            offset=offset,
-            with_payload=False,
-            with_vectors=False
-        )
-        existing_ids.update([record.id for record in records])
-        if offset is None:
+        print(f"Indicizzazione sospesa (indexing_threshold {previous_threshold} -> 0)")
+
+    started = time.perf_counter()
+    try:
+        if total_points:
+            print(f"Upload di {total_points} punti in {total_batches} batch da {upload_batch_size} "
+                  f"({'gRPC' if prefer_grpc else 'REST'}, {upload_workers} worker, wait={wait_for_batches})")
+            client.upload_collection(
+                collection_name=target_collection,
+                vectors=matrix,
+                payload=iter_payloads(),
+                ids=iter_ids(),
+                batch_size=upload_batch_size,
+                parallel=upload_workers,
+                wait=wait_for_batches
+            )
+        elapsed = time.perf_counter() - started
+        if total_points:
+            print(f"✓ {total_points} punti inviati in {elapsed:.1f}s ({total_points / elapsed:.0f} punti/s)")
+
+        # Senza attesa per batch: verifica finale che tutti i punti siano applicati
+        if not wait_for_batches and new_ids:
+            pending_ids = list(new_ids)
+            deadline = time.monotonic() + consistency_timeout_s
+            while True:
+                found = set()
+                for start in range(0, len(pending_ids), 1000):
+                    records = client.retrieve(
+                        collection_name=target_collection,
+                        ids=pending_ids[start:start + 1000],
+                        with_payload=False,
+                        with_vectors=False
+                    )
+                    found.update(str(record.id).replace("-", "") for record in records)
+                pending_ids = [point for point in pending_ids if point not in found]
+                if not pending_ids:
+                    break
+                if time.monotonic() > deadline:
+                    raise RuntimeError(
+                        f"Verifica di consistenza fallita: {len(pending_ids)} punti assenti "
+                        f"dopo {consistency_timeout_s}s"
+                    )
+                print(f"In attesa di {len(pending_ids)} punti non ancora applicati...")
+                time.sleep(1)
+            elapsed = time.perf_counter() - started
+            print(f"✓ Verifica di consistenza: {len(new_ids)} punti presenti dopo {elapsed:.1f}s")
+    finally:
+        if previous_threshold is not None:
+            client.update_collection(
+                collection_name=target_collection,
+                optimizers_config=OptimizersConfigDiff(indexing_threshold=previous_threshold)
+            )
+            print(f"Indicizzazione riattivata (indexing_threshold {previous_threshold})")
+
+    # Rimozione dei chunk obsoleti (dopo l'upsert: la collection non resta
+    # mai senza i chunk di un documento durante l'aggiornamento)
+    removed_sources = []
+    obsolete_count = 0
+    if full_rebuild:
+        # Collection nuova: contiene solo i punti appena caricati
+        pass
+    elif incremental:
+        # Solo parte dei chunk è nell'artifact: si rimuovono per filtro le
+        # code dei documenti modificati e i documenti non più presenti
+        existing_sources = set()
+        offset = None
+        while True:
+            records, offset = client.scroll(
+                collection_name=target_collection,
+                scroll_filter=Filter(must=[FieldCondition(key="chunk_id", match=MatchValue(value=0))]),
+                limit=256,
+                offset=offset,
+                with_payload=["source"],
+                with_vectors=False
+            )
+            existing_sources.update(record.payload["source"] for record in records)
+            if offset is None:
+                break
+
+        for source, info in sources.items():
+            if info['status'] in ("new", "changed"):
+                client.delete(
+                    collection_name=target_collection,
+                    points_selector=FilterSelector(filter=Filter(must=[
+                        FieldCondition(key="source", match=MatchValue(value=source)),
+                        FieldCondition(key="chunk_id", range=Range(gte=info['chunk_count']))
+                    ]))
+                )
+
+        removed_sources = sorted(existing_sources - set(sources))
+        if removed_sources:
+            print(f"Rimozione di {len(removed_sources)} documenti non più presenti...")
+            client.delete(
+                collection_name=target_collection,
+                points_selector=FilterSelector(filter=Filter(must=[
+                    FieldCondition(key="source", match=MatchAny(any=removed_sources))
+                ]))
+            )
+            print(f"✓ Documenti rimossi: {', '.join(removed_sources)}")
+    else:
+        # Recupera tutti gli ID esistenti in Qdrant
+        existing_ids = set()
+        offset = None
+        while True:
+            records, offset = client.scroll(
+                collection_name=target_collection,
+                limit=100,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False
+            )
+            existing_ids.update([str(record.id).replace("-", "") for record in records])
+            if offset is None:
+                break
+
+        # Identifica chunk obsoleti da eliminare
+        obsolete_ids = existing_ids - new_ids
+        obsolete_count = len(obsolete_ids)
+
+        if obsolete_ids:
+            print(f"Rimozione {len(obsolete_ids)} chunk obsoleti...")
+            client.delete(
+                collection_name=target_collection,
+                points_selector=list(obsolete_ids)
+            )
+            print(f"✓ Chunk obsoleti rimossi")
+
+    # Manifest: il file_hash sul chunk 0 marca la source come caricata.
+    # Con la deduplica il chunk 0 di una source può non esistere come punto
+    # (è un riferimento di un altro chunk): il manifest non viene scritto e
+    # il run successivo riprocessa tutto
+    completed = 0
+    for source, info in sources.items():
+        if dedup != "none":
             break
+        if info['status'] in ("new", "changed") and info.get('chunk_count') and source not in incomplete_sources:
+            client.set_payload(
+                collection_name=target_collection,
+                payload={'file_hash': info['file_hash']},
+                points=[point_id(source, 0)]
+            )
+            completed += 1
+
+    skipped = sum(info['status'] == "unchanged" for info in sources.values())
+    print(f"✓ Upload completato: {len(new_ids)} chunks, {obsolete_count} chunk obsoleti rimossi")
+    print(f"✓ Documenti: {completed} aggiornati, {skipped} invariati, "
+          f"{len(incomplete_sources)} incompleti, {len(removed_sources)} rimossi")
     
-    # Identifica chunk obsoleti da eliminare
-    obsolete_ids = existing_ids - new_ids
-    
-    if obsolete_ids:
-        print(f"Rimozione {len(obsolete_ids)} chunk obsoleti...")
-        client.delete(
-            collection_name=collection_name,
-            points_selector=list(obsolete_ids)
+    if full_rebuild:
+        # Attende la fine dell'indicizzazione prima di esporre la nuova versione.
+        # Subito dopo il ripristino di indexing_threshold la collection può
+        # risultare ancora GREEN perché l'optimizer non è ripartito: prima si
+        # attende che l'indicizzazione inizi (stato non GREEN) o sia completa
+        deadline = time.monotonic() + index_timeout_s
+        start_deadline = time.monotonic() + index_start_timeout_s
+        while True:
+            info = client.get_collection(target_collection)
+            if info.status != CollectionStatus.GREEN or (info.indexed_vectors_count or 0) >= (info.points_count or 0):
+                break
+            if time.monotonic() > start_deadline:
+                print(f"⚠️ Indicizzazione non avviata in {index_start_timeout_s}s "
+                      f"({info.indexed_vectors_count}/{info.points_count} vettori indicizzati)")
+                break
+            time.sleep(2)
+        while client.get_collection(target_collection).status != CollectionStatus.GREEN:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Indicizzazione di '{target_collection}' non completata in {index_timeout_s}s")
+            time.sleep(2)
+        info = client.get_collection(target_collection)
+        print(f"✓ Indicizzazione completata: {info.indexed_vectors_count}/{info.points_count} vettori indicizzati")
+
+        operations = []
+        if live_collection is not None:
+            operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=collection_name)))
+        operations.append(CreateAliasOperation(
+            create_alias=CreateAlias(collection_name=target_collection, alias_name=collection_name)
+        ))
+        # Delete + create nella stessa richiesta: lo swap è atomico
+        client.update_collection_aliases(change_aliases_operations=operations)
+        print(f"✓ Alias '{collection_name}' -> '{target_collection}' (prima: {live_collection})")
+
+        # GC: si tengono la versione attiva e le `keep_versions - 1` precedenti.
+        # Le versioni più recenti di quella attiva non vengono mai toccate:
+        # possono essere rebuild ancora in corso
+        older_versions = sorted(
+            name for name in collection_names()
+            if name.startswith(f"{collection_name}_v") and name[len(collection_name) + 2:].isdigit()
+            and name < target_collection
         )
-        print(f"✓ Chunk obsoleti rimossi")
-    
-    # Upsert nuovi/aggiornati chunk
-    batch_size = 100
-    for i in range(0, len(new_points), batch_size):
-        batch = new_points[i:i+batch_size]
-        client.upsert(
-            collection_name=collection_name,
-            points=batch
+        for name in older_versions[:max(0, len(older_versions) - (keep_versions - 1))]:
+            client.delete_collection(name)
+            print(f"  → Versione rimossa: {name}")
+
+    data_changed = (
+        bool(total_points) or full_rebuild or obsolete_count > 0 or bool(removed_sources)
+        or any(info['status'] in ("new", "changed") for info in sources.values())
+    )
+    if not data_changed:
+        print("✓ Nessuna modifica ai dati: revisione e cache semantica invariate")
+        return
+
+    # Nuova revisione dei dati: ogni replica del RAG orchestrator la confronta
+    # periodicamente e invalida la propria cache semantica quando cambia
+    revision_collection = f"{collection_name}_revision"
+    if revision_collection not in collection_names():
+        client.create_collection(
+            collection_name=revision_collection,
+            vectors_config=VectorParams(size=1, distance=Distance.DOT)
         )
-        print(f"Uploaded batch {i//batch_size + 1}/{(len(new_points)-1)//batch_size + 1}")
-    
-    print(f"✓ Upload completato: {len(new_points)} chunks, {len(obsolete_ids)} rimossi")
+    revision = uuid.uuid4().hex
+    client.upsert(
+        collection_name=revision_collection,
+        points=[PointStruct(id=0, vector=[0.0], payload={"revision": revision, "collection": target_collection,
+                                                          "updated_at": time.time()})]
+    )
+    print(f"✓ Revisione dei dati: {revision}")
+
+    # Invalida subito la cache della replica raggiunta (errori non bloccanti)
+    if cache_invalidate_url:
+        import urllib.request
+        try:
+            request = urllib.request.Request(cache_invalidate_url, data=b"", method="POST")
+            urllib.request.urlopen(request, timeout=10)
+            print(f"✓ Cache semantica invalidata: {cache_invalidate_url}")
+        except Exception as e:
+            print(f"⚠️ Invalidazione cache non riuscita ({cache_invalidate_url}): {e}")
 
 @dsl.pipeline(
     name='Document Processing Pipeline',
@@ -314,13 +1131,35 @@ def document_processing_pipeline(
     hf_api_key: str = '',
     chunk_size: int = 1000,
     chunk_overlap: int = 200,
+    chunk_workers: int = 4,
     embedding_model: str = 'sentence-transformers/all-MiniLM-L6-v2',
+    embedding_concurrency: int = 4,
+    embedding_backend: str = 'hf_api',
+    embedding_service_url: str = 'http://embedding-service.kubeflow-user-example-com.svc.cluster.local/v1/models/embedding-model:predict',
+    min_embedding_coverage: float = 0.99,
     qdrant_url: str = 'http://qdrant:6333',
     collection_name: str = 'documents',
-    vector_size: int = 384
+    vector_size: int = 384,
+    cache_invalidate_url: str = 'http://rag-orchestrator-service.kubeflow-user-example-com.svc.cluster.local/cache/invalidate',
+    incremental: bool = True,
+    # Bulk upload (opt-in): gRPC, batch in parallelo senza attesa per batch
+    # e indicizzazione HNSW rimandata a fine caricamento
+    qdrant_prefer_grpc: bool = False,
+    upload_workers: int = 1,
+    upload_batch_size: int = 100,
+    upload_wait_for_batches: bool = True,
+    upload_defer_indexing: bool = False,
+    full_rebuild: bool = False,
+    keep_versions: int = 2,
+    dedup: str = 'none',
+    # Quantizzazione e vettori originali su disco (opt-in, vedi upload_to_qdrant)
+    quantization: str = 'none',
+    on_disk_vectors: bool = False,
+    hnsw_m: int = 16,
+    hnsw_ef_construct: int = 100
 ):
     download_task = download_from_minio(
-        git_repo_url='https://github.com/vincenzo426/MLOpsRepo',  # Inserisci URL del tuo repo
+        git_repo_url=PIPELINE_REPO_URL,
         git_branch='main',
         minio_endpoint=minio_endpoint,
         access_key=minio_access_key,
@@ -330,22 +1169,53 @@ def document_processing_pipeline(
     chunk_task = chunk_documents(
         documents=download_task.outputs['output_dataset'],
         chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap
+        chunk_overlap=chunk_overlap,
+        num_workers=chunk_workers,
+        qdrant_url=qdrant_url,
+        collection_name=collection_name,
+        incremental=incremental,
+        full_rebuild=full_rebuild,
+        dedup=dedup
     )
     
-    embed_task = create_embeddings(
+    embed_args = dict(
         chunks=chunk_task.outputs['output_chunks'],
         model_name=embedding_model,
-        hf_api_key=hf_api_key
-    )
-    
-    upload_task = upload_to_qdrant(
-        embeddings=embed_task.outputs['output_embeddings'],
+        hf_api_key=hf_api_key,
         qdrant_url=qdrant_url,
         collection_name=collection_name,
-        vector_size=vector_size
+        max_concurrency=embedding_concurrency,
+        min_coverage=min_embedding_coverage,
+        backend=embedding_backend,
+        kserve_url=embedding_service_url
     )
 
+    def upload(embed_task):
+        return upload_to_qdrant(
+            embeddings=embed_task.outputs['output_embeddings'],
+            qdrant_url=qdrant_url,
+            collection_name=collection_name,
+            vector_size=vector_size,
+            cache_invalidate_url=cache_invalidate_url,
+            prefer_grpc=qdrant_prefer_grpc,
+            upload_batch_size=upload_batch_size,
+            upload_workers=upload_workers,
+            wait_for_batches=upload_wait_for_batches,
+            defer_indexing=upload_defer_indexing,
+            full_rebuild=full_rebuild,
+            keep_versions=keep_versions,
+            quantization=quantization,
+            on_disk_vectors=on_disk_vectors,
+            hnsw_m=hnsw_m,
+            hnsw_ef_construct=hnsw_ef_construct
+        )
+
+    # Variante con torch solo per il backend locale
+    with dsl.If(embedding_backend == 'local', name='local-embedding-backend'):
+        upload(create_embeddings_local(**embed_args).set_display_name('create-embeddings-local'))
+    with dsl.Else(name='remote-embedding-backend'):
+        upload(create_embeddings(**embed_args))
+
 
 if __name__ == '__main__':
     compiler.Compiler().compile(
@@ -0,0 +1,9 @@
+"""
+Codice condiviso dai componenti di kubeflow_pipeline.py, dal model server di
+embedding (kserve-embedding) e dai servizi RAG (rag_orchestrator, rag_api_local).
+
+I componenti KFP lightweight sono serializzati senza il resto del modulo:
+questo pacchetto viene installato in ciascuno tramite `packages_to_install`
+(vedi PIPELINE_LIB in kubeflow_pipeline.py). Le immagini dei servizi lo
+installano da pipeline_lib/ durante la build.
+"""
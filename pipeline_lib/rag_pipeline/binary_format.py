@@ -0,0 +1,66 @@
+"""
+Formato binario compatto per le risposte di EmbeddingPredictor.
+
+Layout (little-endian):
+    magic   4 byte   b"EMB1"
+    dtype   1 byte   b"f" (float32) | b"e" (float16)
+    pad     3 byte
+    rows    uint32
+    dim     uint32
+    data    rows * dim * itemsize byte, row-major
+
+Il client lo richiede con l'header `X-Embedding-Format: f32|f16`;
+senza header (o con `json`) la risposta resta {"predictions": [...]}.
+"""
+import struct
+from typing import Dict, Optional
+
+import numpy as np
+
+FORMAT_HEADER = "x-embedding-format"
+MAGIC = b"EMB1"
+_HEADER = struct.Struct("<4sc3xII")
+
+_DTYPES = {
+    "f32": np.dtype("<f4"),
+    "f16": np.dtype("<f2"),
+}
+_DTYPE_CODES = {np.dtype("<f4"): b"f", np.dtype("<f2"): b"e"}
+_CODE_DTYPES = {code: dtype for dtype, code in _DTYPE_CODES.items()}
+
+
+def requested_format(headers: Optional[Dict]) -> str:
+    """Restituisce 'json', 'f32' o 'f16' in base agli header della richiesta."""
+    if not headers:
+        return "json"
+    for key, value in headers.items():
+        if key.lower() == FORMAT_HEADER:
+            value = str(value).strip().lower()
+            return value if value in _DTYPES else "json"
+    return "json"
+
+
+def encode_embeddings(embeddings: np.ndarray, fmt: str = "f32") -> bytes:
+    matrix = np.ascontiguousarray(np.atleast_2d(embeddings), dtype=_DTYPES[fmt])
+    rows, dim = matrix.shape
+    return _HEADER.pack(MAGIC, _DTYPE_CODES[matrix.dtype], rows, dim) + matrix.tobytes()
+
+
+def is_binary_payload(payload: bytes) -> bool:
+    return payload[:4] == MAGIC
+
+
+def decode_embeddings(payload: bytes) -> np.ndarray:
+    """Decodifica un payload binario in una matrice float32 (rows, dim)."""
+    if len(payload) < _HEADER.size:
+        raise ValueError(f"Payload di embedding binario troncato ({len(payload)} byte)")
+    magic, code, rows, dim = _HEADER.unpack_from(payload)
+    if magic != MAGIC or code not in _CODE_DTYPES:
+        raise ValueError(f"Payload di embedding binario non valido (magic {magic!r}, dtype {code!r})")
+    dtype = _CODE_DTYPES[code]
+    expected = _HEADER.size + rows * dim * dtype.itemsize
+    if len(payload) != expected:
+        raise ValueError(f"Payload di embedding binario di {len(payload)} byte, attesi {expected} "
+                         f"({rows}x{dim} {dtype.name})")
+    matrix = np.frombuffer(payload, dtype=dtype, count=rows * dim, offset=_HEADER.size)
+    return matrix.reshape(rows, dim).astype(np.float32, copy=False)
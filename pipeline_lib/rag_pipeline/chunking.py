@@ -0,0 +1,61 @@
+"""
+Task di parsing e splitting eseguiti dal pool di processi di chunk_documents.
+
+Sono funzioni di modulo (serializzabili con pickle) così che il pool possa
+riceverle indipendentemente dal metodo di avvio dei processi. Le dipendenze
+(langchain, pypdfium2) sono installate dal componente.
+"""
+from typing import List, Tuple
+
+
+def load_and_split(file_path: str, chunk_size: int, chunk_overlap: int) -> Tuple[str, List[str]]:
+    """Task per un file intero: restituisce ("chunks", lista di chunk)."""
+    from langchain_community.document_loaders import PyPDFium2Loader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    if file_path.lower().endswith('.pdf'):
+        loader = PyPDFium2Loader(file_path)
+        pdf_pages = loader.load()
+        # Uniamo il testo di tutte le pagine
+        content = "\n".join([doc.page_content for doc in pdf_pages])
+    else:
+        # Assumiamo che gli altri file siano di testo
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read()
+    if not (content and content.strip()):
+        return "chunks", []
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len
+    )
+    return "chunks", splitter.split_text(content)
+
+
+def extract_pages(file_path: str, start: int, end: int) -> Tuple[str, List[str]]:
+    """Task per un intervallo di pagine di un PDF: restituisce ("pages", testi)."""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        texts = []
+        for index in range(start, end):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return "pages", texts
+    finally:
+        pdf.close()
+
+
+def run_task(task: tuple) -> tuple:
+    """Esegue un task ("file" | "pages", args) isolando gli errori: l'eccezione torna come risultato."""
+    kind, args = task
+    try:
+        if kind == "file":
+            return load_and_split(*args)
+        return extract_pages(*args)
+    except Exception as e:
+        return "error", f"{type(e).__name__}: {e}"
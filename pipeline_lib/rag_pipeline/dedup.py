@@ -0,0 +1,112 @@
+"""
+Deduplica dei chunk tra documenti, usata da chunk_documents (`dedup`).
+
+- "exact":   sha256 del testo normalizzato (minuscolo, spazi compattati)
+- "minhash": in più i quasi-duplicati, con MinHash LSH su trigrammi di parole
+             (richiede `datasketch`, installato dal componente)
+
+Resta il primo chunk di ogni gruppo, con tutti i riferimenti source/chunk_id
+in `references`. In memoria restano solo gli hash (e le firme MinHash): i
+chunk canonici e i riferimenti dei duplicati sono scritti su disco man mano;
+i riferimenti, ordinati a blocchi per chunk canonico, sono poi uniti ai
+canonici con un merge in streaming.
+"""
+import hashlib
+import heapq
+import json
+import os
+from typing import Optional, Set
+
+from .shards import ShardWriter, iter_records
+
+MODES = ("none", "exact", "minhash")
+# Riferimenti dei duplicati ordinati in memoria per ogni run su disco
+RUN_SIZE = 100000
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def word_trigrams(text: str) -> Set[str]:
+    """Trigrammi di parole del testo normalizzato (il testo intero se più corto)."""
+    words = text.split()
+    return {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def deduplicate(raw_path: str, output_path: str, mode: str, sources: dict, shard_size: int,
+                compression: str, minhash_threshold: float = 0.9, minhash_num_perm: int = 128,
+                run_size: int = RUN_SIZE) -> ShardWriter:
+    """
+    Riscrive i chunk dell'artifact in `raw_path` in `output_path` tenendo un
+    record per gruppo di duplicati. File temporanei in `raw_path`.
+    """
+    if mode not in ("exact", "minhash"):
+        raise ValueError(f"Modalità di deduplica non supportata: {mode}")
+    lsh = None
+    if mode == "minhash":
+        from datasketch import MinHash, MinHashLSH
+        lsh = MinHashLSH(threshold=minhash_threshold, num_perm=minhash_num_perm)
+
+    # 1. Primo passaggio: i chunk canonici (prima occorrenza) in uno shard
+    #    temporaneo, i duplicati come (indice canonico, indice, riferimento)
+    #    in run ordinate di al più `run_size` righe
+    canonical_writer = ShardWriter(os.path.join(raw_path, "canonical"), "chunks", shard_size, compression)
+    runs = []
+    pending = []
+
+    def flush_references():
+        if not pending:
+            return
+        pending.sort()
+        run_path = os.path.join(raw_path, f"references-{len(runs):05d}.jsonl")
+        with open(run_path, "w", encoding="utf-8") as f:
+            for entry in pending:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        runs.append(run_path)
+        pending.clear()
+
+    by_hash = {}
+    for index, record in enumerate(iter_records(raw_path)):
+        text = normalize(record['content'])
+        key = hashlib.sha256(text.encode('utf-8')).digest()
+        canonical: Optional[int] = by_hash.get(key)
+        if canonical is None and lsh is not None:
+            minhash = MinHash(num_perm=minhash_num_perm)
+            minhash.update_batch([shingle.encode('utf-8') for shingle in word_trigrams(text)])
+            matches = lsh.query(minhash)
+            if matches:
+                canonical = min(matches)
+            else:
+                lsh.insert(index, minhash)
+        if canonical is None:
+            canonical = index
+        by_hash.setdefault(key, canonical)
+        if canonical == index:
+            canonical_writer.write({**record, '_index': index})
+        else:
+            pending.append([canonical, index, record['source'], record['chunk_id']])
+            if len(pending) >= run_size:
+                flush_references()
+    flush_references()
+    canonical_writer.close()
+
+    # 2. Secondo passaggio: canonici e riferimenti sono entrambi ordinati per
+    #    indice canonico, quindi basta scorrerli insieme
+    run_files = [open(run_path, "r", encoding="utf-8") for run_path in runs]
+    try:
+        references = heapq.merge(*[map(json.loads, f) for f in run_files])
+        reference = next(references, None)
+        deduplicated = ShardWriter(output_path, "chunks", shard_size, compression)
+        for record in iter_records(canonical_writer.path):
+            index = record.pop('_index')
+            group = [{'source': record['source'], 'chunk_id': record['chunk_id']}]
+            while reference is not None and reference[0] == index:
+                group.append({'source': reference[2], 'chunk_id': reference[3]})
+                reference = next(references, None)
+            deduplicated.write({**record, 'references': group})
+    finally:
+        for f in run_files:
+            f.close()
+    deduplicated.close(incremental=False, sources=sources, dedup=mode)
+    return deduplicated
@@ -0,0 +1,51 @@
+"""
+Matrice degli embeddings (`embeddings.npy`) scritta da create_embeddings e
+letta in memory-map da upload_to_qdrant.
+"""
+import struct
+
+import numpy as np
+
+
+class MatrixWriter:
+    """
+    Scrive i vettori riga per riga in un .npy memory-mapped. La capacità
+    (chunk in ingresso) è un limite superiore: a fine scrittura l'header
+    viene riscritto con il numero reale di righe e il file troncato.
+    """
+
+    def __init__(self, path: str, capacity: int, dtype):
+        self.path = path
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.dim = 0
+        self._matrix = None
+
+    def write(self, vector) -> int:
+        """Aggiunge una riga e ne restituisce l'indice."""
+        if self._matrix is None:
+            self.dim = len(vector)
+            self._matrix = np.lib.format.open_memmap(
+                self.path, mode="w+", dtype=self.dtype, shape=(max(self.capacity, 1), self.dim)
+            )
+        self._matrix[self.rows] = vector
+        self.rows += 1
+        return self.rows - 1
+
+    def close(self):
+        if self._matrix is None:
+            np.save(self.path, np.zeros((0, 0), dtype=self.dtype))
+            return
+        offset = self._matrix.offset
+        self._matrix.flush()
+        del self._matrix
+        # Header npy 1.0 riscritto in place con la stessa lunghezza
+        # (il nuovo shape ha al più tante cifre quanto la capacità)
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%d, %d), }" % (
+            np.lib.format.dtype_to_descr(self.dtype), self.rows, self.dim
+        )
+        header = header.ljust(offset - 10 - 1) + "\n"
+        with open(self.path, "r+b") as f:
+            f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+            f.truncate(offset + self.rows * self.dim * self.dtype.itemsize)
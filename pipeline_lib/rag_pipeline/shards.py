@@ -0,0 +1,68 @@
+"""
+Artifact JSON Lines a shard scambiati tra i componenti della pipeline.
+
+Un artifact è una directory con gli shard (`<prefix>-00000.jsonl[.gz]`, ...)
+e un `manifest.json` con l'elenco degli shard, il numero di record e i campi
+aggiunti dal componente che lo produce (sources, incremental, dedup, ...).
+"""
+import gzip
+import hashlib
+import json
+import os
+from typing import Iterator, Optional
+
+
+class ShardWriter:
+    """Scrive record JSON Lines ruotando lo shard ogni `shard_size` record."""
+
+    def __init__(self, path: str, prefix: str, shard_size: int, compression: str):
+        self.path = path
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.compression = compression
+        self.shards = []
+        self.count = 0
+        self._file = None
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, record: dict):
+        if self._file is None or self.count % self.shard_size == 0:
+            self._rotate()
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        suffix = ".jsonl.gz" if self.compression == "gzip" else ".jsonl"
+        name = f"{self.prefix}-{len(self.shards):05d}{suffix}"
+        opener = gzip.open if self.compression == "gzip" else open
+        self._file = opener(os.path.join(self.path, name), "wt", encoding="utf-8")
+        self.shards.append(name)
+
+    def close(self, **extra):
+        """Chiude lo shard corrente e scrive il manifest (con i campi `extra`)."""
+        if self._file is not None:
+            self._file.close()
+        with open(os.path.join(self.path, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"format": "jsonl", "shards": self.shards, "count": self.count, **extra}, f)
+
+
+def read_manifest(dataset_path: str) -> dict:
+    with open(os.path.join(dataset_path, "manifest.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_records(dataset_path: str, manifest: Optional[dict] = None) -> Iterator[dict]:
+    """Legge in modo lazy i record di un artifact JSON Lines a shard."""
+    manifest = manifest or read_manifest(dataset_path)
+    for shard in manifest["shards"]:
+        opener = gzip.open if shard.endswith(".gz") else open
+        with opener(os.path.join(dataset_path, shard), "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def point_id(source: str, chunk_id: int) -> str:
+    """ID del punto Qdrant di un chunk (stabile tra i run)."""
+    return hashlib.md5(f"{source}_{chunk_id}".encode()).hexdigest()
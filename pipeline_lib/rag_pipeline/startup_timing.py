@@ -0,0 +1,26 @@
+"""
+Tempi delle fasi di avvio, condivisi da EmbeddingPredictor e dai servizi RAG
+(rag_orchestrator/rag_metrics.py).
+
+Ogni fase è salvata nel dizionario dei tempi (riportato nei log) e sul Gauge
+Prometheus indicato, con label "phase"; una fase che fallisce viene comunque
+registrata con la durata fino all'errore.
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+def record_startup_phase(gauge, timings: Dict[str, float], phase: str, seconds: float):
+    timings[phase] = seconds
+    gauge.labels(phase).set(seconds)
+
+
+@contextmanager
+def startup_phase(gauge, timings: Dict[str, float], phase: str):
+    """Misura una fase di avvio (riportata nei log e su /metrics)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_phase(gauge, timings, phase, time.perf_counter() - started)
@@ -1,4 +1,7 @@
 import os
+import time
+# Inizio dell'avvio: include il tempo di import di torch/sentence-transformers
+_import_started = time.perf_counter()
 from fastapi import FastAPI, HTTPException, Body
 from pydantic import BaseModel
 from qdrant_client import QdrantClient
@@ -6,6 +9,18 @@ from sentence_transformers import SentenceTransformer
 from huggingface_hub import InferenceClient
 from dotenv import load_dotenv
 import uvicorn
+from typing import Optional
+
+# Metriche condivise con il RAG orchestrator (stessi nomi in locale e nel cluster)
+from rag_orchestrator.rag_metrics import RETRIEVED_CHUNKS, TIME_TO_FIRST_TOKEN, instrument_app, observe_stage, record_error, record_startup_phase, startup_phase, track_stage
+# Filtro, parametri di ricerca e costruzione del contesto condivisi con il RAG orchestrator
+from rag_orchestrator.query_filter import QueryFilter, build_qdrant_filter
+from rag_orchestrator.search_params import SearchOptions, build_search_params
+from rag_orchestrator.context_builder import TokenCounter
+# Prompt ed eventi SSE condivisi con il RAG orchestrator (stessi messaggi e stesso formato di streaming)
+from rag_orchestrator.rag_prompt import NO_CONTEXT_ANSWER, done_event, prepare_prompt, sse_event, sse_response
+# Warm-up del modello di embedding (EMBEDDING_WARMUP_BATCH_SIZE), come nell'orchestrator
+from rag_orchestrator.embedding_warmup import EMBEDDING_WARMUP_BATCH_SIZE, warmup_embedding_model
 
 # Carica le variabili dal tuo file .env (per HF_API_KEY, ecc.)
 load_dotenv()
@@ -16,6 +31,8 @@ load_dotenv()
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
 COLLECTION_NAME = "documents" # Come definito in document_pipeline.yaml
 EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2" # DEVE corrispondere a document_pipeline.yaml
+# Snapshot locale del modello (es. `make model-snapshot`): caricato senza accedere all'hub
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")
 HF_API_KEY = os.getenv("HF_API_KEY")
 HF_LLM_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct" # <-- MODIFICATO
 
@@ -27,21 +44,45 @@ if not HF_API_KEY:
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 3
+    filter: Optional[QueryFilter] = None
+    # hnsw_ef / exact / oversampling / rescore (default da SEARCH_*)
+    search: Optional[SearchOptions] = None
 
 class QueryResponse(BaseModel):
     answer: str
     retrieved_sources: list[str]
+    # Token del prompt inviato all'LLM
+    prompt_tokens: Optional[int] = None
 
 # --- 3. Inizializzazione Globale (Modelli caricati all'avvio) ---
 # Questi oggetti vengono creati una sola volta all'avvio del server.
+# Durata di ogni fase di avvio (log, /health e /metrics)
+startup_timings = {}
+record_startup_phase(startup_timings, "imports", time.perf_counter() - _import_started)
+
+# Tokenizer dell'LLM per il budget del contesto (CONTEXT_TOKENIZER / CONTEXT_MAX_TOKENS)
+with startup_phase(startup_timings, "tokenizer"):
+    token_counter = TokenCounter(token=HF_API_KEY)
+
 try:
     print("Inizializzazione servizio RAG...")
     
-    print(f"Caricamento modello di embedding: {EMBEDDING_MODEL_NAME}...")
-    # 1. Carica il modello di embedding (SentenceTransformer)
-    embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    # 1. Carica il modello di embedding (SentenceTransformer), dallo snapshot locale se presente
+    with startup_phase(startup_timings, "load_model"):
+        if EMBEDDING_MODEL_PATH:
+            print(f"Caricamento modello di embedding dallo snapshot: {EMBEDDING_MODEL_PATH}...")
+            embedding_model = SentenceTransformer(EMBEDDING_MODEL_PATH, local_files_only=True)
+        else:
+            print(f"Caricamento modello di embedding: {EMBEDDING_MODEL_NAME}...")
+            embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
     print("✓ Modello di embedding caricato.")
 
+    # Warm-up: la prima query reale non paga l'inizializzazione lazy di torch
+    if EMBEDDING_WARMUP_BATCH_SIZE > 0:
+        with startup_phase(startup_timings, "warmup"):
+            warmup_embedding_model(embedding_model)
+        print(f"✓ Warm-up completato (batch da {EMBEDDING_WARMUP_BATCH_SIZE}).")
+
     print(f"Connessione a Qdrant: {QDRANT_URL}...")
     # 2. Si connette a Qdrant
     qdrant_client = QdrantClient(url=QDRANT_URL)
@@ -54,6 +95,8 @@ try:
     print(f"Utilizzo chiave: {HF_API_KEY}")
     print("✓ Client Hugging Face inizializzato.")
     
+    record_startup_phase(startup_timings, "total", time.perf_counter() - _import_started)
+    print("Avvio: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_timings.items()))
     print("\n🚀 Servizio RAG pronto.")
     
 except Exception as e:
@@ -63,11 +106,31 @@ except Exception as e:
     qdrant_client = None
     hf_client = None
 
-# --- 4. Creazione dell'App FastAPI ---
+# --- 4. Funzioni di supporto ---
+def retrieve(query: str, top_k: int, query_filter: Optional[QueryFilter] = None,
+             options: Optional[SearchOptions] = None):
+    """Vettorizza la query e cerca i chunk più simili in Qdrant (eventualmente filtrata)."""
+    with track_stage("embedding"):
+        query_vector = embedding_model.encode(query).tolist()
+    print(f"Ricerca in Qdrant (top_k={top_k})...")
+    with track_stage("search"):
+        results = qdrant_client.search(
+            collection_name=COLLECTION_NAME,
+            query_vector=query_vector,
+            query_filter=build_qdrant_filter(query_filter),
+            search_params=build_search_params(options),
+            limit=top_k,
+            with_payload=True
+        )
+    RETRIEVED_CHUNKS.inc(len(results))
+    return results
+
+# --- 5. Creazione dell'App FastAPI ---
 app = FastAPI(
     title="RAG Inference API (Local)",
     description="API per interrogare un sistema RAG con Qdrant e Hugging Face"
 )
+instrument_app(app)
 
 @app.post("/query", response_model=QueryResponse)
 async def query_rag(request: QueryRequest = Body(...)):
@@ -81,69 +144,31 @@ async def query_rag(request: QueryRequest = Body(...)):
         raise HTTPException(status_code=503, detail="Servizio non inizializzato correttamente. Controlla i log all'avvio.")
         
     try:
-        # --- Step 1: Vettorizza la query ---
+        # --- Step 1-2: Vettorizza la query e cerca in Qdrant ---
         print(f"\nQuery ricevuta: {request.query}")
-        query_vector = embedding_model.encode(request.query).tolist()
-
-        # --- Step 2: Cerca in Qdrant ---
-        print(f"Ricerca in Qdrant (top_k={request.top_k})...")
-        search_results = qdrant_client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=query_vector,
-            limit=request.top_k,
-            with_payload=True
-        )
+        search_results = retrieve(request.query, request.top_k, request.filter, request.search)
         
         # --- Step 3: Estrai contesto e sorgenti ---
-        context = ""
-        sources = set()
-        
         if not search_results:
             print("Nessun risultato trovato in Qdrant.")
-            return QueryResponse(answer="Non ho trovato informazioni rilevanti nei documenti per rispondere a questa domanda.", retrieved_sources=[])
+            return QueryResponse(answer=NO_CONTEXT_ANSWER, retrieved_sources=[])
 
         print(f"Trovati {len(search_results)} chunk rilevanti.")
-        for result in search_results:
-            if 'content' in result.payload:
-                context += f"\n---\n{result.payload['content']}"
-            if 'source' in result.payload:
-                sources.add(result.payload['source'])
-
         # --- Step 4: Costruisci i Messaggi per 'chat_completion' ---
-        # (Questo sostituisce il vecchio prompt in formato [INST])
-        
-        # 4.1. Definiamo le istruzioni di sistema
-        system_message = (
-            "Sei un assistente AI. Usa esclusivamente il seguente contesto per rispondere alla domanda."
-            " Rispondi solo in base al contesto fornito."
-            " Se la risposta non è nel contesto, dì 'Non ho trovato informazioni sufficienti per rispondere'."
-        )
-        
-        # 4.2. Creiamo il prompt dell'utente con contesto e domanda
-        user_message = f"""
-        Contesto:
-        {context}
-
-        Domanda:
-        {request.query}
-        """
-        
-        # 4.3. Formattiamo i messaggi come richiesto dall'API
-        messages = [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": user_message}
-        ]
+        # (contesto senza sovrapposizioni ed entro CONTEXT_MAX_TOKENS)
+        context, messages = prepare_prompt(request.query, search_results, token_counter)
         
         # --- Step 5: Chiama l'LLM via Hugging Face (con chat_completion) ---
         print(f"Invio prompt all'LLM ({HF_LLM_MODEL}) con il task 'chat_completion'...")
         
         # Sostituiamo hf_client.text_generation con hf_client.chat_completion
-        response = hf_client.chat_completion(
-            model=HF_LLM_MODEL,
-            messages=messages,
-            max_tokens=512,  # 'max_new_tokens' diventa 'max_tokens' in questa API
-            temperature=0.7
-        )
+        with track_stage("llm"):
+            response = hf_client.chat_completion(
+                model=HF_LLM_MODEL,
+                messages=messages,
+                max_tokens=512,  # 'max_new_tokens' diventa 'max_tokens' in questa API
+                temperature=0.7
+            )
         
         # Estraiamo la risposta (il formato è diverso)
         response_text = response.choices[0].message.content
@@ -151,7 +176,8 @@ async def query_rag(request: QueryRequest = Body(...)):
         print(f"Risposta LLM: {response_text.strip()}")
         return QueryResponse(
             answer=response_text.strip(),
-            retrieved_sources=list(sources)
+            retrieved_sources=list(context.sources),
+            prompt_tokens=context.prompt_tokens
         )
 
     except Exception as e:
@@ -160,16 +186,79 @@ async def query_rag(request: QueryRequest = Body(...)):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+def query_rag_stream(request: QueryRequest = Body(...)):
+    """
+    Come /query, ma in Server-Sent Events:
+    1. evento `sources` con le sorgenti recuperate
+    2. eventi `token` con i token dell'LLM man mano che arrivano
+    3. evento `done` con i tempi (incluso il time-to-first-token)
+    Endpoint sincrono: FastAPI lo esegue nel threadpool, quindi i client
+    bloccanti non fermano l'event loop.
+    """
+    if not all([embedding_model, qdrant_client, hf_client]):
+        raise HTTPException(status_code=503, detail="Servizio non inizializzato correttamente. Controlla i log all'avvio.")
+
+    started = time.perf_counter()
+    try:
+        print(f"\nQuery ricevuta (streaming): {request.query}")
+        search_results = retrieve(request.query, request.top_k, request.filter, request.search)
+    except Exception as e:
+        print(f"❌ Errore durante il retrieval: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    retrieved = time.perf_counter()
+    context, messages = prepare_prompt(request.query, search_results, token_counter)
+
+    def event_stream():
+        yield sse_event("sources", {"retrieved_sources": list(context.sources)})
+
+        if not context.text:
+            yield sse_event("token", {"text": NO_CONTEXT_ANSWER})
+            yield done_event(started, retrieved, time.perf_counter(), None, context, 0)
+            return
+
+        llm_started = time.perf_counter()
+        first_token_at = None
+        tokens = 0
+        try:
+            stream = hf_client.chat_completion(
+                model=HF_LLM_MODEL,
+                messages=messages,
+                max_tokens=512,
+                temperature=0.7,
+                stream=True
+            )
+            for chunk in stream:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if not token:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    TIME_TO_FIRST_TOKEN.observe(first_token_at - started)
+                tokens += 1
+                yield sse_event("token", {"text": token})
+        except Exception as e:
+            print(f"❌ Errore LLM in streaming: {e}")
+            record_error("llm")
+            yield sse_event("error", {"detail": str(e)})
+            return
+
+        finished = time.perf_counter()
+        observe_stage("llm", finished - llm_started)
+        yield done_event(started, retrieved, finished, first_token_at, context, tokens)
+
+    return sse_response(event_stream())
+
 @app.get("/health")
 async def health_check():
     """Controlla la salute del servizio e la connessione a Qdrant."""
     try:
         qdrant_client.health_check()
-        return {"status": "ok", "qdrant_connection": "ok"}
+        return {"status": "ok", "qdrant_connection": "ok", "startup_s": startup_timings}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Qdrant non raggiungibile: {e}")
 
-# --- 5. Blocco di Esecuzione ---
+# --- 6. Blocco di Esecuzione ---
 # Questo permette di eseguire lo script direttamente con: python rag_api_local.py
 if __name__ == "__main__":
     print("Avvio server FastAPI locale su http://localhost:8000")
@@ -0,0 +1,162 @@
+"""
+Costruzione del contesto del prompt, condivisa da rag_orchestrator e rag_api_local.
+
+I chunk sono prodotti con `chunk_overlap`: due chunk consecutivi dello stesso
+documento ripetono lo stesso testo. Il contesto viene quindi costruito così:
+  1. i chunk recuperati sono raggruppati per `source` e ordinati per `chunk_id`;
+     quelli consecutivi sono fusi eliminando la parte sovrapposta
+  2. i blocchi risultanti seguono l'ordine di rilevanza (miglior chunk del blocco)
+  3. i blocchi sono aggiunti finché rientrano in CONTEXT_MAX_TOKENS, contati
+     con il tokenizer (Rust, `tokenizers`) dell'LLM se CONTEXT_TOKENIZER è
+     impostato, altrimenti stimati dai caratteri; l'ultimo può essere troncato
+"""
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional, Set
+
+# Token massimi del contesto (0 = nessun limite)
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "2048"))
+# tokenizer.json locale o repository Hugging Face dell'LLM, opt-in (vuoto =
+# stima da caratteri). Il repository di Llama 3 è gated: serve un token con accesso
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "")
+
+CHUNK_SEPARATOR = "\n---\n"
+# Sovrapposizione minima (caratteri) per considerare due chunk come contigui
+MIN_OVERLAP_CHARS = 20
+# Un blocco troncato a meno token di così non viene aggiunto
+MIN_TRUNCATED_TOKENS = 32
+# Stima usata senza tokenizer
+CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    """Conta e tronca testo in token; senza tokenizer usa una stima da caratteri."""
+
+    def __init__(self, name: str = CONTEXT_TOKENIZER, token: Optional[str] = None):
+        self.tokenizer = None
+        if not name:
+            print(f"Tokenizer del contesto non configurato (CONTEXT_TOKENIZER): "
+                  f"stima di {CHARS_PER_TOKEN} caratteri per token")
+            return
+        try:
+            from tokenizers import Tokenizer
+            if os.path.isfile(name):
+                self.tokenizer = Tokenizer.from_file(name)
+            else:
+                self.tokenizer = Tokenizer.from_pretrained(name, token=token)
+            print(f"✓ Tokenizer del contesto caricato: {name}")
+        except Exception as e:
+            print(f"❌ Tokenizer '{name}' non disponibile ({e}): il budget del contesto usa una STIMA di "
+                  f"{CHARS_PER_TOKEN} caratteri per token e può superare o sprecare CONTEXT_MAX_TOKENS")
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        if self.tokenizer is None:
+            return [-(-len(text) // CHARS_PER_TOKEN) for text in texts]
+        return [len(encoding.ids) for encoding in self.tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def count_messages(self, messages: List[dict]) -> int:
+        """Token del prompt (contenuto dei messaggi, escluso il chat template)."""
+        return sum(self.count_batch([message["content"] for message in messages]))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.tokenizer is None:
+            return text[:max_tokens * CHARS_PER_TOKEN]
+        encoding = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(encoding.ids) <= max_tokens:
+            return text
+        return text[:encoding.offsets[max_tokens - 1][1]]
+
+
+@dataclass
+class PromptContext:
+    text: str = ""
+    sources: Set[str] = field(default_factory=set)
+    # Token del contesto, chunk recuperati e blocchi effettivamente inclusi
+    tokens: int = 0
+    chunks: int = 0
+    blocks: int = 0
+    truncated: bool = False
+    # Token dell'intero prompt (impostato da chi costruisce i messaggi)
+    prompt_tokens: int = 0
+
+
+def overlap_length(previous: str, following: str) -> int:
+    """Lunghezza del suffisso di `previous` con cui inizia `following`."""
+    anchor = following[:MIN_OVERLAP_CHARS]
+    if len(anchor) < MIN_OVERLAP_CHARS:
+        return 0
+    # La prima occorrenza valida è la sovrapposizione più lunga
+    start = previous.find(anchor)
+    while start != -1:
+        if following.startswith(previous[start:]):
+            return len(previous) - start
+        start = previous.find(anchor, start + 1)
+    return 0
+
+
+def merge_chunks(search_results) -> List[dict]:
+    """Fonde i chunk consecutivi dello stesso documento, in ordine di rilevanza."""
+    runs = {}
+    seen_contents = set()
+    for rank, result in enumerate(search_results):
+        payload = result.payload or {}
+        content = payload.get("content")
+        if not content or content in seen_contents:
+            continue
+        seen_contents.add(content)
+        runs.setdefault(payload.get("source"), []).append((payload.get("chunk_id"), rank, payload))
+
+    blocks = []
+    for source, chunks in runs.items():
+        chunks.sort(key=lambda chunk: (chunk[0] is None, chunk[0] or 0))
+        block = None
+        for chunk_id, rank, payload in chunks:
+            contiguous = (block is not None and chunk_id is not None
+                          and block["last_chunk_id"] is not None and chunk_id == block["last_chunk_id"] + 1)
+            if contiguous:
+                overlap = overlap_length(block["text"], payload["content"])
+                block["text"] += payload["content"][overlap:] if overlap else "\n" + payload["content"]
+                block["rank"] = min(block["rank"], rank)
+                block["payloads"].append(payload)
+            else:
+                block = {"text": payload["content"], "rank": rank, "payloads": [payload]}
+                blocks.append(block)
+            block["last_chunk_id"] = chunk_id
+    blocks.sort(key=lambda block: block["rank"])
+    return blocks
+
+
+def build_context(search_results, token_counter: TokenCounter, max_tokens: int = CONTEXT_MAX_TOKENS) -> PromptContext:
+    """Contesto testuale e sorgenti dai risultati di Qdrant, entro `max_tokens`."""
+    context = PromptContext(chunks=len(search_results))
+    blocks = merge_chunks(search_results)
+    pieces = [CHUNK_SEPARATOR + block["text"] for block in blocks]
+    counts = token_counter.count_batch(pieces) if pieces else []
+
+    texts = []
+    for block, piece, count in zip(blocks, pieces, counts):
+        if max_tokens and context.tokens + count > max_tokens:
+            remaining = max_tokens - context.tokens
+            if remaining < MIN_TRUNCATED_TOKENS:
+                context.truncated = True
+                break
+            piece = token_counter.truncate(piece, remaining)
+            count = token_counter.count(piece)
+            context.truncated = True
+        texts.append(piece)
+        context.tokens += count
+        context.blocks += 1
+        for payload in block["payloads"]:
+            if payload.get("source"):
+                context.sources.add(payload["source"])
+            # Chunk deduplicato in ingestion: lo stesso testo compare in più documenti
+            for reference in payload.get("references", []):
+                context.sources.add(reference["source"])
+        if context.truncated:
+            break
+
+    context.text = "".join(texts)
+    return context
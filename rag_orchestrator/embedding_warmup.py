@@ -0,0 +1,21 @@
+"""
+Warm-up del modello di embedding in-process, condiviso da rag_orchestrator
+(EMBEDDING_BACKEND=local) e rag_api_local.
+
+Prima di dichiarare il servizio pronto si eseguono una query singola e un
+batch di EMBEDDING_WARMUP_BATCH_SIZE testi: la prima query reale non paga
+l'inizializzazione lazy di torch (allocatori, thread pool intra-op).
+"""
+import os
+
+# Testi del batch di warm-up (0 = disabilitato)
+EMBEDDING_WARMUP_BATCH_SIZE = int(os.getenv("EMBEDDING_WARMUP_BATCH_SIZE", "8"))
+
+
+def warmup_embedding_model(model, batch_size: int = EMBEDDING_WARMUP_BATCH_SIZE) -> bool:
+    """Esegue il warm-up di `model`; False se disabilitato (batch_size <= 0)."""
+    if batch_size <= 0:
+        return False
+    model.encode("Domanda di warm-up")
+    model.encode(["Testo di warm-up del modello di embedding."] * batch_size)
+    return True
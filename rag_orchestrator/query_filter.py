@@ -0,0 +1,34 @@
+"""
+Filtro opzionale delle query RAG, condiviso da rag_orchestrator e rag_api_local.
+
+Il filtro è tradotto in un `Filter` di Qdrant applicato durante la ricerca
+HNSW. Usa solo campi con payload index (creati da upload_to_qdrant), così
+una query filtrata costa quanto una non filtrata anche su collection grandi.
+"""
+import json
+from typing import List, Optional
+
+from pydantic import BaseModel
+from qdrant_client.models import FieldCondition, Filter, MatchAny
+
+
+class QueryFilter(BaseModel):
+    # Limita la ricerca ai chunk di questi documenti (campo `source`)
+    sources: Optional[List[str]] = None
+
+
+def build_qdrant_filter(query_filter: Optional[QueryFilter]) -> Optional[Filter]:
+    if query_filter is None or not query_filter.sources:
+        return None
+    # Un chunk deduplicato appartiene anche ai documenti in `references`
+    return Filter(should=[
+        FieldCondition(key="source", match=MatchAny(any=query_filter.sources)),
+        FieldCondition(key="references[].source", match=MatchAny(any=query_filter.sources)),
+    ])
+
+
+def filter_scope(query_filter: Optional[QueryFilter]) -> str:
+    """Rappresentazione canonica del filtro per la chiave della cache semantica."""
+    if query_filter is None or not query_filter.sources:
+        return ""
+    return json.dumps({"sources": sorted(set(query_filter.sources))}, separators=(",", ":"))
@@ -0,0 +1,106 @@
+"""
+Metriche Prometheus condivise dai servizi RAG (rag_orchestrator e rag_api_local).
+
+Gli stessi nomi sono usati in entrambi i servizi, così le dashboard funzionano
+sia in locale che nel cluster. Le label sono pre-risolte all'import per
+mantenere trascurabile il costo nell'hot path.
+"""
+import time
+from contextlib import contextmanager
+
+from fastapi import FastAPI, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from rag_pipeline import startup_timing
+
+STAGES = ("embedding", "search", "prompt", "llm")
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_LATENCY = Histogram(
+    "rag_stage_duration_seconds",
+    "Durata di ciascuna fase della query RAG",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "rag_stage_errors_total",
+    "Errori per fase della query RAG",
+    ["stage"],
+)
+REQUEST_LATENCY = Histogram(
+    "rag_request_duration_seconds",
+    "Durata complessiva delle richieste per endpoint",
+    ["endpoint"],
+    buckets=_LATENCY_BUCKETS,
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "rag_time_to_first_token_seconds",
+    "Tempo dalla ricezione della richiesta al primo token dell'LLM (streaming)",
+    buckets=_LATENCY_BUCKETS,
+)
+RETRIEVED_CHUNKS = Counter(
+    "rag_retrieved_chunks_total",
+    "Chunk restituiti dalla ricerca vettoriale",
+)
+PROMPT_TOKENS = Histogram(
+    "rag_prompt_tokens",
+    "Token del prompt inviato all'LLM (contesto incluso)",
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+
+STARTUP_PHASE_SECONDS = Gauge(
+    "rag_startup_phase_seconds",
+    "Durata delle fasi di avvio del servizio",
+    ["phase"],
+)
+
+_stage_latency = {stage: STAGE_LATENCY.labels(stage) for stage in STAGES}
+_stage_errors = {stage: STAGE_ERRORS.labels(stage) for stage in STAGES}
+
+
+def observe_stage(stage: str, seconds: float):
+    _stage_latency[stage].observe(seconds)
+
+
+def record_error(stage: str):
+    _stage_errors[stage].inc()
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Misura la durata di una fase e conta le eccezioni che la attraversano."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        _stage_errors[stage].inc()
+        raise
+    finally:
+        _stage_latency[stage].observe(time.perf_counter() - started)
+
+
+def record_startup_phase(timings: dict, phase: str, seconds: float):
+    startup_timing.record_startup_phase(STARTUP_PHASE_SECONDS, timings, phase, seconds)
+
+
+def startup_phase(timings: dict, phase: str):
+    """Misura una fase di avvio (riportata nei log e su /metrics)."""
+    return startup_timing.startup_phase(STARTUP_PHASE_SECONDS, timings, phase)
+
+
+def instrument_app(app: FastAPI):
+    """Registra l'endpoint /metrics e la latenza delle richieste per route."""
+    @app.middleware("http")
+    async def _request_latency(request: Request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        # Label sul path della route (non sull'URL) per limitare la cardinalità;
+        # per le risposte in streaming misura il tempo fino all'invio degli header
+        route = request.scope.get("route")
+        if route is not None:
+            REQUEST_LATENCY.labels(route.path).observe(time.perf_counter() - started)
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
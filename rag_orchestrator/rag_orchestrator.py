@@ -2,123 +2,525 @@
 # rag_orchestrator.py
 #
 import os
-import requests
+import asyncio
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import httpx
 from fastapi import FastAPI, HTTPException, Body
 from pydantic import BaseModel
-from qdrant_client import QdrantClient
-from huggingface_hub import InferenceClient
-from typing import List, Optional
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import SearchRequest
+from typing import AsyncIterator, List, Optional
+
+from query_filter import QueryFilter, build_qdrant_filter, filter_scope
+from search_params import SearchOptions, build_search_params, search_scope
+from context_builder import TokenCounter
+from rag_metrics import (RETRIEVED_CHUNKS, TIME_TO_FIRST_TOKEN, instrument_app, observe_stage, record_error,
+                         startup_phase, track_stage)
+from rag_prompt import NO_CONTEXT_ANSWER, done_event, prepare_prompt, sse_event, sse_response
+from semantic_cache import SemanticCache
+from embedding_warmup import EMBEDDING_WARMUP_BATCH_SIZE, warmup_embedding_model
+from rag_pipeline.binary_format import decode_embeddings, is_binary_payload
 
 # --- CONFIGURAZIONE ---
+# Backend di embedding: "kserve" (servizio remoto, default) oppure "local"
+# (modello caricato nel processo all'avvio, niente hop di rete)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "kserve").lower()
+# Con EMBEDDING_BACKEND=local: modello (come nella pipeline) e thread per encode
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+# Snapshot locale del modello (come nel predictor KServe): se impostato, il
+# modello viene letto da qui senza contattare l'hub
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "2"))
+
 # URL del servizio di embedding (interno al cluster Kubernetes)
 # Nota: La porta 80 è quella del Service di KServe, che gira il traffico al pod sulla 8080
 EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "http://embedding-service.kubeflow-user-example-com.svc.cluster.local/v1/models/embedding-model:predict")
 
+# Formato della risposta di embedding: "json" (default) oppure binario "f32"/"f16"
+# (vedi pipeline_lib/rag_pipeline/binary_format.py)
+EMBEDDING_RESPONSE_FORMAT = os.getenv("EMBEDDING_RESPONSE_FORMAT", "json").lower()
+
 # Configurazione Qdrant (URL interno al cluster)
 QDRANT_URL = os.getenv("QDRANT_URL", "http://qdrant:6333")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "documents")
+# Collection in cui la pipeline scrive la revisione dei dati a ogni upload
+REVISION_COLLECTION_NAME = os.getenv("REVISION_COLLECTION_NAME", f"{COLLECTION_NAME}_revision")
 
 # Configurazione LLM (Hugging Face)
 HF_API_KEY = os.getenv("HF_API_KEY")
 HF_LLM_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
+# Endpoint chat completion (compatibile OpenAI) del router Hugging Face
+HF_CHAT_URL = os.getenv("HF_CHAT_URL", "https://router.huggingface.co/v1/chat/completions")
 
 if not HF_API_KEY:
     print("⚠️ ATTENZIONE: HF_API_KEY non trovato.")
 
+# Timeout (secondi) per servizio
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "10"))
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "10"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+# Limiti dei connection pool (per client): query concorrenti servibili da un worker
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+
+# Cache semantica delle risposte (0 voci = disabilitata)
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+# Similarità coseno minima perché due query siano considerate equivalenti
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_S = float(os.getenv("SEMANTIC_CACHE_TTL_S", "3600"))
+# Ogni quanti secondi verificare se la collection è stata modificata
+SEMANTIC_CACHE_CHECK_INTERVAL_S = float(os.getenv("SEMANTIC_CACHE_CHECK_INTERVAL_S", "30"))
+
+# /query/batch: numero massimo di query per richiesta e generazioni LLM concorrenti
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "256"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
 # --- CLIENTS ---
+# Client asincroni con connessioni keep-alive persistenti: nessuna chiamata blocca l'event loop
+http_limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+
+# Servizio di embedding (KServe)
+embedding_http = httpx.AsyncClient(limits=http_limits, timeout=EMBEDDING_TIMEOUT)
+
+# Embedding in-process (EMBEDDING_BACKEND=local): modello caricato nel lifespan,
+# encode eseguito in un thread pool dedicato per non bloccare l'event loop
+embedding_model = None
+startup_timings = {}
+embedding_executor = ThreadPoolExecutor(max_workers=EMBEDDING_THREADS, thread_name_prefix="embedding")
+
 # Qdrant
 try:
-    qdrant_client = QdrantClient(url=QDRANT_URL)
+    qdrant_client = AsyncQdrantClient(url=QDRANT_URL, timeout=QDRANT_TIMEOUT, limits=http_limits)
     print(f"✓ Client Qdrant configurato su {QDRANT_URL}")
 except Exception as e:
     print(f"⚠️ Errore config Qdrant: {e}")
     qdrant_client = None
 
 # Hugging Face
-hf_client = InferenceClient(token=HF_API_KEY)
+llm_http = httpx.AsyncClient(
+    limits=http_limits,
+    timeout=LLM_TIMEOUT,
+    headers={"Authorization": f"Bearer {HF_API_KEY}"} if HF_API_KEY else None,
+)
+
+# Tokenizer dell'LLM per il budget del contesto (CONTEXT_TOKENIZER / CONTEXT_MAX_TOKENS)
+token_counter = TokenCounter(token=HF_API_KEY)
+
+# Cache semantica
+semantic_cache = None
+if SEMANTIC_CACHE_MAX_ENTRIES > 0:
+    semantic_cache = SemanticCache(
+        max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        ttl_s=SEMANTIC_CACHE_TTL_S
+    )
+    print(f"✓ Cache semantica attiva (threshold={SEMANTIC_CACHE_THRESHOLD}, ttl={SEMANTIC_CACHE_TTL_S}s)")
 
 # --- MODELLI DATI ---
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 3
+    filter: Optional[QueryFilter] = None
+    # hnsw_ef / exact / oversampling / rescore (default da SEARCH_*)
+    search: Optional[SearchOptions] = None
 
 class QueryResponse(BaseModel):
     answer: str
     retrieved_sources: list[str]
+    # Token del prompt inviato all'LLM (None se servita dalla cache)
+    prompt_tokens: Optional[int] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 3
+    # Filtro e parametri di ricerca comuni a tutte le query del batch
+    filter: Optional[QueryFilter] = None
+    search: Optional[SearchOptions] = None
+    # Generazioni LLM concorrenti (limitate da BATCH_LLM_CONCURRENCY)
+    max_concurrency: Optional[int] = None
+
+class BatchQueryResult(BaseModel):
+    answer: Optional[str] = None
+    retrieved_sources: list[str] = []
+    prompt_tokens: Optional[int] = None
+    error: Optional[str] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+
+async def collection_revision() -> Optional[str]:
+    """Revisione scritta da upload_to_qdrant a ogni scrittura (None se assente)."""
+    try:
+        points = await qdrant_client.retrieve(REVISION_COLLECTION_NAME, ids=[0], with_payload=True)
+    except Exception:
+        return None
+    return points[0].payload.get("revision") if points else None
+
+async def watch_collection():
+    """
+    Invalida la cache semantica quando la collection cambia (nuova ingestion).
+    Ogni replica esegue il proprio controllo: l'invalidazione non dipende
+    dalla replica raggiunta dalla chiamata a /cache/invalidate.
+    """
+    fingerprint = None
+    while True:
+        try:
+            info = await qdrant_client.get_collection(COLLECTION_NAME)
+            # COLLECTION_NAME può essere un alias spostato da un full rebuild:
+            # anche a parità di punti la collection servita cambia
+            aliases = await qdrant_client.get_aliases()
+            target = next((a.collection_name for a in aliases.aliases if a.alias_name == COLLECTION_NAME), None)
+            # La revisione cambia a ogni upload, anche quando i chunk aggiornati
+            # sostituiscono quelli esistenti senza variare il numero di punti
+            current = (target, info.points_count, await collection_revision())
+            if fingerprint is not None and current != fingerprint:
+                print(f"Collection '{COLLECTION_NAME}' modificata: invalidazione cache semantica")
+                semantic_cache.invalidate()
+            fingerprint = current
+        except Exception as e:
+            print(f"⚠️ Verifica collection fallita: {e}")
+        await asyncio.sleep(SEMANTIC_CACHE_CHECK_INTERVAL_S)
+
+def load_embedding_model():
+    """Carica il modello di embedding in-process ed esegue il warm-up (EMBEDDING_WARMUP_BATCH_SIZE)."""
+    from sentence_transformers import SentenceTransformer
+
+    if EMBEDDING_MODEL_PATH and not os.path.isdir(EMBEDDING_MODEL_PATH):
+        raise RuntimeError(f"Snapshot del modello non trovato: {EMBEDDING_MODEL_PATH}")
+    source = EMBEDDING_MODEL_PATH or EMBEDDING_MODEL_NAME
+    with startup_phase(startup_timings, "load_model"):
+        model = SentenceTransformer(source, device="cpu")
+    if EMBEDDING_WARMUP_BATCH_SIZE > 0:
+        with startup_phase(startup_timings, "warmup"):
+            warmup_embedding_model(model)
+    print(f"✓ Modello di embedding {source} caricato: "
+          + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_timings.items()))
+    return model
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global embedding_model
+    if EMBEDDING_BACKEND == "local" and embedding_model is None:
+        embedding_model = await asyncio.get_running_loop().run_in_executor(embedding_executor, load_embedding_model)
+    watcher = None
+    if semantic_cache and qdrant_client:
+        watcher = asyncio.create_task(watch_collection())
+    yield
+    if watcher:
+        watcher.cancel()
+    # Chiude i connection pool allo shutdown del worker
+    await embedding_http.aclose()
+    await llm_http.aclose()
+    embedding_executor.shutdown(wait=False)
+    if qdrant_client:
+        await qdrant_client.close()
 
-app = FastAPI(title="RAG Orchestrator")
+app = FastAPI(title="RAG Orchestrator", lifespan=lifespan)
+instrument_app(app)
 
-def get_embedding_remote(text: str) -> List[float]:
-    """Chiama il microservizio KServe per ottenere l'embedding."""
-    payload = {"instances": [text]}
+def decode_embedding_response(content: bytes) -> List[List[float]]:
+    """Decodifica la risposta del servizio di embedding (binaria o JSON)."""
+    if is_binary_payload(content):
+        return decode_embeddings(content).tolist()
+
+    # KServe restituisce: {"predictions": [[0.1, 0.2, ...]]}
+    return json.loads(content)["predictions"]
+
+async def get_embeddings_remote(texts: List[str]) -> List[List[float]]:
+    """Chiama il microservizio KServe per ottenere gli embeddings (una sola richiesta)."""
+    payload = {"instances": texts}
+    headers = {}
+    if EMBEDDING_RESPONSE_FORMAT != "json":
+        headers["X-Embedding-Format"] = EMBEDDING_RESPONSE_FORMAT
     
     try:
         print(f"Richiesta embedding a: {EMBEDDING_SERVICE_URL}")
-        response = requests.post(EMBEDDING_SERVICE_URL, json=payload)
-        response.raise_for_status()
-        
-        # KServe restituisce: {"predictions": [[0.1, 0.2, ...]]}
-        data = response.json()
-        embedding = data["predictions"][0]
-        return embedding
+        with track_stage("embedding"):
+            response = await embedding_http.post(EMBEDDING_SERVICE_URL, json=payload, headers=headers)
+            response.raise_for_status()
+            return decode_embedding_response(response.content)
     except Exception as e:
         print(f"❌ Errore chiamata Embedding Service: {e}")
         raise HTTPException(status_code=503, detail=f"Embedding Service error: {str(e)}")
 
+async def get_embeddings_local(texts: List[str]) -> List[List[float]]:
+    """Embeddings calcolati in-process, nel thread pool dedicato."""
+    with track_stage("embedding"):
+        embeddings = await asyncio.get_running_loop().run_in_executor(embedding_executor, embedding_model.encode, texts)
+    return embeddings.tolist()
+
+async def get_embeddings(texts: List[str]) -> List[List[float]]:
+    """Embeddings delle query con il backend configurato (EMBEDDING_BACKEND)."""
+    if EMBEDDING_BACKEND == "local":
+        return await get_embeddings_local(texts)
+    return await get_embeddings_remote(texts)
+
+async def get_embedding(text: str) -> List[float]:
+    return (await get_embeddings([text]))[0]
+
+def llm_payload(messages: List[dict], stream: bool = False) -> dict:
+    return {
+        "model": HF_LLM_MODEL,
+        "messages": messages,
+        "max_tokens": 512,
+        "temperature": 0.7,
+        "stream": stream
+    }
+
+async def generate_answer(messages: List[dict]) -> str:
+    """Chiama l'LLM (chat completion) sul connection pool condiviso."""
+    with track_stage("llm"):
+        response = await llm_http.post(HF_CHAT_URL, json=llm_payload(messages))
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+async def stream_answer(messages: List[dict]) -> AsyncIterator[str]:
+    """Chiama l'LLM in streaming e restituisce i token man mano che arrivano."""
+    async with llm_http.stream("POST", HF_CHAT_URL, json=llm_payload(messages, stream=True)) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            # Formato SSE compatibile OpenAI: "data: {...}" ... "data: [DONE]"
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or []
+            token = choices[0].get("delta", {}).get("content") if choices else None
+            if token:
+                yield token
+
+async def search(query_vector: List[float], top_k: int, query_filter: Optional[QueryFilter] = None,
+                 options: Optional[SearchOptions] = None):
+    """Ricerca dei chunk più simili in Qdrant (eventualmente filtrata)."""
+    with track_stage("search"):
+        results = await qdrant_client.search(
+            collection_name=COLLECTION_NAME,
+            query_vector=query_vector,
+            query_filter=build_qdrant_filter(query_filter),
+            search_params=build_search_params(options),
+            limit=top_k
+        )
+    RETRIEVED_CHUNKS.inc(len(results))
+    return results
+
+def cache_scope(request) -> str:
+    """Parametri che, oltre alla query, determinano la risposta."""
+    return f"top_k={request.top_k};filter={filter_scope(request.filter)};search={search_scope(request.search)}"
+
 @app.post("/query", response_model=QueryResponse)
 async def query_rag(request: QueryRequest = Body(...)):
     if not qdrant_client:
         raise HTTPException(status_code=503, detail="Qdrant non disponibile")
 
-    # 1. Ottieni Embedding (Chiamata remota)
-    query_vector = get_embedding_remote(request.query)
+    # 1. Ottieni Embedding (KServe o in-process, vedi EMBEDDING_BACKEND)
+    query_vector = await get_embedding(request.query)
+
+    # Cache semantica: una query equivalente già servita salta ricerca e LLM
+    scope = cache_scope(request)
+    cached = semantic_cache.lookup(query_vector, scope) if semantic_cache else None
+    if cached:
+        print(f"✓ Risposta dalla cache semantica per: '{request.query}'")
+        return QueryResponse(answer=cached.answer, retrieved_sources=cached.sources)
 
     # 2. Cerca in Qdrant
+    started = time.perf_counter()
     print(f"Ricerca Qdrant per: '{request.query}'")
-    search_results = qdrant_client.search(
-        collection_name=COLLECTION_NAME,
-        query_vector=query_vector,
-        limit=request.top_k
-    )
-
-    context_text = ""
-    sources = set()
-    
-    for result in search_results:
-        payload = result.payload or {}
-        if 'content' in payload:
-            context_text += f"\n---\n{payload['content']}"
-        if 'source' in payload:
-            sources.add(payload['source'])
+    search_results = await search(query_vector, request.top_k, request.filter, request.search)
+    context, messages = prepare_prompt(request.query, search_results, token_counter)
 
-    if not context_text:
-        return QueryResponse(answer="Nessun documento rilevante trovato.", retrieved_sources=[])
+    if not context.text:
+        return QueryResponse(answer=NO_CONTEXT_ANSWER, retrieved_sources=[])
 
     # 3. Genera risposta con LLM
-    system_message = "Sei un assistente utile. Rispondi alla domanda usando solo il contesto fornito."
-    user_message = f"Contesto:{context_text}\n\nDomanda: {request.query}"
-    
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": user_message}
-    ]
 
     print("Invio a LLM...")
     try:
-        response = hf_client.chat_completion(
-            model=HF_LLM_MODEL,
-            messages=messages,
-            max_tokens=512,
-            temperature=0.7
-        )
-        answer = response.choices[0].message.content
-        return QueryResponse(answer=answer, retrieved_sources=list(sources))
-
+        answer = await generate_answer(messages)
     except Exception as e:
         print(f"❌ Errore LLM: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    if semantic_cache:
+        semantic_cache.store(query_vector, scope, answer, list(context.sources), 1000 * (time.perf_counter() - started))
+    return QueryResponse(answer=answer, retrieved_sources=list(context.sources), prompt_tokens=context.prompt_tokens)
+
+@app.post("/query/stream")
+async def query_rag_stream(request: QueryRequest = Body(...)):
+    """
+    Come /query, ma in Server-Sent Events:
+    1. evento `sources` con le sorgenti recuperate
+    2. eventi `token` con i token dell'LLM man mano che arrivano
+    3. evento `done` con i tempi (incluso il time-to-first-token)
+    Un errore durante la generazione viene inviato come evento `error`.
+    """
+    if not qdrant_client:
+        raise HTTPException(status_code=503, detail="Qdrant non disponibile")
+
+    started = time.perf_counter()
+    query_vector = await get_embedding(request.query)
+    embedded = time.perf_counter()
+
+    scope = cache_scope(request)
+    cached = semantic_cache.lookup(query_vector, scope) if semantic_cache else None
+    if cached:
+        print(f"✓ Risposta dalla cache semantica per: '{request.query}'")
+
+        async def cached_stream():
+            yield sse_event("sources", {"retrieved_sources": cached.sources})
+            yield sse_event("token", {"text": cached.answer})
+            yield sse_event("done", {"cache_hit": True, "total_ms": 1000 * (time.perf_counter() - started)})
+
+        return sse_response(cached_stream())
+
+    search_results = await search(query_vector, request.top_k, request.filter, request.search)
+    retrieved = time.perf_counter()
+    context, messages = prepare_prompt(request.query, search_results, token_counter)
+
+    async def event_stream():
+        yield sse_event("sources", {"retrieved_sources": list(context.sources)})
+
+        if not context.text:
+            yield sse_event("token", {"text": NO_CONTEXT_ANSWER})
+            yield done_event(started, retrieved, time.perf_counter(), None, context, 0, cache_hit=False)
+            return
+
+        print("Invio a LLM (streaming)...")
+        llm_started = time.perf_counter()
+        first_token_at = None
+        tokens = []
+        try:
+            async for token in stream_answer(messages):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    TIME_TO_FIRST_TOKEN.observe(first_token_at - started)
+                tokens.append(token)
+                yield sse_event("token", {"text": token})
+        except Exception as e:
+            print(f"❌ Errore LLM: {e}")
+            record_error("llm")
+            yield sse_event("error", {"detail": str(e)})
+            return
+
+        finished = time.perf_counter()
+        observe_stage("llm", finished - llm_started)
+        if semantic_cache:
+            semantic_cache.store(query_vector, scope, "".join(tokens), list(context.sources), 1000 * (finished - embedded))
+        yield done_event(started, retrieved, finished, first_token_at, context, len(tokens), cache_hit=False)
+
+    return sse_response(event_stream())
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_rag_batch(request: BatchQueryRequest = Body(...)):
+    """
+    Esegue molte query in tre fasi:
+    1. un'unica chiamata di embedding per tutte le query (`instances` a KServe o encode in-process)
+    2. un'unica ricerca batch in Qdrant (solo per le query non in cache)
+    3. generazioni LLM concorrenti, limitate da max_concurrency
+    I risultati mantengono l'ordine delle query; l'errore di una query
+    viene riportato nel suo campo `error` senza far fallire le altre.
+    """
+    if not qdrant_client:
+        raise HTTPException(status_code=503, detail="Qdrant non disponibile")
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"Massimo {BATCH_MAX_QUERIES} query per richiesta")
+    if not request.queries:
+        return BatchQueryResponse(results=[])
+
+    # 1. Embedding di tutte le query in una sola chiamata
+    print(f"Batch di {len(request.queries)} query")
+    query_vectors = await get_embeddings(request.queries)
+
+    results: List[Optional[BatchQueryResult]] = [None] * len(request.queries)
+    scope = cache_scope(request)
+    pending = []
+    for i, query_vector in enumerate(query_vectors):
+        cached = semantic_cache.lookup(query_vector, scope) if semantic_cache else None
+        if cached:
+            results[i] = BatchQueryResult(answer=cached.answer, retrieved_sources=cached.sources)
+        else:
+            pending.append(i)
+
+    # 2. Ricerca batch in Qdrant
+    started = time.perf_counter()
+    batch_results = []
+    if pending:
+        search_filter = build_qdrant_filter(request.filter)
+        search_params = build_search_params(request.search)
+        try:
+            with track_stage("search"):
+                batch_results = await qdrant_client.search_batch(
+                    collection_name=COLLECTION_NAME,
+                    requests=[
+                        SearchRequest(vector=query_vectors[i], filter=search_filter, params=search_params,
+                                      limit=request.top_k, with_payload=True)
+                        for i in pending
+                    ]
+                )
+        except Exception as e:
+            # Le query servite dalla cache restano valide: le altre riportano l'errore
+            print(f"❌ Errore ricerca batch Qdrant: {e}")
+            for i in pending:
+                results[i] = BatchQueryResult(error=f"Qdrant search error: {e}")
+            return BatchQueryResponse(results=results)
+        RETRIEVED_CHUNKS.inc(sum(len(hits) for hits in batch_results))
+    searched_ms = 1000 * (time.perf_counter() - started)
+
+    # 3. Generazioni LLM concorrenti con limite di parallelismo
+    concurrency = min(request.max_concurrency or BATCH_LLM_CONCURRENCY, BATCH_LLM_CONCURRENCY)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer_one(i: int, search_results) -> BatchQueryResult:
+        try:
+            context, messages = prepare_prompt(request.queries[i], search_results, token_counter)
+        except Exception as e:
+            print(f"❌ Errore nella costruzione del prompt per la query {i}: {e}")
+            return BatchQueryResult(error=f"Prompt error: {e}")
+        if not context.text:
+            return BatchQueryResult(answer=NO_CONTEXT_ANSWER, retrieved_sources=[])
+        try:
+            async with semaphore:
+                generation_started = time.perf_counter()
+                answer = await generate_answer(messages)
+        except Exception as e:
+            print(f"❌ Errore LLM per la query {i}: {e}")
+            return BatchQueryResult(retrieved_sources=list(context.sources), prompt_tokens=context.prompt_tokens,
+                                    error=str(e))
+
+        if semantic_cache:
+            compute_ms = searched_ms / len(pending) + 1000 * (time.perf_counter() - generation_started)
+            semantic_cache.store(query_vectors[i], scope, answer, list(context.sources), compute_ms)
+        return BatchQueryResult(answer=answer, retrieved_sources=list(context.sources),
+                                prompt_tokens=context.prompt_tokens)
+
+    answers = await asyncio.gather(*[answer_one(i, hits) for i, hits in zip(pending, batch_results)])
+    for i, result in zip(pending, answers):
+        results[i] = result
+
+    return BatchQueryResponse(results=results)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit rate e latenza risparmiata dalla cache semantica."""
+    if not semantic_cache:
+        return {"enabled": False}
+    return {"enabled": True, **semantic_cache.stats()}
+
+@app.post("/cache/invalidate")
+async def cache_invalidate():
+    """
+    Svuota la cache semantica della replica che riceve la richiesta (chiamato
+    dalla pipeline dopo l'upload su Qdrant); le altre repliche si allineano
+    entro SEMANTIC_CACHE_CHECK_INTERVAL_S tramite watch_collection.
+    """
+    if semantic_cache:
+        semantic_cache.invalidate()
+    return {"status": "ok"}
+
 if __name__ == "__main__":
     import uvicorn
     # KServe si aspetta che ascoltiamo sulla 8080
@@ -0,0 +1,72 @@
+"""
+Prompt per l'LLM e risposte in streaming (Server-Sent Events), condivisi da
+rag_orchestrator e rag_api_local: i due servizi inviano all'LLM gli stessi
+messaggi e producono gli stessi eventi `sources` / `token` / `error` / `done`.
+"""
+import json
+from typing import List, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+
+# Modulo di primo livello nell'immagine dell'orchestrator, rag_orchestrator.rag_prompt
+# per rag_api_local (che importa i moduli condivisi dalla root del repository)
+if __package__:
+    from .context_builder import PromptContext, TokenCounter, build_context
+    from .rag_metrics import PROMPT_TOKENS, track_stage
+else:
+    from context_builder import PromptContext, TokenCounter, build_context
+    from rag_metrics import PROMPT_TOKENS, track_stage
+
+# Risposta quando la ricerca non restituisce contesto utile
+NO_CONTEXT_ANSWER = "Nessun documento rilevante trovato."
+
+
+def build_messages(query: str, context_text: str) -> List[dict]:
+    system_message = "Sei un assistente utile. Rispondi alla domanda usando solo il contesto fornito."
+    user_message = f"Contesto:{context_text}\n\nDomanda: {query}"
+
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_message}
+    ]
+
+
+def prepare_prompt(query: str, search_results, token_counter: TokenCounter) -> Tuple[PromptContext, List[dict]]:
+    """Contesto entro il budget di token e messaggi per l'LLM."""
+    with track_stage("prompt"):
+        context = build_context(search_results, token_counter)
+        messages = build_messages(query, context.text)
+        context.prompt_tokens = token_counter.count_messages(messages)
+    if context.text:
+        PROMPT_TOKENS.observe(context.prompt_tokens)
+        print(f"Prompt: {context.prompt_tokens} token ({context.blocks} blocchi da {context.chunks} chunk"
+              f"{', troncato' if context.truncated else ''})")
+    return context, messages
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def done_event(started: float, retrieved: float, finished: float, first_token_at: Optional[float],
+               context: PromptContext, tokens: int, **extra) -> str:
+    """Evento `done` con i tempi (da time.perf_counter) e i token della risposta."""
+    return sse_event("done", {
+        "retrieval_ms": 1000 * (retrieved - started),
+        **extra,
+        "time_to_first_token_ms": 1000 * (first_token_at - started) if first_token_at else None,
+        "generation_ms": 1000 * (finished - retrieved),
+        "total_ms": 1000 * (finished - started),
+        "prompt_tokens": context.prompt_tokens,
+        "tokens": tokens
+    })
+
+
+def sse_response(events) -> StreamingResponse:
+    """Risposta text/event-stream da un iteratore (sincrono o asincrono) di eventi."""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Disabilita il buffering di eventuali proxy (es. nginx) per non ritardare i token
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
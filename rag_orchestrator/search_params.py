@@ -0,0 +1,74 @@
+"""
+Parametri di accuratezza della ricerca vettoriale, condivisi da
+rag_orchestrator e rag_api_local.
+
+I default di deployment arrivano dalle variabili d'ambiente; ogni richiesta
+può sovrascriverli con `SearchOptions`:
+  - hnsw_ef:     ampiezza della ricerca HNSW (più alto = recall migliore, più lento)
+  - exact:       ricerca esatta senza indice (riferimento per la recall)
+  - oversampling / rescore: con collection quantizzate, recupera
+                 oversampling * top_k candidati con i vettori quantizzati e
+                 li riordina con i vettori originali
+"""
+import json
+import os
+from typing import Optional
+
+from pydantic import BaseModel
+from qdrant_client.models import QuantizationSearchParams, SearchParams
+
+
+class SearchOptions(BaseModel):
+    hnsw_ef: Optional[int] = None
+    exact: Optional[bool] = None
+    oversampling: Optional[float] = None
+    rescore: Optional[bool] = None
+
+
+_FIELDS = ("hnsw_ef", "exact", "oversampling", "rescore")
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.getenv(name, "")
+    return float(value) if value else None
+
+
+def _env_bool(name: str) -> Optional[bool]:
+    value = os.getenv(name, "")
+    return value.lower() in ("1", "true", "yes") if value else None
+
+
+# Default di deployment (variabile vuota = default di Qdrant)
+DEFAULT_SEARCH_OPTIONS = SearchOptions(
+    hnsw_ef=int(os.getenv("SEARCH_HNSW_EF", "0")) or None,
+    exact=_env_bool("SEARCH_EXACT"),
+    oversampling=_env_float("SEARCH_OVERSAMPLING"),
+    rescore=_env_bool("SEARCH_RESCORE"),
+)
+
+
+def resolve_search_options(options: Optional[SearchOptions]) -> SearchOptions:
+    """Opzioni della richiesta sovrapposte ai default di deployment."""
+    if options is None:
+        return DEFAULT_SEARCH_OPTIONS
+    return SearchOptions(**{
+        field: getattr(options, field) if getattr(options, field) is not None else getattr(DEFAULT_SEARCH_OPTIONS, field)
+        for field in _FIELDS
+    })
+
+
+def build_search_params(options: Optional[SearchOptions]) -> Optional[SearchParams]:
+    options = resolve_search_options(options)
+    quantization = None
+    if options.oversampling is not None or options.rescore is not None:
+        quantization = QuantizationSearchParams(oversampling=options.oversampling, rescore=options.rescore)
+    if options.hnsw_ef is None and options.exact is None and quantization is None:
+        return None
+    return SearchParams(hnsw_ef=options.hnsw_ef, exact=bool(options.exact), quantization=quantization)
+
+
+def search_scope(options: Optional[SearchOptions]) -> str:
+    """Rappresentazione canonica delle opzioni per la chiave della cache semantica."""
+    options = resolve_search_options(options)
+    values = {field: getattr(options, field) for field in _FIELDS if getattr(options, field) is not None}
+    return json.dumps(values, sort_keys=True, separators=(",", ":")) if values else ""
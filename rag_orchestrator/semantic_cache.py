@@ -0,0 +1,132 @@
+"""
+Cache semantica delle risposte del RAG orchestrator.
+
+Le risposte dell'LLM vengono indicizzate con l'embedding della query: una
+nuova query con similarità coseno >= threshold rispetto a una già servita
+(con lo stesso `scope`, es. top_k) riceve la risposta in cache, saltando
+sia la ricerca in Qdrant che la generazione.
+
+Vettori, scadenze, scope e ultimo utilizzo sono tenuti in array numpy
+paralleli: lookup e scelta dello slot da sovrascrivere sono operazioni
+vettoriali sulle righe occupate, senza cicli Python sulle voci.
+"""
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    sources: List[str]
+    scope: str
+    created_at: float
+    last_used: float
+    # Tempo (ms) di ricerca + generazione risparmiato a ogni hit
+    compute_ms: float
+
+
+class SemanticCache:
+    def __init__(self, max_entries: int = 1000, threshold: float = 0.95, ttl_s: float = 3600.0):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+
+        # Matrice dei vettori normalizzati, allocata al primo inserimento;
+        # le righe [0, _size) sono state occupate almeno una volta
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[CachedAnswer]] = [None] * max_entries
+        self._size = 0
+        # Per slot: inserimento (-inf = vuoto), ultimo utilizzo e hash dello scope
+        self._created_at = np.full(max_entries, -np.inf)
+        self._last_used = np.zeros(max_entries)
+        self._scope_hashes = np.zeros(max_entries, dtype=np.int64)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_ms = 0.0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _live(self, now: float) -> np.ndarray:
+        """Maschera degli slot occupati e non scaduti (righe [0, _size))."""
+        return now - self._created_at[:self._size] < self.ttl_s
+
+    def lookup(self, query_vector, scope: str) -> Optional[CachedAnswer]:
+        if self._size == 0:
+            self.misses += 1
+            return None
+
+        now = time.time()
+        similarities = self._vectors[:self._size] @ self._normalize(query_vector)
+        valid = self._live(now) & (self._scope_hashes[:self._size] == hash(scope))
+        similarities[~valid] = -np.inf
+
+        best = int(np.argmax(similarities))
+        entry = self._entries[best]
+        # Il confronto dello scope esclude eventuali collisioni di hash
+        if similarities[best] < self.threshold or entry.scope != scope:
+            self.misses += 1
+            return None
+
+        entry.last_used = now
+        self._last_used[best] = now
+        self.hits += 1
+        self.saved_ms += entry.compute_ms
+        return entry
+
+    def store(self, query_vector, scope: str, answer: str, sources: List[str], compute_ms: float):
+        vector = self._normalize(query_vector)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+        slot = self._free_slot()
+        now = time.time()
+        self._vectors[slot] = vector
+        self._entries[slot] = CachedAnswer(
+            answer=answer, sources=list(sources), scope=scope,
+            created_at=now, last_used=now, compute_ms=compute_ms
+        )
+        self._created_at[slot] = now
+        self._last_used[slot] = now
+        self._scope_hashes[slot] = hash(scope)
+
+    def _free_slot(self) -> int:
+        """Slot vuoto o scaduto; altrimenti evict della voce usata meno di recente."""
+        expired = np.flatnonzero(~self._live(time.time()))
+        if expired.size:
+            return int(expired[0])
+        if self._size < self.max_entries:
+            self._size += 1
+            return self._size - 1
+        self.evictions += 1
+        return int(np.argmin(self._last_used))
+
+    def invalidate(self):
+        """Svuota la cache (es. dopo una nuova ingestion della collection)."""
+        self._entries = [None] * self.max_entries
+        self._created_at.fill(-np.inf)
+        self._size = 0
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        now = time.time()
+        return {
+            "entries": int(self._live(now).sum()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "saved_latency_ms": self.saved_ms,
+            "avg_saved_latency_ms": self.saved_ms / self.hits if self.hits else 0.0,
+        }
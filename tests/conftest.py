@@ -0,0 +1,12 @@
+"""
+Configurazione comune dei test (dalla root del repository: `make test`).
+
+I moduli del model server e dell'orchestrator sono di primo livello nelle
+rispettive immagini, quindi li rendiamo importabili come nei container.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "kserve-embedding", "model_server"))
+sys.path.insert(0, os.path.join(ROOT, "rag_orchestrator"))
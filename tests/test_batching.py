@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import numpy as np
+
+from batching import MicroBatcher
+
+
+def encode_recording(calls):
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+    return encode
+
+
+def test_concurrent_requests_share_one_batch():
+    calls = []
+    batcher = MicroBatcher(encode_recording(calls), max_batch_size=8, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(
+            batcher.submit(["a"]), batcher.submit(["bb", "ccc"]), batcher.submit(["dddd"])
+        )
+
+    results = asyncio.run(run())
+
+    assert calls == [["a", "bb", "ccc", "dddd"]]
+    assert [r[:, 0].tolist() for r in results] == [[1.0], [2.0, 3.0], [4.0]]
+    assert batcher.stats()["batches"] == 1
+    assert batcher.stats()["requests"] == 3
+
+
+def test_flush_when_batch_is_full():
+    calls = []
+    batcher = MicroBatcher(encode_recording(calls), max_batch_size=3, max_wait_ms=1000)
+
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            batcher.submit(["a", "b"]), batcher.submit(["c"]), batcher.submit(["d", "e"])
+        )
+        return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(run())
+
+    # Il primo batch è pieno e parte subito; la richiesta che non entra apre il successivo
+    assert calls[0] == ["a", "b", "c"]
+    assert calls[1] == ["d", "e"]
+    assert [len(r) for r in results] == [2, 1, 2]
+    assert batcher.stats()["max_batch_size_seen"] == 3
+    # Solo l'ultimo batch (non pieno) attende max_wait_ms
+    assert elapsed < 2.0
+
+
+def test_flush_after_max_wait():
+    calls = []
+    batcher = MicroBatcher(encode_recording(calls), max_batch_size=32, max_wait_ms=20)
+
+    async def run():
+        first = asyncio.ensure_future(batcher.submit(["a"]))
+        await asyncio.sleep(0.2)
+        # Il primo batch è già partito allo scadere dell'attesa, senza riempirsi
+        assert first.done()
+        second = await batcher.submit(["b"])
+        return await first, second
+
+    first, second = asyncio.run(run())
+
+    assert calls == [["a"], ["b"]]
+    assert first[:, 0].tolist() == [1.0]
+    assert second[:, 0].tolist() == [1.0]
+
+
+def test_encode_error_reaches_every_caller():
+    def encode(texts):
+        raise RuntimeError("modello non disponibile")
+
+    batcher = MicroBatcher(encode, max_batch_size=8, max_wait_ms=20)
+
+    async def run():
+        return await asyncio.gather(batcher.submit(["a"]), batcher.submit(["b"]), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(r, RuntimeError) for r in results)
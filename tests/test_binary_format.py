@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from rag_pipeline.binary_format import (
+    decode_embeddings, encode_embeddings, is_binary_payload, requested_format
+)
+
+
+@pytest.mark.parametrize("fmt", ["f32", "f16"])
+def test_round_trip(fmt):
+    embeddings = np.random.default_rng(0).standard_normal((5, 384)).astype(np.float32)
+
+    payload = encode_embeddings(embeddings, fmt)
+    decoded = decode_embeddings(payload)
+
+    assert is_binary_payload(payload)
+    assert decoded.dtype == np.float32
+    assert decoded.shape == (5, 384)
+    np.testing.assert_allclose(decoded, embeddings, rtol=1e-3 if fmt == "f16" else 0, atol=1e-3 if fmt == "f16" else 0)
+
+
+def test_single_vector_is_one_row():
+    decoded = decode_embeddings(encode_embeddings(np.ones(8, dtype=np.float32)))
+
+    assert decoded.shape == (1, 8)
+
+
+def test_requested_format():
+    assert requested_format(None) == "json"
+    assert requested_format({"X-Embedding-Format": " F16 "}) == "f16"
+    assert requested_format({"x-embedding-format": "f32"}) == "f32"
+    assert requested_format({"X-Embedding-Format": "bf16"}) == "json"
+    assert not is_binary_payload(b'{"predictions": []}')
+
+
+def test_truncated_header():
+    with pytest.raises(ValueError, match="troncato"):
+        decode_embeddings(b"EMB1f")
+
+
+def test_wrong_magic_or_dtype():
+    payload = encode_embeddings(np.ones((2, 4), dtype=np.float32))
+
+    with pytest.raises(ValueError, match="non valido"):
+        decode_embeddings(b"EMB2" + payload[4:])
+    with pytest.raises(ValueError, match="non valido"):
+        decode_embeddings(payload[:4] + b"d" + payload[5:])
+
+
+@pytest.mark.parametrize("delta", [-1, 4])
+def test_data_length_mismatch(delta):
+    payload = encode_embeddings(np.ones((2, 4), dtype=np.float32))
+    payload = payload[:delta] if delta < 0 else payload + b"\0" * delta
+
+    with pytest.raises(ValueError, match="attesi"):
+        decode_embeddings(payload)
@@ -0,0 +1,75 @@
+import types
+
+from context_builder import CHUNK_SEPARATOR, TokenCounter, build_context, merge_chunks, overlap_length
+
+OVERLAP = "testo ripetuto tra due chunk consecutivi "
+
+
+def hit(source, chunk_id, content, **payload):
+    return types.SimpleNamespace(payload={"source": source, "chunk_id": chunk_id, "content": content, **payload})
+
+
+def test_overlap_length():
+    assert overlap_length("inizio " + OVERLAP, OVERLAP + "fine") == len(OVERLAP)
+    # Sovrapposizione più corta di MIN_OVERLAP_CHARS: non rilevata
+    assert overlap_length("inizio abc", "abc fine") == 0
+    # Testo condiviso che non è un suffisso di `previous`
+    assert overlap_length(OVERLAP + "altro", OVERLAP + "fine") == 0
+
+
+def test_overlap_length_prefers_longest_suffix():
+    previous = "x " + OVERLAP + OVERLAP
+    following = OVERLAP + OVERLAP + "fine"
+
+    assert overlap_length(previous, following) == 2 * len(OVERLAP)
+
+
+def test_merge_consecutive_chunks_without_repeating_overlap():
+    blocks = merge_chunks([
+        hit("a.pdf", 1, OVERLAP + "seconda parte"),
+        hit("a.pdf", 0, "prima parte " + OVERLAP),
+    ])
+
+    assert len(blocks) == 1
+    assert blocks[0]["text"] == "prima parte " + OVERLAP + "seconda parte"
+    assert [p["chunk_id"] for p in blocks[0]["payloads"]] == [0, 1]
+
+
+def test_merge_keeps_gaps_and_relevance_order():
+    blocks = merge_chunks([
+        hit("b.pdf", 5, "b cinque"),
+        hit("a.pdf", 0, "a zero"),
+        hit("a.pdf", 2, "a due"),
+        # Chunk consecutivo senza sovrapposizione: unito su una nuova riga
+        hit("a.pdf", 3, "a tre"),
+        # Stesso testo già recuperato (chunk deduplicato): ignorato
+        hit("c.pdf", 0, "b cinque"),
+    ])
+
+    assert [block["text"] for block in blocks] == ["b cinque", "a zero", "a due\na tre"]
+
+
+def test_build_context_within_budget():
+    counter = TokenCounter("")
+    results = [hit("a.pdf", 0, "x" * 400), hit("b.pdf", 0, "y" * 400, references=[{"source": "c.pdf", "chunk_id": 0}])]
+
+    context = build_context(results, counter, max_tokens=1000)
+
+    assert context.text == CHUNK_SEPARATOR + "x" * 400 + CHUNK_SEPARATOR + "y" * 400
+    assert context.blocks == 2
+    assert not context.truncated
+    assert context.sources == {"a.pdf", "b.pdf", "c.pdf"}
+    # Token contati per blocco
+    assert context.tokens == 2 * counter.count(CHUNK_SEPARATOR + "x" * 400)
+
+
+def test_build_context_truncates_last_block():
+    counter = TokenCounter("")
+    results = [hit("a.pdf", 0, "x" * 400), hit("b.pdf", 0, "y" * 400), hit("c.pdf", 0, "z" * 400)]
+
+    context = build_context(results, counter, max_tokens=150)
+
+    assert context.truncated
+    assert context.blocks == 2
+    assert context.tokens <= 150
+    assert context.sources == {"a.pdf", "b.pdf"}
@@ -0,0 +1,83 @@
+import pytest
+
+from rag_pipeline.dedup import deduplicate, normalize, word_trigrams
+from rag_pipeline.shards import ShardWriter, iter_records, read_manifest
+
+SOURCES = {"a.txt": {"status": "processed"}, "b.txt": {"status": "processed"}}
+
+
+def write_chunks(path, records, shard_size=2):
+    writer = ShardWriter(str(path), "chunks", shard_size, "gzip")
+    for source, chunk_id, content in records:
+        writer.write({"source": source, "chunk_id": chunk_id, "content": content})
+    writer.close(incremental=False, sources=SOURCES)
+
+
+def references(output):
+    return [
+        (record["content"], [(ref["source"], ref["chunk_id"]) for ref in record["references"]])
+        for record in iter_records(str(output))
+    ]
+
+
+def test_normalize_and_trigrams():
+    assert normalize("  Il  Gatto\nNERO ") == "il gatto nero"
+    assert word_trigrams("a b c d") == {"a b c", "b c d"}
+    assert word_trigrams("a b") == {"a b"}
+
+
+# run_size=1 scrive un run su disco per ogni duplicato: il merge li deve riunire
+@pytest.mark.parametrize("run_size", [1, 100000])
+def test_exact_merges_references_into_first_chunk(tmp_path, run_size):
+    write_chunks(tmp_path / "raw", [
+        ("a.txt", 0, "Primo paragrafo"),
+        ("a.txt", 1, "Secondo paragrafo"),
+        ("b.txt", 0, "secondo   PARAGRAFO"),
+        ("b.txt", 1, "Terzo paragrafo"),
+        ("b.txt", 2, "primo paragrafo"),
+        ("b.txt", 3, "Secondo paragrafo"),
+    ])
+
+    writer = deduplicate(str(tmp_path / "raw"), str(tmp_path / "out"), "exact", SOURCES,
+                         shard_size=2, compression="none", run_size=run_size)
+
+    assert writer.count == 3
+    assert references(tmp_path / "out") == [
+        ("Primo paragrafo", [("a.txt", 0), ("b.txt", 2)]),
+        ("Secondo paragrafo", [("a.txt", 1), ("b.txt", 0), ("b.txt", 3)]),
+        ("Terzo paragrafo", [("b.txt", 1)]),
+    ]
+    manifest = read_manifest(str(tmp_path / "out"))
+    assert manifest["count"] == 3
+    assert manifest["dedup"] == "exact"
+    assert manifest["incremental"] is False
+    assert manifest["sources"] == SOURCES
+    assert not any("_index" in record for record in iter_records(str(tmp_path / "out")))
+
+
+def test_minhash_merges_near_duplicates(tmp_path):
+    text = " ".join(f"parola{i}" for i in range(200))
+    write_chunks(tmp_path / "raw", [
+        ("a.txt", 0, text),
+        ("a.txt", 1, "un testo del tutto diverso dal primo chunk"),
+        # Una parola cambiata su 200: quasi-duplicato, non duplicato esatto
+        ("b.txt", 0, text.replace("parola100", "altro")),
+    ])
+
+    exact = deduplicate(str(tmp_path / "raw"), str(tmp_path / "exact"), "exact", SOURCES,
+                        shard_size=10, compression="none")
+    minhash = deduplicate(str(tmp_path / "raw"), str(tmp_path / "minhash"), "minhash", SOURCES,
+                          shard_size=10, compression="none", minhash_threshold=0.8)
+
+    assert exact.count == 3
+    assert minhash.count == 2
+    assert references(tmp_path / "minhash")[0][1] == [("a.txt", 0), ("b.txt", 0)]
+    assert read_manifest(str(tmp_path / "minhash"))["dedup"] == "minhash"
+
+
+def test_rejects_unknown_mode(tmp_path):
+    write_chunks(tmp_path / "raw", [("a.txt", 0, "testo")])
+
+    with pytest.raises(ValueError):
+        deduplicate(str(tmp_path / "raw"), str(tmp_path / "out"), "none", SOURCES,
+                    shard_size=10, compression="none")
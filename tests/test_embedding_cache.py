@@ -0,0 +1,59 @@
+import numpy as np
+
+from embedding_cache import _ENTRY_OVERHEAD, EmbeddingCache
+
+
+def vectors(n, dim=4):
+    return np.arange(n * dim, dtype=np.float32).reshape(n, dim)
+
+
+def test_only_misses_are_returned_as_none():
+    cache = EmbeddingCache("modello@rev/torch")
+    cache.put_many(["a", "b"], vectors(2))
+
+    results = cache.get_many(["a", "c", "b"])
+
+    np.testing.assert_array_equal(results[0], vectors(2)[0])
+    assert results[1] is None
+    np.testing.assert_array_equal(results[2], vectors(2)[1])
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_namespace_separates_models():
+    torch_cache = EmbeddingCache("modello@rev/torch")
+    onnx_cache = EmbeddingCache("modello@rev/onnx")
+
+    assert torch_cache._key("a") != onnx_cache._key("a")
+
+
+def test_evicts_least_recently_used_entry():
+    cache = EmbeddingCache("m", max_entries=2)
+    cache.put_many(["a", "b"], vectors(2))
+    cache.get_many(["a"])
+
+    cache.put_many(["c"], vectors(1))
+
+    assert [v is not None for v in cache.get_many(["a", "b", "c"])] == [True, False, True]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_memory_budget():
+    entry_bytes = vectors(1).nbytes + _ENTRY_OVERHEAD
+    cache = EmbeddingCache("m", max_entries=100, max_bytes=3 * entry_bytes)
+
+    cache.put_many([str(i) for i in range(5)], vectors(5))
+
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["bytes"] == 3 * entry_bytes
+    assert cache.stats()["evictions"] == 2
+
+
+def test_cached_vectors_do_not_keep_the_batch_alive():
+    cache = EmbeddingCache("m")
+    batch = vectors(2)
+
+    cache.put_many(["a", "b"], batch)
+    batch[:] = 0
+
+    assert cache.get_many(["a"])[0].any()
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+# engines.py importa sentence-transformers (requirements del model server)
+engines = pytest.importorskip("engines")
+
+
+def test_max_cosine_distance_ignores_norm():
+    reference = np.array([[1.0, 0.0], [0.0, 1.0]])
+
+    assert engines.max_cosine_distance(reference, 3 * reference) == pytest.approx(0.0, abs=1e-7)
+
+
+def test_max_cosine_distance_is_worst_row():
+    reference = np.array([[1.0, 0.0], [0.0, 1.0]])
+    candidate = np.array([[1.0, 0.0], [1.0, 1.0]])
+
+    assert engines.max_cosine_distance(reference, candidate) == pytest.approx(1 - np.sqrt(0.5))
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError, match="non supportato"):
+        engines.build_model("tensorrt", "modello", "/tmp")
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from rag_pipeline.matrix import MatrixWriter
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_header_rewritten_with_actual_rows(tmp_path, dtype):
+    path = str(tmp_path / "embeddings.npy")
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    # Capacità con più cifre del numero reale di righe
+    writer = MatrixWriter(path, capacity=1000, dtype=dtype)
+
+    rows = [writer.write(vector) for vector in vectors]
+    writer.close()
+
+    matrix = np.load(path, mmap_mode="r")
+    assert rows == [0, 1, 2]
+    assert matrix.shape == (3, 4)
+    assert matrix.dtype == np.dtype(dtype)
+    np.testing.assert_array_equal(matrix, vectors.astype(dtype))
+    # Il file è troncato alle righe scritte
+    assert (tmp_path / "embeddings.npy").stat().st_size == matrix.offset + vectors.astype(dtype).nbytes
+
+
+def test_full_capacity(tmp_path):
+    path = str(tmp_path / "embeddings.npy")
+    writer = MatrixWriter(path, capacity=2, dtype="float32")
+
+    writer.write([1.0, 2.0])
+    writer.write([3.0, 4.0])
+    writer.close()
+
+    np.testing.assert_array_equal(np.load(path), [[1.0, 2.0], [3.0, 4.0]])
+
+
+def test_no_rows(tmp_path):
+    path = str(tmp_path / "embeddings.npy")
+    writer = MatrixWriter(path, capacity=0, dtype="float16")
+
+    writer.close()
+
+    matrix = np.load(path)
+    assert matrix.shape == (0, 0)
+    assert matrix.dtype == np.float16
@@ -0,0 +1,129 @@
+import asyncio
+import types
+
+import numpy as np
+import pytest
+
+from semantic_cache import SemanticCache
+
+
+def unit(index, dim=4):
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[index] = 1.0
+    return vector
+
+
+def test_hit_above_threshold():
+    cache = SemanticCache(max_entries=4, threshold=0.9)
+    cache.store(unit(0), "top_k=3", "risposta", ["a.pdf"], compute_ms=120.0)
+
+    # Stessa direzione, norma diversa
+    entry = cache.lookup(3 * unit(0) + 0.1 * unit(1), "top_k=3")
+
+    assert entry.answer == "risposta"
+    assert entry.sources == ["a.pdf"]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["saved_latency_ms"] == 120.0
+
+
+def test_miss_below_threshold_or_other_scope():
+    cache = SemanticCache(max_entries=4, threshold=0.9)
+    assert cache.lookup(unit(0), "top_k=3") is None
+
+    cache.store(unit(0), "top_k=3", "risposta", [], compute_ms=0.0)
+
+    assert cache.lookup(unit(1), "top_k=3") is None
+    assert cache.lookup(unit(0), "top_k=5") is None
+    assert cache.stats()["misses"] == 3
+    assert cache.stats()["hit_rate"] == 0.0
+
+
+def test_expired_entries_miss(monkeypatch):
+    cache = SemanticCache(max_entries=4, threshold=0.9, ttl_s=10.0)
+    now = [1000.0]
+    monkeypatch.setattr("semantic_cache.time.time", lambda: now[0])
+    cache.store(unit(0), "", "risposta", [], compute_ms=0.0)
+
+    now[0] += 11.0
+
+    assert cache.lookup(unit(0), "") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_evicts_least_recently_used(monkeypatch):
+    cache = SemanticCache(max_entries=2, threshold=0.9)
+    now = [1000.0]
+    monkeypatch.setattr("semantic_cache.time.time", lambda: now[0])
+    cache.store(unit(0), "", "zero", [], compute_ms=0.0)
+    now[0] += 1
+    cache.store(unit(1), "", "uno", [], compute_ms=0.0)
+    now[0] += 1
+    assert cache.lookup(unit(0), "").answer == "zero"
+    now[0] += 1
+
+    cache.store(unit(2), "", "due", [], compute_ms=0.0)
+
+    assert cache.stats()["evictions"] == 1
+    assert cache.lookup(unit(1), "") is None
+    assert cache.lookup(unit(0), "").answer == "zero"
+    assert cache.lookup(unit(2), "").answer == "due"
+
+
+def test_invalidate_empties_the_cache():
+    cache = SemanticCache(max_entries=4, threshold=0.9)
+    cache.store(unit(0), "", "risposta", [], compute_ms=0.0)
+
+    cache.invalidate()
+
+    assert cache.lookup(unit(0), "") is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["invalidations"] == 1
+
+
+class RevisionQdrant:
+    """Qdrant simulato: la collection cambia solo di revisione."""
+
+    def __init__(self):
+        self.revision = "r1"
+
+    async def get_collection(self, name):
+        return types.SimpleNamespace(points_count=10)
+
+    async def get_aliases(self):
+        return types.SimpleNamespace(aliases=[])
+
+    async def retrieve(self, collection_name, ids, with_payload):
+        return [types.SimpleNamespace(payload={"revision": self.revision})]
+
+
+@pytest.fixture
+def orchestrator(monkeypatch):
+    import rag_orchestrator
+    monkeypatch.setattr(rag_orchestrator, "qdrant_client", RevisionQdrant())
+    monkeypatch.setattr(rag_orchestrator, "semantic_cache", SemanticCache(max_entries=4, threshold=0.9))
+    monkeypatch.setattr(rag_orchestrator, "SEMANTIC_CACHE_CHECK_INTERVAL_S", 0.01)
+    return rag_orchestrator
+
+
+def test_new_revision_invalidates(orchestrator):
+    cache = orchestrator.semantic_cache
+
+    async def run():
+        watcher = asyncio.ensure_future(orchestrator.watch_collection())
+        try:
+            await asyncio.sleep(0.05)
+            # Stessi punti e stessa revisione: la cache resta valida
+            cache.store(unit(0), "", "risposta", [], compute_ms=0.0)
+            await asyncio.sleep(0.05)
+            assert cache.lookup(unit(0), "") is not None
+
+            # Upload che sostituisce i chunk senza variare il numero di punti
+            orchestrator.qdrant_client.revision = "r2"
+            await asyncio.sleep(0.05)
+        finally:
+            watcher.cancel()
+
+    asyncio.run(run())
+
+    assert cache.stats()["invalidations"] == 1
+    assert cache.lookup(unit(0), "") is None
@@ -0,0 +1,40 @@
+import json
+
+from rag_pipeline.shards import ShardWriter, iter_records, point_id, read_manifest
+
+
+def test_rotates_shards_and_writes_manifest(tmp_path):
+    writer = ShardWriter(str(tmp_path), "chunks", shard_size=2, compression="gzip")
+    records = [{"source": "a.pdf", "chunk_id": i, "content": f"testo è {i}"} for i in range(5)]
+
+    for record in records:
+        writer.write(record)
+    writer.close(incremental=True, sources={"a.pdf": {"status": "processed"}})
+
+    manifest = read_manifest(str(tmp_path))
+    assert manifest["shards"] == ["chunks-00000.jsonl.gz", "chunks-00001.jsonl.gz", "chunks-00002.jsonl.gz"]
+    assert manifest["count"] == 5
+    assert manifest["incremental"] is True
+    assert list(iter_records(str(tmp_path))) == records
+
+
+def test_uncompressed_shards(tmp_path):
+    writer = ShardWriter(str(tmp_path), "metadata", shard_size=10, compression="none")
+    writer.write({"row": 0})
+    writer.close()
+
+    assert read_manifest(str(tmp_path))["shards"] == ["metadata-00000.jsonl"]
+    assert json.loads((tmp_path / "metadata-00000.jsonl").read_text()) == {"row": 0}
+
+
+def test_empty_artifact(tmp_path):
+    ShardWriter(str(tmp_path), "chunks", shard_size=10, compression="gzip").close()
+
+    assert read_manifest(str(tmp_path))["count"] == 0
+    assert list(iter_records(str(tmp_path))) == []
+
+
+def test_point_id_is_stable_per_chunk():
+    assert point_id("a.pdf", 0) == point_id("a.pdf", 0)
+    assert point_id("a.pdf", 0) != point_id("a.pdf", 1)
+    assert len(point_id("a.pdf", 0)) == 32